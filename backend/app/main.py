@@ -2,13 +2,10 @@
 Main Flask application with configuration, logging, and error handlers.
 """
 import os
-import json
 import logging
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
 
 # Import VRContextWorkflow - handle both local and Docker paths
 import sys
@@ -25,6 +22,24 @@ except ImportError:
     sys.path.insert(0, '/app')
     from llm import VRContextWorkflow
 
+from app.utils.image_processing import ResizePolicy
+from app.utils.foveation import FoveationPolicy
+from app.utils.response_cache import ResponseCache
+from app.utils.singleflight import SingleFlight
+from app.utils.health import UpstreamHealthMonitor, gemini_probe, speech_probe
+from app.utils.resilience import Resilience
+from app.utils.hedging import HedgePolicy
+from app.utils.prompts import prompt_registry
+from app.utils.session_store import create_session_store
+from app.utils.capture import CaptureRecorder, install_capture
+from app.utils.clients import use_fake_backends
+from app.utils.fakes import FaultInjector, fake_probe
+from app.utils.metrics import metrics, install_metrics
+from app.utils.tracing import (
+    BatchSpanProcessor, FileSpanExporter, OTLPHttpSpanExporter, configure_tracing, install_tracing
+)
+from app.utils.log_pipeline import JSONFormatter, configure_logging, parse_rates, start_request_sampling
+
 # Load environment variables
 load_dotenv()
 
@@ -36,65 +51,105 @@ class Config:
     API_KEY = os.getenv('API_KEY')
     FLASK_ENV = os.getenv('FLASK_ENV', 'production')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')  # per level below/above LOG_LEVEL, e.g. DEBUG=0.01
+    LOG_MESSAGE_SAMPLE_RATES = os.getenv('LOG_MESSAGE_SAMPLE_RATES', '')  # per sample_key, e.g. model_payload=0.01
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # records buffered before dropping
     MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', 5 * 1024 * 1024))  # 5MB default
+    BATCH_MAX_FRAMES = int(os.getenv('BATCH_MAX_FRAMES', 4))  # snapshots per /assist/batch request
     IMAGE_COMPRESSION_SIZE = tuple(map(int, os.getenv('IMAGE_COMPRESSION_SIZE', '768,768').split(',')))
+    IMAGE_MAX_TILES = int(os.getenv('IMAGE_MAX_TILES', 1))  # 768x768 vision tiles, 0 = no tile budget
+    IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG')  # JPEG or WEBP
+    IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+    IMAGE_MIN_QUALITY = int(os.getenv('IMAGE_MIN_QUALITY', 40))
+    IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 256 * 1024))  # 0 = no byte budget
     SESSION_TIMEOUT_HOURS = int(os.getenv('SESSION_TIMEOUT_HOURS', 24))
     CONTEXT_DIR = os.getenv('CONTEXT_DIR', 'contexts')
-
-
-class JSONFormatter(logging.Formatter):
-    """Custom JSON formatter for structured logging."""
-    
-    def format(self, record):
-        log_data = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'level': record.levelname,
-            'message': record.getMessage(),
-            'module': record.module,
-            'function': record.funcName,
-            'line': record.lineno
-        }
-        
-        # Add extra fields if present
-        if hasattr(record, 'session_id'):
-            log_data['session_id'] = record.session_id
-        if hasattr(record, 'endpoint'):
-            log_data['endpoint'] = record.endpoint
-        if hasattr(record, 'task'):
-            log_data['task'] = record.task
-        if hasattr(record, 'step'):
-            log_data['step'] = record.step
-        if hasattr(record, 'duration_ms'):
-            log_data['duration_ms'] = record.duration_ms
-        if hasattr(record, 'status'):
-            log_data['status'] = record.status
-        
-        # Add exception info if present
-        if record.exc_info:
-            log_data['exception'] = self.formatException(record.exc_info)
-        
-        return json.dumps(log_data)
+    SESSION_STORE_BACKEND = os.getenv('SESSION_STORE_BACKEND', 'json')  # json or sqlite
+    SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH')  # SQLite file, default {CONTEXT_DIR}/sessions.db
+    SESSION_CACHE_ENTRIES = int(os.getenv('SESSION_CACHE_ENTRIES', 1024))  # 0 = no in-process cache
+    SESSION_SQLITE_POOL_SIZE = int(os.getenv('SESSION_SQLITE_POOL_SIZE', 8))  # idle SQLite connections kept for reuse
+    FOLLOW_UP_LOG_COMPACT_AT = int(os.getenv('FOLLOW_UP_LOG_COMPACT_AT', 500))  # JSON backend
+    FOLLOW_UP_LOG_KEEP = int(os.getenv('FOLLOW_UP_LOG_KEEP', 100))  # JSON backend
+    ASK_FOLLOW_UP_HISTORY = int(os.getenv('ASK_FOLLOW_UP_HISTORY', 5))  # earlier follow-ups in the /ask prompt
+    SESSION_HISTORY_STEPS = int(os.getenv('SESSION_HISTORY_STEPS', 5))  # earlier /assist steps kept in full in the prompt
+    SESSION_SUMMARY_CHARS = int(os.getenv('SESSION_SUMMARY_CHARS', 600))  # running summary of older steps
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256))
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 120))
+    RESPONSE_CACHE_HAMMING_THRESHOLD = int(os.getenv('RESPONSE_CACHE_HAMMING_THRESHOLD', 6))
+    RESPONSE_CACHE_GAZE_STEP = float(os.getenv('RESPONSE_CACHE_GAZE_STEP', 0.1))
+    HEALTH_MONITOR_ENABLED = os.getenv('HEALTH_MONITOR_ENABLED', 'true').lower() == 'true'
+    HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv('HEALTH_PROBE_INTERVAL_SECONDS', 60))
+    HEALTH_ERROR_WINDOW_SECONDS = float(os.getenv('HEALTH_ERROR_WINDOW_SECONDS', 300))
+    HEALTH_ERROR_RATE_THRESHOLD = float(os.getenv('HEALTH_ERROR_RATE_THRESHOLD', 0.5))
+    HEALTH_MIN_REQUESTS = int(os.getenv('HEALTH_MIN_REQUESTS', 5))
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+    LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', 3))
+    LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', 0.5))
+    LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', 8))
+    LLM_RETRY_BUDGET_RATIO = float(os.getenv('LLM_RETRY_BUDGET_RATIO', 0.2))  # retries per request
+    LLM_RETRY_BUDGET_MIN = int(os.getenv('LLM_RETRY_BUDGET_MIN', 10))  # retries always allowed per window
+    LLM_RETRY_BUDGET_WINDOW_SECONDS = float(os.getenv('LLM_RETRY_BUDGET_WINDOW_SECONDS', 10))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_RECOVERY_SECONDS = float(os.getenv('CIRCUIT_RECOVERY_SECONDS', 30))
+    ASSIST_DEADLINE_SECONDS = float(os.getenv('ASSIST_DEADLINE_SECONDS', 10))  # without X-Request-Deadline
+    ASK_DEADLINE_SECONDS = float(os.getenv('ASK_DEADLINE_SECONDS', 12))  # without X-Request-Deadline
+    MAX_REQUEST_DEADLINE_SECONDS = float(os.getenv('MAX_REQUEST_DEADLINE_SECONDS', 30))
+    DEADLINE_MIN_GENERATION_SECONDS = float(os.getenv('DEADLINE_MIN_GENERATION_SECONDS', 0.5))  # don't start Gemini with less
+    HEDGING_ENABLED = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.95))  # hedge after this latency percentile
+    HEDGE_BUDGET_RATIO = float(os.getenv('HEDGE_BUDGET_RATIO', 0.05))  # extra calls per request
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_MIN_DELAY_SECONDS = float(os.getenv('HEDGE_MIN_DELAY_SECONDS', 0.5))
+    HEDGE_MAX_CALL_SECONDS = float(os.getenv('HEDGE_MAX_CALL_SECONDS', 15))  # RPC timeout per hedged call; a losing call runs until then
+    FOVEATION_ENABLED = os.getenv('FOVEATION_ENABLED', 'false').lower() == 'true'  # more detail at the gaze point for 2 tiles instead of 1
+    FOVEATION_CAMERA_FOV = tuple(map(float, os.getenv('FOVEATION_CAMERA_FOV', '80,80').split(',')))  # degrees
+    FOVEATION_CROP_FRACTION = float(os.getenv('FOVEATION_CROP_FRACTION', 0.35))
+    FOVEATION_FOVEA_SIZE = tuple(map(int, os.getenv('FOVEATION_FOVEA_SIZE', '384,384').split(',')))
+    FOVEATION_CONTEXT_SIZE = tuple(map(int, os.getenv('FOVEATION_CONTEXT_SIZE', '384,384').split(',')))
+    UPSTREAM_BACKEND = os.getenv('UPSTREAM_BACKEND', 'google')  # google or fake (in-process stand-ins)
+    FAKE_GEMINI_LATENCY = os.getenv('FAKE_GEMINI_LATENCY', 'lognormal:1.5,0.4')  # see fakes.parse_latency
+    FAKE_STT_LATENCY = os.getenv('FAKE_STT_LATENCY', 'lognormal:0.8,0.3')
+    FAKE_RATE_LIMIT_RATE = float(os.getenv('FAKE_RATE_LIMIT_RATE', 0))  # fraction of calls failing with 429
+    FAKE_TIMEOUT_RATE = float(os.getenv('FAKE_TIMEOUT_RATE', 0))  # fraction of calls hanging until timeout
+    FAKE_MALFORMED_RATE = float(os.getenv('FAKE_MALFORMED_RATE', 0))  # fraction of truncated/empty outputs
+    FAKE_TIMEOUT_SECONDS = float(os.getenv('FAKE_TIMEOUT_SECONDS', 30))
+    FAKE_SEED = int(os.environ['FAKE_SEED']) if os.getenv('FAKE_SEED') else None
+    CAPTURE_ENABLED = os.getenv('CAPTURE_ENABLED', 'false').lower() == 'true'
+    CAPTURE_DIR = os.getenv('CAPTURE_DIR', 'replay_corpus')
+    CAPTURE_MAX_ENTRIES = int(os.getenv('CAPTURE_MAX_ENTRIES', 1000))  # 0 = no limit
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # Prometheus /metrics
+    TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')  # none, file or otlp
+    TRACING_FILE = os.getenv('TRACING_FILE', 'traces/spans.jsonl')  # OTLP/JSON lines
+    TRACING_OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACING_SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'lucid-backend')
 
 
 def setup_logging(app):
-    """Set up JSON logging for the application."""
-    # Remove default handlers
-    app.logger.handlers.clear()
-    
-    # Create console handler with JSON formatter
-    handler = logging.StreamHandler()
-    handler.setFormatter(JSONFormatter())
+    """
+    Set up JSON logging for the application.
     
-    # Set log level
+    Records go through a queue to a listener thread that formats and writes
+    them, so request threads never block on stdout (see log_pipeline).
+    """
     log_level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
-    handler.setLevel(log_level)
-    app.logger.setLevel(log_level)
+    level_rates = {
+        logging.getLevelName(name.upper()): rate for name, rate in parse_rates(Config.LOG_SAMPLE_RATES).items()
+    }
+    configure_logging(
+        level=log_level,
+        level_rates=level_rates,
+        message_rates=parse_rates(Config.LOG_MESSAGE_SAMPLE_RATES),
+        queue_size=Config.LOG_QUEUE_SIZE
+    )
     
-    # Add handler to app logger
-    app.logger.addHandler(handler)
+    # The app logger goes through the root logger's queue handler
+    app.logger.handlers.clear()
+    app.logger.setLevel(logging.NOTSET)
+    app.logger.propagate = True
     
-    # Prevent propagation to avoid duplicate logs
-    app.logger.propagate = False
+    # One sampling decision per request, so sampled requests log completely
+    app.before_request(start_request_sampling)
 
 
 def create_app():
@@ -105,14 +160,137 @@ def create_app():
     # Set up JSON logging
     setup_logging(app)
     
+    # Session context storage shared by /assist and /ask
+    app.session_store = create_session_store(
+        backend=Config.SESSION_STORE_BACKEND,
+        context_dir=Config.CONTEXT_DIR,
+        db_path=Config.SESSION_STORE_PATH,
+        cache_entries=Config.SESSION_CACHE_ENTRIES,
+        follow_up_compact_at=Config.FOLLOW_UP_LOG_COMPACT_AT,
+        follow_up_keep=Config.FOLLOW_UP_LOG_KEEP,
+        sqlite_pool_size=Config.SESSION_SQLITE_POOL_SIZE
+    )
+    
+    # Circuit breakers, backoff and retry budget shared by every model call
+    app.resilience = Resilience(
+        max_attempts=Config.LLM_MAX_ATTEMPTS,
+        base_delay=Config.LLM_BACKOFF_BASE_SECONDS,
+        max_delay=Config.LLM_BACKOFF_MAX_SECONDS,
+        failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+        recovery_seconds=Config.CIRCUIT_RECOVERY_SECONDS,
+        retry_budget_ratio=Config.LLM_RETRY_BUDGET_RATIO,
+        retry_budget_min=Config.LLM_RETRY_BUDGET_MIN,
+        retry_budget_window_seconds=Config.LLM_RETRY_BUDGET_WINDOW_SECONDS
+    )
+    
+    # Hedge slow /assist generations with a second call (opt-in)
+    if Config.HEDGING_ENABLED:
+        app.hedging = HedgePolicy(
+            percentile=Config.HEDGE_PERCENTILE,
+            budget_ratio=Config.HEDGE_BUDGET_RATIO,
+            min_samples=Config.HEDGE_MIN_SAMPLES,
+            min_delay=Config.HEDGE_MIN_DELAY_SECONDS,
+            max_call_seconds=Config.HEDGE_MAX_CALL_SECONDS
+        )
+    else:
+        app.hedging = None
+    
+    # Offline stand-ins for Gemini and Speech-to-Text, with latency and fault injection
+    if Config.UPSTREAM_BACKEND == 'fake':
+        fault_rates = dict(
+            rate_limit_rate=Config.FAKE_RATE_LIMIT_RATE,
+            timeout_rate=Config.FAKE_TIMEOUT_RATE,
+            malformed_rate=Config.FAKE_MALFORMED_RATE,
+            timeout_seconds=Config.FAKE_TIMEOUT_SECONDS
+        )
+        use_fake_backends(
+            FaultInjector(Config.FAKE_GEMINI_LATENCY, seed=Config.FAKE_SEED, **fault_rates),
+            FaultInjector(Config.FAKE_STT_LATENCY, seed=Config.FAKE_SEED, **fault_rates)
+        )
+        app.logger.warning('Using fake Gemini and Speech-to-Text backends (UPSTREAM_BACKEND=fake)')
+    
+    # Validate prompt templates now rather than on the first request
+    prompt_hashes = prompt_registry.compile()
+    app.logger.info(f'Prompt templates compiled: {prompt_hashes}')
+    
     # Initialize VRContextWorkflow
     if Config.GEMINI_API_KEY:
-        app.workflow = VRContextWorkflow(api_key=Config.GEMINI_API_KEY)
+        app.workflow = VRContextWorkflow(api_key=Config.GEMINI_API_KEY, session_store=app.session_store,
+                                         resilience=app.resilience, hedging=app.hedging,
+                                         max_context_history=Config.SESSION_HISTORY_STEPS,
+                                         max_summary_chars=Config.SESSION_SUMMARY_CHARS)
         app.logger.info('VRContextWorkflow initialized')
     else:
         app.logger.warning('GEMINI_API_KEY not set, workflow not initialized')
         app.workflow = None
     
+    # Resolution, format and byte budget for snapshots sent to Gemini
+    app.resize_policy = ResizePolicy(
+        target_size=Config.IMAGE_COMPRESSION_SIZE,
+        max_tiles=Config.IMAGE_MAX_TILES,
+        output_format=Config.IMAGE_OUTPUT_FORMAT,
+        quality=Config.IMAGE_QUALITY,
+        min_quality=Config.IMAGE_MIN_QUALITY,
+        max_bytes=Config.IMAGE_MAX_BYTES
+    )
+    
+    # Low-resolution context frame plus a high-resolution crop at the gaze point
+    if Config.FOVEATION_ENABLED:
+        app.foveation = FoveationPolicy(
+            fov_degrees=Config.FOVEATION_CAMERA_FOV,
+            crop_fraction=Config.FOVEATION_CROP_FRACTION,
+            fovea_size=Config.FOVEATION_FOVEA_SIZE,
+            context_size=Config.FOVEATION_CONTEXT_SIZE,
+            output_format=Config.IMAGE_OUTPUT_FORMAT,
+            quality=Config.IMAGE_QUALITY
+        )
+    else:
+        app.foveation = None
+    
+    # Cache of /assist results for near-duplicate snapshots
+    if Config.RESPONSE_CACHE_ENABLED:
+        app.response_cache = ResponseCache(
+            max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=Config.RESPONSE_CACHE_TTL_SECONDS,
+            hamming_threshold=Config.RESPONSE_CACHE_HAMMING_THRESHOLD,
+            gaze_step=Config.RESPONSE_CACHE_GAZE_STEP
+        )
+    else:
+        app.response_cache = None
+    
+    # Cached upstream health from background probes and real traffic
+    app.upstream_monitor = UpstreamHealthMonitor(
+        probes=upstream_probes(),
+        interval_seconds=Config.HEALTH_PROBE_INTERVAL_SECONDS,
+        window_seconds=Config.HEALTH_ERROR_WINDOW_SECONDS,
+        error_rate_threshold=Config.HEALTH_ERROR_RATE_THRESHOLD,
+        min_requests=Config.HEALTH_MIN_REQUESTS
+    )
+    if Config.HEALTH_MONITOR_ENABLED and Config.GEMINI_API_KEY:
+        app.upstream_monitor.start()
+    
+    # Coalesce concurrent duplicate /assist and /ask requests
+    app.single_flight = SingleFlight() if Config.SINGLE_FLIGHT_ENABLED else None
+    
+    # Record real requests into a replay corpus for replay.py (opt-in)
+    if Config.CAPTURE_ENABLED:
+        app.capture = CaptureRecorder(Config.CAPTURE_DIR, max_entries=Config.CAPTURE_MAX_ENTRIES)
+        install_capture(app, app.capture)
+        app.logger.warning(f'Request capture enabled, writing to {Config.CAPTURE_DIR}')
+    else:
+        app.capture = None
+    
+    # Per-stage latency histograms and component counters at /metrics
+    if Config.METRICS_ENABLED:
+        install_metrics(app)
+    
+    # Trace spans per request and stage, exported as OTLP/JSON (opt-in)
+    span_processor = create_span_processor()
+    configure_tracing(span_processor)
+    if span_processor is not None:
+        install_tracing(app)
+        app.logger.info(f'Tracing enabled, exporting to {Config.TRACING_EXPORTER}')
+    
     # Register error handlers
     register_error_handlers(app)
     
@@ -127,6 +305,26 @@ def create_app():
     return app
 
 
+def create_span_processor():
+    """Span processor for the configured exporter, or None when tracing is off."""
+    if Config.TRACING_EXPORTER == 'file':
+        exporter = FileSpanExporter(Config.TRACING_FILE)
+    elif Config.TRACING_EXPORTER == 'otlp':
+        exporter = OTLPHttpSpanExporter(Config.TRACING_OTLP_ENDPOINT)
+    else:
+        return None
+    return BatchSpanProcessor(exporter, service_name=Config.TRACING_SERVICE_NAME)
+
+
+def upstream_probes() -> dict:
+    """Background health probes for the configured upstreams."""
+    if not Config.GEMINI_API_KEY:
+        return {}
+    if Config.UPSTREAM_BACKEND == 'fake':
+        return {'gemini': fake_probe, 'speech': fake_probe}
+    return {'gemini': gemini_probe(Config.GEMINI_API_KEY), 'speech': speech_probe()}
+
+
 def register_error_handlers(app):
     """Register error handlers for common HTTP status codes."""
     
@@ -208,40 +406,74 @@ def register_routes(app):
     from app.routes.ask import register_ask_route
     register_ask_route(app)
     
+    @app.route('/livez', methods=['GET'])
+    def livez():
+        """
+        Liveness probe. Answers as long as the process is serving requests.
+        """
+        return jsonify({'status': 'alive'}), 200
+    
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        """
+        Readiness probe. Returns 200 once the app is configured to serve
+        /assist, 503 otherwise. Never calls an upstream.
+        """
+        if not Config.GEMINI_API_KEY or getattr(app, 'workflow', None) is None:
+            return jsonify({'status': 'not_ready', 'reason': 'Workflow not initialized'}), 503
+        
+        return jsonify({'status': 'ready'}), 200
+    
+    if Config.METRICS_ENABLED:
+        @app.route('/metrics', methods=['GET'])
+        def prometheus_metrics():
+            """
+            Metrics in the Prometheus text format: per-stage and per-request
+            latency histograms, requests in flight, retries, model output
+            parse failures, cache hits and circuit breaker states.
+            """
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    
     @app.route('/health', methods=['GET'])
     def health():
         """
-        Health check endpoint that tests Gemini API connectivity.
-        Returns 200 if healthy, 503 if Gemini API is unreachable.
+        Upstream health from the cached monitor state.
+        Returns 200 if healthy, 503 if the Gemini API is down.
+        
+        Upstreams are probed in the background, and real traffic error rates
+        are included, so this endpoint never makes a Gemini call itself.
         """
-        try:
-            # Quick Gemini API connectivity check
-            if not Config.GEMINI_API_KEY:
-                raise ValueError("GEMINI_API_KEY not configured")
-            
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=Config.GEMINI_API_KEY,
-                temperature=0
-            )
-            
-            # Simple test invocation
-            llm.invoke([HumanMessage(content="test")])
-            
-            app.logger.info('Health check passed')
-            
+        if not Config.GEMINI_API_KEY:
+            app.logger.error('Health check failed: GEMINI_API_KEY not configured')
             return jsonify({
-                'status': 'healthy',
+                'status': 'unhealthy',
+                'error': 'GEMINI_API_KEY not configured',
                 'timestamp': datetime.utcnow().isoformat() + 'Z'
-            }), 200
-            
-        except Exception as e:
-            app.logger.error(f'Health check failed: {str(e)}', exc_info=True)
+            }), 503
+        
+        upstreams = app.upstream_monitor.snapshot()
+        gemini = upstreams.get('gemini', {'status': 'unknown'})
+        
+        if gemini['status'] == 'down':
+            error = (gemini.get('last_probe') or {}).get('error') or 'Gemini API unreachable'
             return jsonify({
                 'status': 'unhealthy',
-                'error': str(e),
+                'error': error,
+                'upstreams': upstreams,
                 'timestamp': datetime.utcnow().isoformat() + 'Z'
             }), 503
+        
+        body = {
+            'status': 'degraded' if gemini['status'] == 'degraded' else 'healthy',
+            'upstreams': upstreams,
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        }
+        if app.hedging is not None:
+            body['hedging'] = app.hedging.stats()
+        if getattr(app, 'workflow', None) is not None:
+            body['model_output'] = app.workflow.parse_stats.snapshot()
+        
+        return jsonify(body), 200
 
 
 # Create the Flask app instance
@@ -1,21 +1,211 @@
 """
 /ask endpoint for text-only and voice follow-up questions.
 """
-import json
+import math
 from datetime import datetime
-from flask import current_app, request, jsonify
+from typing import Optional
+from flask import request, jsonify
 from werkzeug.exceptions import BadRequest, Unauthorized, NotFound, RequestEntityTooLarge
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 # Import utilities
 from app.utils.session import load_session_context
+from app.utils.session_store import JSONFileSessionStore
 from app.utils.validation import sanitize_string
 from app.utils.audio_validation import validate_audio, MAX_AUDIO_SIZE
-from app.utils.speech_to_text import transcribe_audio
+from app.utils.speech_to_text import transcribe_audio, CLIENT_AUDIO_ERRORS
+from app.utils.singleflight import coalesce, content_hash
+from app.utils.clients import call_options, get_chat_model
+from app.utils.health import record_upstream
+from app.utils.resilience import Resilience, CircuitOpenError
+from app.utils.deadline import Deadline, DeadlineExceeded, deadline_exceeded_body
+from app.routes.assist import authenticate_request, parse_multipart, request_deadline
+from app.utils.metrics import stage_timer
+from app.utils.tracing import tracer, SPAN_KIND_CLIENT
+from app.utils.prompts import prompt_registry
+
+
+# Built once; identical on every /ask call so Gemini can cache the prefix
+ASK_SYSTEM_MESSAGE = SystemMessage(content=prompt_registry.get('ask').system)
+
+
+def format_follow_ups(follow_ups: list) -> str:
+    """Render earlier follow-up Q&A entries for the /ask prompt ('' if there are none)."""
+    if not follow_ups:
+        return ''
+    
+    lines = ['', 'EARLIER FOLLOW-UP QUESTIONS IN THIS SESSION:']
+    for entry in follow_ups:
+        lines.append(f"Q: {entry.get('question', '')}")
+        lines.extend(f"   - {step}" for step in entry.get('answer_steps', []))
+    lines.append('')
+    
+    return '\n'.join(lines)
+
+
+def answer_follow_up(app, session_id: str, question: Optional[str], audio_bytes: Optional[bytes] = None,
+                     audio_content_type: Optional[str] = None, deadline: Optional[Deadline] = None) -> dict:
+    """
+    Answer a follow-up question from the saved session context.
+    
+    Transcribes the audio if given, asks Gemini and appends the Q&A to the
+    session's follow-up log.
+    
+    Args:
+        app: Flask app
+        session_id: Sanitized session identifier
+        question: Text question (ignored when audio_bytes is given)
+        audio_bytes: Optional recorded question
+        audio_content_type: MIME type of audio_bytes
+        deadline: Optional request deadline; its remaining time is the RPC
+            timeout of the transcription and the Gemini call
+        
+    Returns:
+        /ask success payload
+        
+    Raises:
+        BadRequest: If transcription fails or there is no question
+        NotFound: If the session does not exist
+        DeadlineExceeded: If the deadline passes before the answer is ready
+    """
+    # Transcribe audio to text
+    if audio_bytes is not None:
+        app.logger.info(f'Transcribing audio for session {session_id}')
+        if deadline is not None:
+            deadline.check('transcription')
+        with stage_timer('stt'):
+            success, transcribed_text, error_msg = transcribe_audio(
+                audio_bytes,
+                audio_content_type,
+                timeout=deadline.remaining() if deadline is not None else None
+            )
+        if deadline is not None:
+            # A Speech call cut off by our own deadline is not the client's fault
+            deadline.check('transcription')
+        record_upstream(app, 'speech', success or error_msg in CLIENT_AUDIO_ERRORS)
+        
+        if not success:
+            raise BadRequest(f'Audio transcription failed: {error_msg}')
+        
+        question = transcribed_text
+        app.logger.debug('Audio transcribed: "%s"', question, extra={'sample_key': 'transcript'})
+    
+    if not question:
+        raise BadRequest('Missing required field: question or audio')
+    
+    question = sanitize_string(question)
+    
+    # 1. Load session context
+    store = getattr(app, 'session_store', None) or JSONFileSessionStore(app.config.get('CONTEXT_DIR', 'contexts'))
+    with stage_timer('session_load'), tracer.span('session.load', attributes={'session.id': session_id}):
+        session_context = load_session_context(session_id, store=store)
+    
+    if session_context is None:
+        raise NotFound(f'Session not found: {session_id}')
+    
+    # 2. Build prompt with previous context
+    task = session_context.get('task', 'Unknown task')
+    step = session_context.get('step', 'Unknown step')
+    image_analysis = session_context.get('image_analysis', '')
+    previous_instruction = session_context.get('instruction', {})
+    
+    # Extract instruction steps
+    instruction_steps = previous_instruction.get('steps', [])
+    if isinstance(instruction_steps, str):
+        instruction_steps = [instruction_steps]
+    instruction_text = '\n'.join(f"- {step}" for step in instruction_steps)
+    
+    # Bounded tail of earlier follow-ups (older sessions kept them in the context itself)
+    history_size = app.config.get('ASK_FOLLOW_UP_HISTORY', 5)
+    with stage_timer('session_load'), tracer.span('session.recent_follow_ups', attributes={'session.id': session_id}):
+        recent_follow_ups = store.recent_follow_ups(session_id, history_size)
+    follow_ups = session_context.get('follow_up_qa', []) + recent_follow_ups
+    follow_ups = follow_ups[-history_size:] if history_size > 0 else []
+    follow_up_text = format_follow_ups(follow_ups)
+    
+    # Only this section changes per request; the static instructions are
+    # sent as the system instruction
+    prompt = prompt_registry.get('ask').render(
+        task=task,
+        step=step,
+        image_analysis=image_analysis,
+        instruction_text=instruction_text,
+        follow_up_text=follow_up_text,
+        question=question
+    )
+    
+    # 3. Invoke Gemini text-only model (cheaper, no image)
+    app.logger.info(f'Processing follow-up question for session {session_id}')
+    
+    if not app.config.get('GEMINI_API_KEY'):
+        raise Exception('GEMINI_API_KEY not configured')
+    
+    llm = get_chat_model(app.config['GEMINI_API_KEY'], model="gemini-2.5-flash", temperature=0.5)
+    
+    messages = [ASK_SYSTEM_MESSAGE, HumanMessage(content=prompt)]
+    
+    def generate():
+        with tracer.span('gemini.generate', SPAN_KIND_CLIENT, {'gen_ai.request.model': 'gemini-2.5-flash'}):
+            return llm.invoke(messages, **call_options(deadline.remaining() if deadline is not None else None))
+    
+    resilience = getattr(app, 'resilience', None) or Resilience()
+    try:
+        if deadline is not None:
+            deadline.check('generation', app.config['DEADLINE_MIN_GENERATION_SECONDS'])
+        with stage_timer('llm_call'):
+            response = resilience.call("gemini-2.5-flash", generate, deadline)
+    except (CircuitOpenError, DeadlineExceeded):
+        # Gemini was skipped or cut off by our deadline; not an upstream failure
+        raise
+    except Exception:
+        record_upstream(app, 'gemini', False)
+        raise
+    record_upstream(app, 'gemini', True)
+    
+    answer_text = response.content
+    
+    # Parse the answer into steps (split by numbered list items)
+    import re
+    # Match patterns like "1. ", "2. ", etc.
+    steps = re.split(r'\n\s*\d+\.\s+', answer_text)
+    # Remove empty first element if answer starts with "1. "
+    if steps and not steps[0].strip():
+        steps = steps[1:]
+    # Clean up each step
+    answer_steps = [step.strip() for step in steps if step.strip()]
+    
+    # If parsing failed or no steps found, use the whole answer as a single step
+    if not answer_steps:
+        answer_steps = [answer_text.strip()]
+    
+    # 4. Append follow-up Q&A to the session's log (the context itself is not rewritten)
+    with stage_timer('context_save'), tracer.span('session.append_follow_up', attributes={'session.id': session_id}):
+        store.append_follow_up(session_id, {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'question': question,
+            'answer_steps': answer_steps
+        })
+    
+    # 5. Build response
+    response_data = {
+        'status': 'success',
+        'session_id': session_id,
+        'answer_steps': answer_steps,
+        'context': {
+            'task': task,
+            'step': step,
+            'previous_instruction': instruction_text
+        }
+    }
+    
+    # Add transcribed question if voice input was used
+    if audio_bytes is not None:
+        response_data['transcribed_question'] = question
+    
+    return response_data
 
 
 def register_ask_route(app):
@@ -42,31 +232,25 @@ def register_ask_route(app):
         session_id = None
         
         try:
-            # Log ALL request details at the very start
-            app.logger.info(f'=== /ask Request Debug ===')
-            app.logger.info(f'Content-Type: {request.content_type}')
-            app.logger.info(f'Content-Length: {request.content_length}')
-            app.logger.info(f'Method: {request.method}')
-            app.logger.info(f'Headers: {dict(request.headers)}')
+            app.logger.debug('/ask request: Content-Type %s, Content-Length %s',
+                             request.content_type, request.content_length)
             
-            # 1. Authenticate request
-            auth_header = request.headers.get('Authorization', '')
-            if not auth_header.startswith('Bearer '):
-                raise Unauthorized('Missing or invalid Authorization header')
-            
-            api_key = auth_header.replace('Bearer ', '').strip()
-            if api_key != app.config['API_KEY']:
-                raise Unauthorized('Invalid API key')
+            # 1. Authenticate request and start its deadline
+            authenticate_request(app)
+            deadline = request_deadline(app, app.config['ASK_DEADLINE_SECONDS'])
             
             # 2. Parse request data
             # Try form data first (like /assist endpoint does)
             question = None
+            audio_bytes = None
+            audio_content_type = None
             is_voice_input = False
             
             # Check if audio file is provided in multipart data
+            parse_multipart()
             if 'audio' in request.files:
                 # Multipart request with audio
-                app.logger.info('Processing multipart request with audio')
+                app.logger.debug('Processing multipart request with audio')
                 session_id = request.form.get('session_id')
                 audio_file = request.files['audio']
                 
@@ -82,42 +266,18 @@ def register_ask_route(app):
                 audio_bytes = audio_file.read()
                 audio_file.seek(0)
                 
-                # Save audio file for debugging
-                try:
-                    debug_dir = 'test_images'
-                    os.makedirs(debug_dir, exist_ok=True)
-                    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                    debug_filename = f"{debug_dir}/audio_{session_id}_{timestamp}.wav"
-                    with open(debug_filename, 'wb') as f:
-                        f.write(audio_bytes)
-                    app.logger.info(f'Saved audio file to {debug_filename}')
-                except Exception as e:
-                    app.logger.warning(f'Failed to save debug audio: {e}')
-                
-                # Transcribe audio to text
-                app.logger.info(f'Transcribing audio for session {session_id}')
-                success, transcribed_text, error_msg = transcribe_audio(
-                    audio_bytes,
-                    audio_file.content_type
-                )
-                
-                if not success:
-                    raise BadRequest(f'Audio transcription failed: {error_msg}')
-                
-                question = transcribed_text
+                audio_content_type = audio_file.content_type
                 is_voice_input = True
-                app.logger.info(f'Audio transcribed: "{question}"')
-                    
             
             # Check if this is form data without audio (text question)
             elif request.form and 'session_id' in request.form:
-                app.logger.info('Processing form request with text question')
+                app.logger.debug('Processing form request with text question')
                 session_id = request.form.get('session_id')
                 question = request.form.get('question')
             
             # Fallback to JSON (backward compatibility)
             elif request.is_json:
-                app.logger.info('Processing JSON request')
+                app.logger.debug('Processing JSON request')
                 data = request.get_json()
                 session_id = data.get('session_id')
                 question = data.get('question')
@@ -131,156 +291,29 @@ def register_ask_route(app):
             if not session_id:
                 raise BadRequest('Missing required field: session_id')
             
-            if not question:
+            if not question and not is_voice_input:
                 raise BadRequest('Missing required field: question or audio')
             
-            # 4. Sanitize inputs
             session_id = sanitize_string(session_id)
-            question = sanitize_string(question)
-            
-            # 5. Load session context
-            context_dir = app.config.get('CONTEXT_DIR', 'contexts')
-            session_context = load_session_context(session_id, context_dir)
-            
-            if session_context is None:
-                raise NotFound(f'Session not found: {session_id}')
-            
-            # 6. Build prompt with previous context
-            task = session_context.get('task', 'Unknown task')
-            step = session_context.get('step', 'Unknown step')
-            image_analysis = session_context.get('image_analysis', '')
-            previous_instruction = session_context.get('instruction', {})
-            
-            # Extract instruction steps
-            instruction_steps = previous_instruction.get('steps', [])
-            if isinstance(instruction_steps, str):
-                instruction_steps = [instruction_steps]
-            instruction_text = '\n'.join(f"- {step}" for step in instruction_steps)
             
-            prompt = f"""You are a Hands-On Coach for Meta Quest 3 AR, answering follow-up questions about an ongoing task.
-
-CURRENT SESSION CONTEXT:
-Task: {task}
-Current Step: {step}
-What the user saw: {image_analysis}
-
-PREVIOUS GUIDANCE PROVIDED:
-{instruction_text}
-
-USER'S FOLLOW-UP QUESTION:
-"{question}"
-
-YOUR ROLE:
-Answer the user's question directly and practically. They are actively working on a physical task and need quick, actionable guidance.
-
-RESPONSE GUIDELINES:
-
-1. ANSWER DIRECTLY
-   - Start with the answer immediately, no preamble
-   - Address exactly what they asked
-   - Reference the previous context when relevant
-
-2. BE PRACTICAL
-   - Focus on what they need to do or know right now
-   - Use the same spatial, specific language as the original guidance
-   - If they're stuck, provide troubleshooting steps
-
-3. STAY CONTEXTUAL
-   - Build on the previous instruction steps
-   - Reference what they saw in the image analysis
-   - Maintain continuity with the current task and step
-
-4. KEEP IT ACTIONABLE
-   - Provide 2-5 clear steps or points
-   - Each point should be concrete and specific
-   - Use action verbs when giving instructions
-
-5. COMMON QUESTION TYPES:
-   - "What if...?" → Provide alternative steps or troubleshooting
-   - "Where is...?" → Give spatial directions based on previous context
-   - "How do I...?" → Break down the specific action into steps
-   - "Why...?" → Explain briefly, then provide next action
-   - "Can I...?" → Answer yes/no, then explain implications
-
-RESPONSE FORMAT:
-Provide your answer as a numbered list of clear, actionable steps or points:
-1. First step or key point
-2. Second step or key point
-3. Third step or key point
-(continue as needed, 2-5 points total)
-
-Be concise, practical, and directly helpful. The user has their hands busy and needs quick, clear answers."""
-            
-            # 7. Invoke Gemini text-only model (cheaper, no image)
-            app.logger.info(f'Processing follow-up question for session {session_id}')
-            
-            if not app.config.get('GEMINI_API_KEY'):
-                raise Exception('GEMINI_API_KEY not configured')
-            
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=app.config['GEMINI_API_KEY'],
-                temperature=0.5
+            # 4. Answer the question; duplicates fired while this one is in
+            # flight share its transcription, LLM call and context write
+            key = (session_id, '/ask', content_hash(audio_content_type, audio_bytes, question))
+            response_data, shared = coalesce(
+                getattr(app, 'single_flight', None),
+                key,
+                lambda: answer_follow_up(app, session_id, question, audio_bytes, audio_content_type, deadline)
             )
+            if shared:
+                app.logger.info(f'Coalesced duplicate follow-up question for session {session_id}')
             
-            message = HumanMessage(content=prompt)
-            response = llm.invoke([message])
-            
-            answer_text = response.content
-            
-            # Parse the answer into steps (split by numbered list items)
-            import re
-            # Match patterns like "1. ", "2. ", etc.
-            steps = re.split(r'\n\s*\d+\.\s+', answer_text)
-            # Remove empty first element if answer starts with "1. "
-            if steps and not steps[0].strip():
-                steps = steps[1:]
-            # Clean up each step
-            answer_steps = [step.strip() for step in steps if step.strip()]
-            
-            # If parsing failed or no steps found, use the whole answer as a single step
-            if not answer_steps:
-                answer_steps = [answer_text.strip()]
-            
-            # 8. Save follow-up Q&A to context file
-            if 'follow_up_qa' not in session_context:
-                session_context['follow_up_qa'] = []
-            
-            session_context['follow_up_qa'].append({
-                'timestamp': datetime.utcnow().isoformat() + 'Z',
-                'question': question,
-                'answer_steps': answer_steps
-            })
-            
-            # Write updated context back to file
-            from pathlib import Path
-            context_path = Path(context_dir) / f"{session_id}.json"
-            with open(context_path, 'w') as f:
-                json.dump(session_context, f, indent=2)
-            
-            # 9. Build response
-            response_data = {
-                'status': 'success',
-                'session_id': session_id,
-                'answer_steps': answer_steps,
-                'context': {
-                    'task': task,
-                    'step': step,
-                    'previous_instruction': instruction_text
-                }
-            }
-            
-            # Add transcribed question if voice input was used
-            if is_voice_input:
-                response_data['transcribed_question'] = question
-            
-            # 10. Log completion
+            # 5. Log completion
             duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
             app.logger.info('Follow-up question completed', extra={
                 'session_id': session_id,
                 'endpoint': '/ask',
-                'task': task,
-                'step': step,
+                'task': response_data['context']['task'],
+                'step': response_data['context']['step'],
                 'duration_ms': duration_ms,
                 'status': 'success'
             })
@@ -291,6 +324,35 @@ Be concise, practical, and directly helpful. The user has their hands busy and n
             # Re-raise HTTP exceptions
             raise
             
+        except DeadlineExceeded as e:
+            # Out of time: a quick "try again" beats a spinner on the headset
+            duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+            app.logger.warning(str(e), extra={
+                'endpoint': '/ask',
+                'session_id': session_id,
+                'duration_ms': duration_ms,
+                'status': 'error'
+            })
+            
+            return jsonify(deadline_exceeded_body(e.stage, session_id)), 504
+            
+        except CircuitOpenError as e:
+            # Gemini is failing; answer immediately instead of queueing more calls
+            app.logger.warning(f'Follow-up question rejected: {str(e)}', extra={
+                'endpoint': '/ask',
+                'session_id': session_id,
+                'status': 'error'
+            })
+            
+            response = jsonify({
+                'status': 'error',
+                'error': str(e),
+                'error_code': 'SERVICE_UNAVAILABLE',
+                'session_id': session_id
+            })
+            response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+            return response, 503
+            
         except Exception as e:
             # Log and return 500 for unexpected errors
             duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
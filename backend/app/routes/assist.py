@@ -1,139 +1,546 @@
 """
 /assist endpoint for processing AR assistance requests.
 """
-import base64
 import json
+import math
 import uuid
 from datetime import datetime
-from flask import current_app, request, jsonify
+from typing import Optional
+from flask import g, request, jsonify, Response, stream_with_context
 from werkzeug.exceptions import BadRequest, Unauthorized, RequestEntityTooLarge
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 # Import utilities
-from app.utils.validation import validate_image, validate_gaze_vector, sanitize_string
-from app.utils.image_processing import compress_image
+from app.utils.validation import validate_gaze_vector, sanitize_string
+from app.utils.image_processing import ingest_image, ingest_image_data, read_stream
+from app.utils.foveation import foveation_report
+from app.utils.response_cache import image_hash as perceptual_image_hash
+from app.utils.singleflight import coalesce, content_hash
+from app.utils.health import record_upstream
+from app.utils.deadline import DEADLINE_HEADER, DeadlineExceeded, deadline_exceeded_body, parse_deadline_header
+from app.utils.metrics import stage_timer
+from app.utils.image_store import ImageHandle, image_store
+from app.utils.capture import keep_raw_body
+
+
+# Request bodies that are the snapshot itself rather than multipart/form-data
+RAW_CONTENT_TYPES = ('application/octet-stream', 'image/jpeg', 'image/png')
+
+# Form field -> (header, query string parameter) for raw uploads; the header wins
+RAW_UPLOAD_FIELDS = {
+    'task_step': ('X-Task-Step', 'step'),
+    'current_task': ('X-Current-Task', 'task'),
+    'gaze_vector': ('X-Gaze-Vector', 'gaze'),
+    'session_id': ('X-Session-Id', 'session_id')
+}
+
+
+def request_deadline(app, default_seconds: float):
+    """
+    Start the deadline for the current request from X-Request-Deadline.
+    
+    Raises:
+        BadRequest: If the header is malformed
+    """
+    is_valid, deadline, error_msg = parse_deadline_header(
+        request.headers.get(DEADLINE_HEADER),
+        default_seconds,
+        app.config['MAX_REQUEST_DEADLINE_SECONDS']
+    )
+    if not is_valid:
+        raise BadRequest(error_msg)
+    
+    return deadline
+
+
+def authenticate_request(app):
+    """
+    Check the Bearer token on the current request.
+    
+    Raises:
+        Unauthorized: If the Authorization header is missing or the key is wrong
+    """
+    with stage_timer('auth'):
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            raise Unauthorized('Missing or invalid Authorization header')
+        
+        api_key = auth_header.replace('Bearer ', '').strip()
+        if api_key != app.config['API_KEY']:
+            raise Unauthorized('Invalid API key')
+
+
+def parse_multipart():
+    """Parse the multipart body now, so its cost is timed on its own."""
+    # Werkzeug parses the body on first access to request.files or request.form
+    with stage_timer('multipart_parse'):
+        request.files
+
+
+def store_image(data: bytes, mime_type: str) -> ImageHandle:
+    """Put an image in the blob store until the current request ends."""
+    handle = image_store.put(data, mime_type)
+    g.setdefault('image_handles', []).append(handle)
+    return handle
+
+
+def ingest_frame(app, snapshot_file, gaze_vector_str: str, session_id: str, endpoint: str = '/assist') -> dict:
+    """
+    Read, validate and store one snapshot and the gaze vector it was taken with.
+    
+    snapshot_file is an uploaded file, or the bytes of a raw request body.
+    
+    Returns:
+        Dict with gaze_vector, image and focus_image (image store handles, the
+        latter None without foveation), image_mime_type, image_report and
+        snapshot (the decoded image)
+    
+    Raises:
+        BadRequest: If the image or gaze vector is invalid
+        RequestEntityTooLarge: If the snapshot exceeds the size limit
+    """
+    # With foveation the main image is a low-resolution context frame, but the
+    # decode keeps enough detail for the high-resolution crop
+    foveation = getattr(app, 'foveation', None)
+    
+    # Read, validate and compress the snapshot with a single decode
+    ingest = ingest_image_data if isinstance(snapshot_file, bytes) else ingest_image
+    is_valid, snapshot, error_msg = ingest(
+        snapshot_file,
+        max_size=app.config['MAX_IMAGE_SIZE'],
+        policy=foveation.context_policy if foveation else app.resize_policy,
+        decode_size=foveation.decode_size if foveation else None
+    )
+    if not is_valid:
+        if 'too large' in error_msg.lower():
+            raise RequestEntityTooLarge(error_msg)
+        raise BadRequest(error_msg)
+    
+    # Validate and parse gaze vector
+    is_valid, gaze_vector, error_msg = validate_gaze_vector(gaze_vector_str)
+    if not is_valid:
+        raise BadRequest(f'Invalid gaze_vector: {error_msg}')
+    
+    image_data = snapshot.data
+    image_mime_type = snapshot.mime_type
+    focus_image = None
+    focus_report = None
+    
+    if foveation:
+        focus = foveation.crop(snapshot.image, gaze_vector, snapshot.report.original_dimensions)
+        if focus is not None:
+            focus_image = store_image(focus.data, focus.mime_type)
+            focus_report = foveation_report(
+                app.resize_policy.target_dimensions(*snapshot.report.original_dimensions),
+                snapshot.report.output_bytes, snapshot.report.output_dimensions, focus
+            )
+        else:
+            # Gaze is outside the camera view, so send the regular full frame
+            image_data, _ = app.resize_policy.apply(snapshot.image)
+            image_mime_type = app.resize_policy.mime_type
+    
+    report = snapshot.report
+    if focus_report is not None:
+        app.logger.info(
+            f'Foveated image {report.original_dimensions[0]}x{report.original_dimensions[1]} -> '
+            f'context {report.output_dimensions[0]}x{report.output_dimensions[1]} + '
+            f'crop {focus_report["fovea_box"]}: {focus_report["output_bytes"]} bytes, '
+            f'~{focus_report["output_tokens"]} tokens (~{focus_report["baseline_tokens"]} without foveation)',
+            extra={'session_id': session_id, 'endpoint': endpoint, 'image': focus_report}
+        )
+    else:
+        app.logger.info(
+            f'Image {report.original_dimensions[0]}x{report.original_dimensions[1]} -> '
+            f'{report.output_dimensions[0]}x{report.output_dimensions[1]} {report.output_format}: '
+            f'saved {report.bytes_saved} bytes, ~{report.tokens_saved} tokens',
+            extra={'session_id': session_id, 'endpoint': endpoint, 'image': report.to_dict()}
+        )
+    
+    return {
+        'gaze_vector': gaze_vector,
+        'image': store_image(image_data, image_mime_type),
+        'image_mime_type': image_mime_type,
+        'focus_image': focus_image,
+        'image_report': report,
+        'snapshot': snapshot
+    }
+
+
+def parse_session_fields(values=None) -> dict:
+    """
+    Extract the task fields shared by /assist and /assist/batch.
+    
+    Args:
+        values: Mapping to read the fields from (default: the form)
+    
+    Returns:
+        Dict with session_id, task_step and current_task (sanitized)
+    
+    Raises:
+        BadRequest: If task_step or current_task is missing
+    """
+    if values is None:
+        values = request.form
+    task_step = values.get('task_step')
+    current_task = values.get('current_task')
+    session_id = values.get('session_id')
+    
+    if not task_step or not current_task:
+        raise BadRequest('Missing required fields: task_step, current_task, or gaze_vector')
+    
+    # Generate session_id if not provided
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    else:
+        session_id = sanitize_string(session_id)
+    
+    # Sanitize string inputs
+    return {
+        'session_id': session_id,
+        'task_step': sanitize_string(task_step),
+        'current_task': sanitize_string(current_task)
+    }
+
+
+def parse_assist_request(app) -> dict:
+    """
+    Extract and validate the /assist payload, multipart or a raw snapshot body.
+    
+    Returns:
+        Dict with session_id, task_step, current_task, gaze_vector, image,
+        image_mime_type, focus_image, image_hash, content_hash and image_report
+    
+    Raises:
+        BadRequest: If fields are missing or invalid
+        RequestEntityTooLarge: If the snapshot exceeds the size limit
+    """
+    if request.mimetype in RAW_CONTENT_TYPES:
+        return parse_raw_assist_request(app)
+    
+    # Extract form data
+    parse_multipart()
+    if 'snapshot' not in request.files:
+        raise BadRequest('Missing snapshot file')
+    
+    gaze_vector_str = request.form.get('gaze_vector')
+    if not gaze_vector_str:
+        raise BadRequest('Missing required fields: task_step, current_task, or gaze_vector')
+    
+    fields = parse_session_fields()
+    frame = ingest_frame(app, request.files['snapshot'], gaze_vector_str, fields['session_id'])
+    return assist_fields(app, fields, frame)
+
+
+def parse_raw_assist_request(app) -> dict:
+    """
+    Extract and validate an /assist request whose body is the snapshot itself.
+    
+    The task fields come from headers or the query string (RAW_UPLOAD_FIELDS),
+    and the gaze vector may be JSON or a compact "x,y,z". The body skips
+    multipart parsing and is read straight from the input stream, with the
+    size limit enforced while reading.
+    
+    Returns:
+        Same dict as parse_assist_request
+    
+    Raises:
+        BadRequest: If fields are missing or invalid
+        RequestEntityTooLarge: If the body exceeds the size limit
+    """
+    values = {
+        name: request.headers.get(header) or request.args.get(param)
+        for name, (header, param) in RAW_UPLOAD_FIELDS.items()
+    }
+    if not values['gaze_vector']:
+        raise BadRequest('Missing required fields: task_step, current_task, or gaze_vector')
+    fields = parse_session_fields(values)
+    
+    with stage_timer('body_read'):
+        is_valid, data, error_msg = read_stream(request.stream, app.config['MAX_IMAGE_SIZE'],
+                                                request.content_length)
+    if not is_valid:
+        raise RequestEntityTooLarge(error_msg)
+    keep_raw_body(data)
+    
+    frame = ingest_frame(app, data, gaze_vector_json(values['gaze_vector']), fields['session_id'])
+    return assist_fields(app, fields, frame)
+
+
+def gaze_vector_json(value: str) -> str:
+    """Turn a compact "x,y,z" gaze vector into JSON; anything else is returned as is."""
+    parts = value.split(',')
+    if len(parts) == 3 and not value.lstrip().startswith('{'):
+        try:
+            return json.dumps(dict(zip('xyz', (float(part) for part in parts))))
+        except ValueError:
+            pass
+    return value
+
+
+def assist_fields(app, fields: dict, frame: dict) -> dict:
+    """Merge an ingested frame into the request fields and add the cache and coalescing hashes."""
+    snapshot = frame.pop('snapshot')
+    fields.update(frame)
+    
+    # Perceptual hash for the response cache, from the already decoded image
+    fields['image_hash'] = None
+    if getattr(app, 'response_cache', None) is not None:
+        fields['image_hash'] = perceptual_image_hash(snapshot.image)
+    
+    fields['content_hash'] = content_hash(
+        image_bytes(fields['image']), image_bytes(fields['focus_image']), fields['current_task'],
+        fields['task_step'], json.dumps(fields['gaze_vector'], sort_keys=True)
+    )
+    return fields
+
+
+def parse_batch_request(app) -> dict:
+    """
+    Extract and validate the multipart /assist/batch payload.
+    
+    The snapshot and gaze_vector fields are repeated, one pair per view, in
+    the same order. The first view is the primary one: it gets the foveated
+    crop and its gaze vector is saved as the session's context.
+    
+    Returns:
+        Dict with session_id, task_step, current_task, the primary view's
+        gaze_vector, image, image_mime_type and focus_image, extra_frames
+        (the other views) and content_hash
+    
+    Raises:
+        BadRequest: If fields are missing or invalid, or the view count is wrong
+        RequestEntityTooLarge: If a snapshot exceeds the size limit
+    """
+    parse_multipart()
+    snapshot_files = request.files.getlist('snapshot')
+    gaze_vector_strs = request.form.getlist('gaze_vector')
+    max_frames = app.config['BATCH_MAX_FRAMES']
+    
+    if not snapshot_files:
+        raise BadRequest('Missing snapshot file')
+    if len(snapshot_files) > max_frames:
+        raise BadRequest(f'Too many snapshots: at most {max_frames} per batch')
+    if len(gaze_vector_strs) != len(snapshot_files):
+        raise BadRequest(
+            f'Expected one gaze_vector per snapshot, got {len(gaze_vector_strs)} for {len(snapshot_files)}'
+        )
+    
+    fields = parse_session_fields()
+    frames = [
+        ingest_frame(app, snapshot_file, gaze_vector_str, fields['session_id'], endpoint='/assist/batch')
+        for snapshot_file, gaze_vector_str in zip(snapshot_files, gaze_vector_strs)
+    ]
+    
+    primary = frames[0]
+    fields.update({
+        'gaze_vector': primary['gaze_vector'],
+        'image': primary['image'],
+        'image_mime_type': primary['image_mime_type'],
+        'focus_image': primary['focus_image'],
+        'extra_frames': [
+            {
+                'image': frame['image'],
+                'image_mime_type': frame['image_mime_type'],
+                'gaze_vector': frame['gaze_vector']
+            }
+            for frame in frames[1:]
+        ]
+    })
+    fields['content_hash'] = content_hash(
+        fields['current_task'], fields['task_step'], image_bytes(primary['focus_image']),
+        *(part for frame in frames
+          for part in (image_bytes(frame['image']), json.dumps(frame['gaze_vector'], sort_keys=True)))
+    )
+    return fields
+
+
+def image_bytes(handle: Optional[ImageHandle]) -> Optional[bytes]:
+    """The stored bytes for a handle (not a copy), for hashing."""
+    return image_store.get(handle) if handle is not None else None
+
+
+def get_cached_result(app, fields: dict) -> Optional[dict]:
+    """
+    Look up a cached result for a near-duplicate snapshot.
+    
+    On a hit the cached answer is saved as this session's context, on top of
+    the session's memory, so /ask follow-ups and later steps work the same as
+    after a full workflow run.
+    
+    Returns:
+        Final state dict for this request, or None on a cache miss
+    """
+    cache = getattr(app, 'response_cache', None)
+    if cache is None or fields.get('image_hash') is None:
+        return None
+    
+    cached = cache.get(fields['current_task'], fields['task_step'], fields['gaze_vector'], fields['image_hash'],
+                       session_id=fields['session_id'])
+    if cached is None:
+        return None
+    
+    state = dict(
+        cached,
+        session_id=fields['session_id'],
+        task_step=fields['task_step'],
+        current_task=fields['current_task'],
+        gaze_vector=fields['gaze_vector']
+    )
+    # save_context appends this step to the memory in the state, so load it first
+    app.workflow._load_memory(state)
+    return app.workflow.save_context(state)
+
+
+def cache_result(app, fields: dict, result: dict) -> None:
+    """Store a successful workflow result in the response cache."""
+    cache = getattr(app, 'response_cache', None)
+    if cache is None or fields.get('image_hash') is None:
+        return
+    
+    # Never cache failures, or the user would get the same error on every
+    # retry; nor repaired (truncated) output, which a retry may get in full
+    if result.get('error') or result.get('parse_error') or result.get('parse_status') == 'repaired':
+        return
+    
+    cache.put(fields['current_task'], fields['task_step'], fields['gaze_vector'], fields['image_hash'], result,
+              session_id=fields['session_id'])
+
+
+def result_events(result: dict):
+    """Yield the /assist/stream events for an already complete result."""
+    yield {'event': 'image_analysis', 'image_analysis': result.get('image_analysis', '')}
+    
+    instruction_text = result.get('instruction_text', [])
+    if isinstance(instruction_text, str):
+        instruction_text = [instruction_text]
+    for index, text in enumerate(instruction_text):
+        yield {'event': 'step', 'index': index, 'text': text}
+    
+    yield {'event': 'target_id', 'target_id': result.get('target_id', '')}
+    yield {'event': 'haptic_cue', 'haptic_cue': result.get('haptic_cue', 'none')}
+    yield {'event': 'complete', 'result': result}
+
+
+def build_assist_response(result: dict, session_id: str, task_step: str) -> dict:
+    """Build the /assist success payload from the final workflow state."""
+    instruction_text = result.get('instruction_text', [])
+    # Ensure it's always a list for consistency
+    if isinstance(instruction_text, str):
+        instruction_text = [instruction_text]
+    
+    return {
+        'status': 'success',
+        'session_id': session_id,
+        'instruction_id': f"{session_id}-{task_step}",
+        'instruction_steps': instruction_text,  # Now a list of steps
+        'target_id': result.get('target_id', ''),
+        'haptic_cue': result.get('haptic_cue', 'none'),
+        'image_analysis': result.get('image_analysis', ''),  # Add image analysis
+        'timestamp': datetime.utcnow().isoformat() + 'Z'  # Add timestamp
+    }
 
 
 def register_assist_route(app):
-    """Register the /assist endpoint with the Flask app."""
+    """Register the /assist, /assist/batch and /assist/stream endpoints with the Flask app."""
     
-    @app.route('/assist', methods=['POST'])
-    def assist():
+    @app.teardown_request
+    def release_request_images(exc):
+        # Runs after a streamed response has finished, too
+        image_store.release(*g.pop('image_handles', ()))
+    
+    def handle_assist(parse_request, endpoint: str):
         """
-        Main assistance endpoint that processes AR context and returns instructions.
-        
-        Accepts multipart/form-data with:
-        - snapshot: File (JPEG/PNG image)
-        - task_step: str (current step number)
-        - current_task: str (task identifier)
-        - gaze_vector: str (JSON with x, y, z coordinates)
-        - session_id: str (optional, generated if not provided)
-        
-        Returns JSON with instruction, target_id, and haptic_cue.
+        Run an /assist style request: authenticate, parse the form with
+        parse_request, run the workflow and build the JSON response.
         """
         start_time = datetime.utcnow()
         
         try:
-            # 1. Authenticate request
-            auth_header = request.headers.get('Authorization', '')
-            if not auth_header.startswith('Bearer '):
-                raise Unauthorized('Missing or invalid Authorization header')
-            
-            api_key = auth_header.replace('Bearer ', '').strip()
-            if api_key != app.config['API_KEY']:
-                raise Unauthorized('Invalid API key')
-            
-            # 2. Extract form data
-            if 'snapshot' not in request.files:
-                raise BadRequest('Missing snapshot file')
-            
-            snapshot_file = request.files['snapshot']
-            task_step = request.form.get('task_step')
-            current_task = request.form.get('current_task')
-            gaze_vector_str = request.form.get('gaze_vector')
-            session_id = request.form.get('session_id')
-            
-            if not task_step or not current_task or not gaze_vector_str:
-                raise BadRequest('Missing required fields: task_step, current_task, or gaze_vector')
-            
-            # 3. Validate image
-            is_valid, error_msg = validate_image(snapshot_file)
-            if not is_valid:
-                if 'too large' in error_msg.lower():
-                    raise RequestEntityTooLarge(error_msg)
-                raise BadRequest(error_msg)
-            
-            # 4. Validate and parse gaze vector
-            is_valid, gaze_vector, error_msg = validate_gaze_vector(gaze_vector_str)
-            if not is_valid:
-                raise BadRequest(f'Invalid gaze_vector: {error_msg}')
-            
-            # 5. Sanitize string inputs
-            task_step = sanitize_string(task_step)
-            current_task = sanitize_string(current_task)
-            
-            # 6. Generate session_id if not provided
-            if not session_id:
-                session_id = str(uuid.uuid4())
-            else:
-                session_id = sanitize_string(session_id)
-            
-            # 7. Read and process image
-            snapshot_file.seek(0)
-            image_bytes = snapshot_file.read()
-            
-            # Compress if larger than 1MB
-            if len(image_bytes) > 1 * 1024 * 1024:
-                app.logger.info(f'Compressing image from {len(image_bytes)} bytes')
-                image_bytes = compress_image(image_bytes)
-                app.logger.info(f'Compressed to {len(image_bytes)} bytes')
-            
-            # Convert to base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
-            # 8. Check if workflow is initialized
+            # 1. Authenticate request and start its deadline
+            authenticate_request(app)
+            deadline = request_deadline(app, app.config['ASSIST_DEADLINE_SECONDS'])
+            
+            # 2. Extract, validate and encode the form data
+            fields = parse_request(app)
+            session_id = fields['session_id']
+            task_step = fields['task_step']
+            current_task = fields['current_task']
+            
+            # 3. Check if workflow is initialized
             if not hasattr(app, 'workflow') or app.workflow is None:
                 raise Exception('VRContextWorkflow not initialized')
             
-            # 9. Invoke LangGraph workflow
-            app.logger.info(f'Processing request for session {session_id}, task {current_task}, step {task_step}')
+            def run_workflow():
+                # 4. Answer near-duplicate snapshots from the response cache
+                result = get_cached_result(app, fields)
+                if result is not None:
+                    app.logger.info(f'Response cache hit for session {session_id}, task {current_task}, step {task_step}')
+                    return result
+                
+                # 5. Invoke LangGraph workflow, if there is still time for a generation
+                deadline.check('generation', app.config['DEADLINE_MIN_GENERATION_SECONDS'])
+                app.logger.info(f'Processing request for session {session_id}, task {current_task}, step {task_step}')
+                
+                result = app.workflow.run(
+                    image=fields['image'],
+                    task_step=task_step,
+                    current_task=current_task,
+                    gaze_vector=fields['gaze_vector'],
+                    session_id=session_id,
+                    image_mime_type=fields['image_mime_type'],
+                    focus_image=fields['focus_image'],
+                    extra_frames=fields.get('extra_frames'),
+                    deadline=deadline
+                )
+                if result.get('retry_after') is None and not result.get('deadline_exceeded'):
+                    record_upstream(app, 'gemini', not result.get('error'))
+                cache_result(app, fields, result)
+                return result
             
-            result = app.workflow.run(
-                image_base64=image_base64,
-                task_step=task_step,
-                current_task=current_task,
-                gaze_vector=gaze_vector,
-                session_id=session_id
+            # Duplicate requests fired while this one is in flight share its result
+            result, shared = coalesce(
+                getattr(app, 'single_flight', None),
+                (session_id, endpoint, fields['content_hash']),
+                run_workflow
             )
+            if shared:
+                app.logger.info(f'Coalesced duplicate request for session {session_id}, task {current_task}, step {task_step}')
+            
+            if result.get('deadline_exceeded'):
+                raise DeadlineExceeded(result['deadline_exceeded'])
+            
+            # Gemini's circuit is open: fail fast with a retry hint
+            if result.get('retry_after') is not None:
+                app.logger.warning(f'Request rejected, Gemini circuit open for session {session_id}', extra={
+                    'session_id': session_id,
+                    'endpoint': endpoint,
+                    'status': 'error'
+                })
+                response = jsonify({
+                    'status': 'error',
+                    'error': 'Gemini API temporarily unavailable',
+                    'error_code': 'SERVICE_UNAVAILABLE',
+                    'session_id': session_id
+                })
+                response.headers['Retry-After'] = str(max(1, math.ceil(result['retry_after'])))
+                return response, 503
             
-            # 10. Check for errors in result
+            # Check for errors in result
             if result.get('error'):
                 raise Exception(result['error'])
             
-            # 11. Build response
-            instruction_text = result.get('instruction_text', [])
-            # Ensure it's always a list for consistency
-            if isinstance(instruction_text, str):
-                instruction_text = [instruction_text]
-            
-            response_data = {
-                'status': 'success',
-                'session_id': session_id,
-                'instruction_id': f"{session_id}-{task_step}",
-                'instruction_steps': instruction_text,  # Now a list of steps
-                'target_id': result.get('target_id', ''),
-                'haptic_cue': result.get('haptic_cue', 'none'),
-                'image_analysis': result.get('image_analysis', ''),  # Add image analysis
-                'timestamp': datetime.utcnow().isoformat() + 'Z'  # Add timestamp
-            }
+            # 6. Build response
+            response_data = build_assist_response(result, session_id, task_step)
+            if 'extra_frames' in fields:
+                response_data['frame_count'] = len(fields['extra_frames']) + 1
             
-            # 12. Log completion
+            # 7. Log completion
             duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
             app.logger.info('Request completed', extra={
                 'session_id': session_id,
-                'endpoint': '/assist',
+                'endpoint': endpoint,
                 'task': current_task,
                 'step': task_step,
                 'duration_ms': duration_ms,
@@ -146,11 +553,24 @@ def register_assist_route(app):
             # Re-raise HTTP exceptions
             raise
             
+        except DeadlineExceeded as e:
+            # Out of time: a quick "try again" beats a spinner on the headset
+            duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+            app.logger.warning(str(e), extra={
+                'endpoint': endpoint,
+                'duration_ms': duration_ms,
+                'status': 'error'
+            })
+            
+            return jsonify(deadline_exceeded_body(
+                e.stage, session_id if 'session_id' in locals() else None
+            )), 504
+            
         except Exception as e:
             # Log and return 500 for unexpected errors
             duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
             app.logger.error(f'Request failed: {str(e)}', exc_info=True, extra={
-                'endpoint': '/assist',
+                'endpoint': endpoint,
                 'duration_ms': duration_ms,
                 'status': 'error'
             })
@@ -161,3 +581,156 @@ def register_assist_route(app):
                 'error_code': 'LLM_ERROR',
                 'session_id': session_id if 'session_id' in locals() else None
             }), 500
+    
+    @app.route('/assist', methods=['POST'])
+    def assist():
+        """
+        Main assistance endpoint that processes AR context and returns instructions.
+        
+        Accepts multipart/form-data with:
+        - snapshot: File (JPEG/PNG image)
+        - task_step: str (current step number)
+        - current_task: str (task identifier)
+        - gaze_vector: str (JSON with x, y, z coordinates)
+        - session_id: str (optional, generated if not provided)
+        
+        Or a raw snapshot body (application/octet-stream, image/jpeg or
+        image/png), with the fields in X-Task-Step, X-Current-Task,
+        X-Gaze-Vector and X-Session-Id headers or in the query string as
+        ?step=4&task=PSU_Install&gaze=0,0,1&session_id=... (gaze may be JSON
+        or "x,y,z").
+        
+        An optional X-Request-Deadline header (milliseconds) bounds the whole
+        request; past it, a 504 DEADLINE_EXCEEDED "try again" response is
+        returned (the Gemini call is given the remaining time as its timeout).
+        
+        Returns JSON with instruction, target_id, and haptic_cue.
+        """
+        return handle_assist(parse_assist_request, '/assist')
+    
+    @app.route('/assist/batch', methods=['POST'])
+    def assist_batch():
+        """
+        Multi-view variant of /assist.
+        
+        Accepts the same multipart/form-data as /assist, except that snapshot
+        and gaze_vector are repeated once per view (up to BATCH_MAX_FRAMES),
+        paired in order. All views go to Gemini in a single call, so the
+        model sees every angle at once and returns one merged set of
+        instructions.
+        
+        Returns the same JSON as /assist, plus frame_count.
+        """
+        return handle_assist(parse_batch_request, '/assist/batch')
+    
+    @app.route('/assist/stream', methods=['POST'])
+    def assist_stream():
+        """
+        Streaming variant of /assist.
+        
+        Accepts the same multipart/form-data or raw snapshot body as /assist
+        and responds with newline-delimited JSON (application/x-ndjson). Each
+        line is one event:
+        - {"event": "image_analysis", "image_analysis": str}
+        - {"event": "step", "index": int, "text": str}, one per instruction step
+        - {"event": "target_id", "target_id": str}
+        - {"event": "haptic_cue", "haptic_cue": str}
+        - {"event": "done", ...} carrying the same payload /assist returns
+        - {"event": "error", "error": str, "error_code": str} if generation fails
+        
+        Steps are emitted as soon as the model has finished generating them,
+        so the headset can show step 1 before the full response is complete.
+        """
+        start_time = datetime.utcnow()
+        
+        # Validation errors are raised before streaming starts so they keep
+        # the regular JSON error responses and status codes
+        authenticate_request(app)
+        deadline = request_deadline(app, app.config['ASSIST_DEADLINE_SECONDS'])
+        fields = parse_assist_request(app)
+        session_id = fields['session_id']
+        task_step = fields['task_step']
+        current_task = fields['current_task']
+        
+        if not hasattr(app, 'workflow') or app.workflow is None:
+            return jsonify({
+                'status': 'error',
+                'error': 'VRContextWorkflow not initialized',
+                'error_code': 'LLM_ERROR',
+                'session_id': session_id
+            }), 500
+        
+        cached = get_cached_result(app, fields)
+        if cached is not None:
+            app.logger.info(f'Response cache hit for session {session_id}, task {current_task}, step {task_step}')
+            events = result_events(cached)
+        else:
+            app.logger.info(f'Streaming request for session {session_id}, task {current_task}, step {task_step}')
+            events = app.workflow.stream(
+                image=fields['image'],
+                task_step=task_step,
+                current_task=current_task,
+                gaze_vector=fields['gaze_vector'],
+                session_id=session_id,
+                image_mime_type=fields['image_mime_type'],
+                focus_image=fields['focus_image'],
+                deadline=deadline
+            )
+        
+        def generate():
+            status = 'success'
+            error_code = 'LLM_ERROR'
+            try:
+                for event in events:
+                    if event['event'] != 'complete':
+                        yield json.dumps(event) + '\n'
+                        continue
+                    
+                    result = event['result']
+                    if cached is None and result.get('retry_after') is None and not result.get('deadline_exceeded'):
+                        record_upstream(app, 'gemini', not result.get('error'))
+                    if result.get('retry_after') is not None:
+                        # Gemini's circuit is open and was not called
+                        error_code = 'SERVICE_UNAVAILABLE'
+                    if result.get('deadline_exceeded'):
+                        error_code = 'DEADLINE_EXCEEDED'
+                    if result.get('error'):
+                        raise Exception(result['error'])
+                    
+                    if cached is None:
+                        cache_result(app, fields, result)
+                    
+                    done = build_assist_response(result, session_id, task_step)
+                    done['event'] = 'done'
+                    yield json.dumps(done) + '\n'
+                    
+            except Exception as e:
+                status = 'error'
+                app.logger.error(f'Streaming request failed: {str(e)}', exc_info=True, extra={
+                    'session_id': session_id,
+                    'endpoint': '/assist/stream',
+                    'status': 'error'
+                })
+                yield json.dumps({
+                    'event': 'error',
+                    'status': 'error',
+                    'error': str(e),
+                    'error_code': error_code,
+                    'session_id': session_id
+                }) + '\n'
+            
+            duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+            app.logger.info('Streaming request completed', extra={
+                'session_id': session_id,
+                'endpoint': '/assist/stream',
+                'task': current_task,
+                'step': task_step,
+                'duration_ms': duration_ms,
+                'status': status
+            })
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
@@ -0,0 +1,222 @@
+"""
+Capture of real /assist and /ask requests into a replay corpus.
+
+Each captured request is one directory under the corpus root holding
+request.json (endpoint, form fields, query string, selected headers, status
+and duration) plus the raw uploaded files, or the raw body of a raw snapshot
+upload, so replay.py can send the exact same payloads again without a headset.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from flask import g, request
+
+
+# Endpoints worth replaying; everything else (probes, metrics) is ignored
+CAPTURED_ENDPOINTS = ('/assist', '/assist/batch', '/assist/stream', '/ask')
+
+# Only headers that change server behaviour are kept; never Authorization.
+# The X-Task-Step ... X-Session-Id headers carry the fields of raw /assist uploads
+CAPTURED_HEADERS = ('Content-Type', 'X-Request-Deadline',
+                    'X-Task-Step', 'X-Current-Task', 'X-Gaze-Vector', 'X-Session-Id')
+
+# Blob holding the body of a raw upload
+BODY_BLOB = 'body'
+
+
+def keep_raw_body(data: bytes) -> None:
+    """
+    Keep the body of a raw upload for capture.
+
+    The body is read straight from the input stream, so it cannot be read
+    again once the view has run; views call this with the bytes they read.
+    """
+    g.capture_body = data
+
+
+class CaptureRecorder:
+    """
+    Writes captured requests to a corpus directory.
+
+    Recording stops after max_entries so a forgotten CAPTURE_ENABLED cannot
+    fill the disk.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 1000):
+        """
+        Initialize the recorder.
+
+        Args:
+            directory: Corpus root, created if missing
+            max_entries: Stop recording after this many requests (0 = no limit)
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._count = len(list_entries(directory))
+
+    def full(self) -> bool:
+        with self._lock:
+            return bool(self.max_entries) and self._count >= self.max_entries
+
+    def record(self, endpoint: str, form: Dict[str, List[str]], files: Dict[str, List[dict]],
+               json_body: Optional[dict], headers: Dict[str, str], status_code: int,
+               duration_ms: int, query: Optional[Dict[str, List[str]]] = None,
+               body: Optional[bytes] = None) -> Optional[str]:
+        """
+        Write one request to the corpus.
+
+        Args:
+            endpoint: Request path, e.g. "/assist"
+            form: Form fields, each a list of values (fields can repeat)
+            files: Uploaded files per field, each a dict with filename,
+                content_type and data (bytes)
+            json_body: Parsed JSON body, if any
+            headers: Headers to keep (see CAPTURED_HEADERS)
+            status_code: Response status
+            duration_ms: Time the server took to answer
+            query: Query string parameters, each a list of values
+            body: Raw request body, for uploads that are not form-encoded
+
+        Returns:
+            Entry directory name, or None if the corpus is full
+        """
+        with self._lock:
+            if self.max_entries and self._count >= self.max_entries:
+                return None
+            self._count += 1
+            sequence = self._count
+
+        entry_id = f"{sequence:06d}-{uuid.uuid4().hex[:8]}"
+        entry_dir = os.path.join(self.directory, entry_id)
+        os.makedirs(entry_dir)
+
+        file_entries = {}
+        for field, uploads in files.items():
+            file_entries[field] = []
+            for index, upload in enumerate(uploads):
+                blob_name = f"{field}-{index}"
+                with open(os.path.join(entry_dir, blob_name), 'wb') as f:
+                    f.write(upload['data'])
+                file_entries[field].append({
+                    'filename': upload['filename'],
+                    'content_type': upload['content_type'],
+                    'blob': blob_name
+                })
+
+        if body is not None:
+            with open(os.path.join(entry_dir, BODY_BLOB), 'wb') as f:
+                f.write(body)
+
+        metadata = {
+            'endpoint': endpoint,
+            'captured_at': time.time(),
+            'form': form,
+            'files': file_entries,
+            'json': json_body,
+            'query': query or {},
+            'body': BODY_BLOB if body is not None else None,
+            'headers': headers,
+            'status_code': status_code,
+            'duration_ms': duration_ms
+        }
+        with open(os.path.join(entry_dir, 'request.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        return entry_id
+
+
+def list_entries(directory: str) -> List[str]:
+    """Return the corpus entry directory names in capture order."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, name, 'request.json'))
+    )
+
+
+def load_corpus(directory: str) -> List[dict]:
+    """
+    Load every captured request, in capture order.
+
+    Returns:
+        List of request.json dicts, with each file entry's "data" filled in
+        with the blob bytes, and "body" with the raw body bytes (or None)
+    """
+    corpus = []
+    for entry_id in list_entries(directory):
+        entry_dir = os.path.join(directory, entry_id)
+        with open(os.path.join(entry_dir, 'request.json')) as f:
+            entry = json.load(f)
+
+        for uploads in entry['files'].values():
+            for upload in uploads:
+                with open(os.path.join(entry_dir, upload['blob']), 'rb') as f:
+                    upload['data'] = f.read()
+
+        if entry.get('body'):
+            with open(os.path.join(entry_dir, entry['body']), 'rb') as f:
+                entry['body'] = f.read()
+        else:
+            entry['body'] = None
+        entry.setdefault('query', {})
+
+        entry['id'] = entry_id
+        corpus.append(entry)
+
+    return corpus
+
+
+def install_capture(app, recorder: CaptureRecorder) -> None:
+    """
+    Record every request to CAPTURED_ENDPOINTS once it has been answered.
+
+    Uploaded files are re-read from their spooled streams after the view
+    has run, so capture adds no work before the response is built.
+    """
+
+    @app.before_request
+    def start_capture_timer():
+        g.capture_started = time.monotonic()
+
+    @app.after_request
+    def capture_request(response):
+        if request.method != 'POST' or request.path not in CAPTURED_ENDPOINTS or recorder.full():
+            return response
+
+        try:
+            files = {}
+            for field in request.files:
+                files[field] = []
+                for upload in request.files.getlist(field):
+                    upload.stream.seek(0)
+                    files[field].append({
+                        'filename': upload.filename,
+                        'content_type': upload.content_type,
+                        'data': upload.stream.read()
+                    })
+                    upload.stream.seek(0)
+
+            recorder.record(
+                endpoint=request.path,
+                form={field: request.form.getlist(field) for field in request.form},
+                files=files,
+                json_body=request.get_json(silent=True) if request.is_json else None,
+                headers={name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+                status_code=response.status_code,
+                duration_ms=int((time.monotonic() - g.get('capture_started', time.monotonic())) * 1000),
+                query={param: request.args.getlist(param) for param in request.args},
+                body=g.get('capture_body')
+            )
+        except Exception as e:
+            # Capture is a debugging aid and must never fail the request
+            app.logger.warning(f'Request capture failed: {e}')
+
+        return response
@@ -0,0 +1,133 @@
+"""
+Process-wide registry of Gemini and Speech-to-Text clients.
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional
+from google.cloud import speech
+from langchain_google_genai import ChatGoogleGenerativeAI
+from app.utils.fakes import FakeChatModel, FakeSpeechClient, FaultInjector
+
+
+_chat_models: Dict[tuple, ChatGoogleGenerativeAI] = {}
+_speech_client: Optional[speech.SpeechClient] = None
+_lock = threading.Lock()
+
+# Set by use_fake_backends: (FakeChatModel, FakeSpeechClient), or None for Google
+_fakes: Optional[tuple] = None
+
+
+def call_options(timeout: Optional[float] = None) -> dict:
+    """
+    Keyword arguments for every invoke/stream on a Gemini client.
+
+    retry=None turns off the gRPC method's default retry of UNAVAILABLE
+    (up to 600 s), so Resilience's budget and breakers see every upstream
+    request.
+
+    Args:
+        timeout: RPC timeout in seconds, normally the request's remaining
+            deadline. A blocking call cannot be cancelled, so this is what
+            stops it once the deadline passes.
+    """
+    options = {'retry': None}
+    if timeout is not None:
+        options['timeout'] = max(timeout, 0.001)
+    return options
+
+
+def use_fake_backends(chat_faults: FaultInjector, speech_faults: FaultInjector,
+                      observer: Optional[Callable[[str, float], None]] = None) -> None:
+    """
+    Serve every later get_chat_model/get_speech_client call from the
+    in-process fakes instead of Google (UPSTREAM_BACKEND=fake).
+
+    Args:
+        chat_faults: Latency and faults of Gemini calls
+        speech_faults: Latency and faults of Speech-to-Text calls
+        observer: Called with (stage, seconds) after every fake call
+    """
+    global _fakes
+
+    with _lock:
+        _fakes = (FakeChatModel(chat_faults, observer=observer), FakeSpeechClient(speech_faults, observer=observer))
+
+
+def use_google_backends() -> None:
+    """Undo use_fake_backends."""
+    global _fakes
+
+    with _lock:
+        _fakes = None
+
+
+def get_chat_model(api_key: str, model: str = "gemini-2.5-flash", temperature: float = 0.2,
+                   response_mime_type: Optional[str] = None,
+                   max_tokens: Optional[int] = None) -> ChatGoogleGenerativeAI:
+    """
+    Return the shared chat model for a configuration, creating it on first use.
+
+    One client per (api_key, model, temperature, response_mime_type,
+    max_tokens) is kept per process, so its gRPC channel and TLS session are
+    reused by every request.
+
+    Args:
+        api_key: Gemini API key
+        model: Model name
+        temperature: Sampling temperature
+        response_mime_type: e.g. "application/json" for JSON mode
+        max_tokens: Maximum output tokens
+
+    Returns:
+        ChatGoogleGenerativeAI instance
+    """
+    key = (api_key, model, temperature, response_mime_type, max_tokens)
+
+    with _lock:
+        if _fakes is not None:
+            return _fakes[0]
+
+        client = _chat_models.get(key)
+        if client is None:
+            # One attempt per call: Resilience is the retry layer
+            kwargs = {'model': model, 'google_api_key': api_key, 'temperature': temperature, 'max_retries': 1}
+            if response_mime_type:
+                kwargs['response_mime_type'] = response_mime_type
+            if max_tokens:
+                kwargs['max_tokens'] = max_tokens
+
+            client = ChatGoogleGenerativeAI(**kwargs)
+            _chat_models[key] = client
+
+    return client
+
+
+def get_speech_client() -> speech.SpeechClient:
+    """Return the shared Speech-to-Text client, creating it on first use."""
+    global _speech_client
+
+    with _lock:
+        if _fakes is not None:
+            return _fakes[1]
+        if _speech_client is None:
+            _speech_client = speech.SpeechClient()
+        return _speech_client
+
+
+def reset_clients() -> None:
+    """
+    Forget all cached clients.
+
+    Runs automatically in forked children, since gRPC channels must not be
+    shared across fork(). Also useful in tests. Fake backends stay
+    selected, since they hold no connections.
+    """
+    global _speech_client, _lock
+
+    _chat_models.clear()
+    _speech_client = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_clients)
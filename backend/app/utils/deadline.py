@@ -0,0 +1,96 @@
+"""
+Per-request deadlines carried from the client through every upstream call.
+"""
+import math
+import time
+from typing import Optional, Tuple
+
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before or during a stage."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    A point in time (monotonic clock) by which a request must be answered.
+
+    Checked before expensive stages, and used as the RPC timeout of
+    upstream calls so they give up when it passes.
+    """
+
+    def __init__(self, timeout_seconds: float):
+        self.timeout_seconds = timeout_seconds
+        self.expires_at = time.monotonic() + timeout_seconds
+
+    def remaining(self) -> float:
+        """Seconds left (0 once expired)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str, min_remaining: float = 0) -> None:
+        """
+        Raise DeadlineExceeded unless more than min_remaining seconds are left.
+
+        Use min_remaining before a stage that cannot usefully finish in less
+        time, so the request fails now instead of after a wasted call.
+        """
+        if self.remaining() <= min_remaining:
+            raise DeadlineExceeded(stage)
+
+
+def parse_deadline_header(value: Optional[str], default_seconds: float,
+                          max_seconds: float) -> Tuple[bool, Optional[Deadline], str]:
+    """
+    Build a request deadline from the X-Request-Deadline header.
+
+    The header is the time budget in milliseconds the client is willing to
+    wait (e.g. "4000"). It is relative rather than a wall-clock time so
+    headset clock skew does not matter. Without the header the endpoint's
+    default applies; budgets are capped at max_seconds.
+
+    Args:
+        value: Header value, or None if absent
+        default_seconds: Budget when the header is absent
+        max_seconds: Upper bound on any budget
+
+    Returns:
+        Tuple of (is_valid, deadline, error_message)
+    """
+    if value is None or not value.strip():
+        return True, Deadline(min(default_seconds, max_seconds)), ""
+
+    try:
+        budget_ms = float(value.strip())
+    except ValueError:
+        return False, None, f"{DEADLINE_HEADER} must be a number of milliseconds"
+
+    if not math.isfinite(budget_ms) or budget_ms <= 0:
+        return False, None, f"{DEADLINE_HEADER} must be a positive number of milliseconds"
+
+    return True, Deadline(min(budget_ms / 1000, max_seconds)), ""
+
+
+def deadline_exceeded_body(stage: str, session_id: Optional[str]) -> dict:
+    """
+    Degraded response for a request whose deadline passed.
+
+    Headset clients show message and let the user retry, instead of waiting
+    on a call that will not finish in time.
+    """
+    return {
+        'status': 'error',
+        'error': 'Request deadline exceeded',
+        'error_code': 'DEADLINE_EXCEEDED',
+        'stage': stage,
+        'message': 'This is taking too long. Please try again.',
+        'retryable': True,
+        'session_id': session_id
+    }
@@ -0,0 +1,247 @@
+"""
+In-process stand-ins for Gemini and Speech-to-Text with latency and fault injection.
+
+Selected with UPSTREAM_BACKEND=fake (see clients.use_fake_backends). They
+implement the parts of the client interfaces the app uses, so the
+workflow, /ask and transcription code paths run unchanged, including
+retries, circuit breakers, hedging and deadlines.
+"""
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple, Union
+from google.api_core import exceptions as google_exceptions
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+# Schema-valid /assist answer (see json_stream.INSTRUCTION_RESPONSE_SCHEMA)
+CANNED_INSTRUCTION = {
+    "image_analysis": "An open PC case with the power supply bay on the lower left.",
+    "instruction": {
+        "steps": ["Slide the PSU into the bay, fan facing down", "Fasten the four screws at the back"],
+        "target_id": "psu_bay",
+        "haptic_cue": "guide_to_target"
+    }
+}
+
+CANNED_ANSWER = "The 24-pin connector goes into the long socket on the right edge of the motherboard."
+
+CANNED_TRANSCRIPT = "Where does the power cable go?"
+
+OUTCOMES = ('ok', 'rate_limit', 'timeout', 'malformed')
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec: "0.8" or "fixed:0.8" (seconds), "uniform:0.2,1.5",
+            or "lognormal:0.8,0.5" (median seconds, sigma)
+
+    Returns:
+        Function drawing one latency in seconds from a Random
+
+    Raises:
+        ValueError: If the spec is malformed
+    """
+    kind, _, params = spec.partition(':')
+    if not params:
+        kind, params = 'fixed', kind
+
+    try:
+        values = [float(value) for value in params.split(',')]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2 and values[0] > 0:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+class FaultInjector:
+    """
+    Draws a latency and an outcome for every fake upstream call.
+
+    Outcomes are "ok", "rate_limit" (429 ResourceExhausted), "timeout"
+    (hangs for timeout_seconds, then 504 DeadlineExceeded) and "malformed"
+    (truncated JSON, empty text or no transcript).
+    """
+
+    def __init__(self, latency: Union[str, Callable[[random.Random], float]] = '0',
+                 rate_limit_rate: float = 0.0, timeout_rate: float = 0.0, malformed_rate: float = 0.0,
+                 timeout_seconds: float = 30.0, seed: Optional[int] = None):
+        """
+        Initialize the injector.
+
+        Args:
+            latency: Latency distribution spec (see parse_latency), or a
+                function drawing seconds from a Random
+            rate_limit_rate: Fraction of calls failing with 429
+            timeout_rate: Fraction of calls that time out
+            malformed_rate: Fraction of calls returning malformed output
+            timeout_seconds: How long a timed-out call hangs
+            seed: Random seed, for repeatable runs
+        """
+        self._latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.rates = {'rate_limit': rate_limit_rate, 'timeout': timeout_rate, 'malformed': malformed_rate}
+        self.timeout_seconds = timeout_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+
+    def draw(self) -> Tuple[float, str]:
+        """Return (latency seconds, outcome) for the next call."""
+        with self._lock:
+            latency = max(0.0, self._latency(self._rng))
+            roll = self._rng.random()
+            outcome = 'ok'
+            for name, rate in self.rates.items():
+                if roll < rate:
+                    outcome = name
+                    break
+                roll -= rate
+            self.counts[outcome] += 1
+        return latency, outcome
+
+    def hang_seconds(self, timeout: Optional[float]) -> float:
+        """How long a timed-out call hangs: the caller's timeout if shorter."""
+        return min(self.timeout_seconds, timeout) if timeout else self.timeout_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+def _rate_limited() -> Exception:
+    return google_exceptions.ResourceExhausted('Resource has been exhausted (fake upstream)')
+
+
+def _timed_out() -> Exception:
+    return google_exceptions.DeadlineExceeded('Deadline Exceeded (fake upstream)')
+
+
+class FakeChatModel:
+    """
+    Stand-in for ChatGoogleGenerativeAI.
+
+    Returns CANNED_ANSWER as text, or CANNED_INSTRUCTION as JSON once bound
+    with a JSON generation_config, as VRContextWorkflow.llm does.
+    """
+
+    def __init__(self, faults: FaultInjector, json_output: bool = False,
+                 observer: Optional[Callable[[str, float], None]] = None):
+        """
+        Initialize the fake model.
+
+        Args:
+            faults: Latency and fault source
+            json_output: Return the /assist JSON instead of a text answer
+            observer: Called with (stage, seconds) after every call; stage
+                is "assist_model" for JSON output, "ask_model" otherwise
+        """
+        self.faults = faults
+        self.json_output = json_output
+        self.observer = observer
+
+    @property
+    def stage(self) -> str:
+        return 'assist_model' if self.json_output else 'ask_model'
+
+    def bind(self, generation_config: Optional[dict] = None, **kwargs) -> 'FakeChatModel':
+        json_output = (generation_config or {}).get('response_mime_type') == 'application/json'
+        return FakeChatModel(self.faults, json_output or self.json_output, self.observer)
+
+    def invoke(self, messages, **kwargs) -> AIMessage:
+        latency, outcome = self.faults.draw()
+        if outcome == 'timeout':
+            time.sleep(self.faults.hang_seconds(kwargs.get('timeout')))
+            raise _timed_out()
+        time.sleep(latency)
+        return self._respond(outcome, latency)
+
+    def stream(self, messages, **kwargs):
+        latency, outcome = self.faults.draw()
+        if outcome == 'timeout':
+            time.sleep(self.faults.hang_seconds(kwargs.get('timeout')))
+            raise _timed_out()
+        if outcome == 'rate_limit':
+            time.sleep(latency)
+            raise _rate_limited()
+
+        content = self._content(outcome)
+        chunk_count = 8
+        chunk_size = max(1, math.ceil(len(content) / chunk_count))
+        for start in range(0, len(content), chunk_size):
+            time.sleep(latency / chunk_count)
+            yield AIMessageChunk(content=content[start:start + chunk_size])
+        self._observe(latency)
+
+    def _respond(self, outcome: str, latency: float) -> AIMessage:
+        if outcome == 'rate_limit':
+            raise _rate_limited()
+        self._observe(latency)
+        return AIMessage(content=self._content(outcome))
+
+    def _content(self, outcome: str) -> str:
+        if not self.json_output:
+            return '' if outcome == 'malformed' else CANNED_ANSWER
+
+        content = json.dumps(CANNED_INSTRUCTION)
+        if outcome == 'malformed':
+            # Cut off mid-response, like a generation that hit max_tokens
+            return content[:len(content) // 2]
+        return content
+
+    def _observe(self, latency: float) -> None:
+        if self.observer is not None:
+            self.observer(self.stage, latency)
+
+
+class FakeSpeechClient:
+    """Stand-in for speech.SpeechClient.recognize, returning CANNED_TRANSCRIPT."""
+
+    def __init__(self, faults: FaultInjector, transcript: str = CANNED_TRANSCRIPT,
+                 observer: Optional[Callable[[str, float], None]] = None):
+        """
+        Initialize the fake client.
+
+        Args:
+            faults: Latency and fault source
+            transcript: Text every successful recognition returns
+            observer: Called with ("stt", seconds) after every call
+        """
+        self.faults = faults
+        self.transcript = transcript
+        self.observer = observer
+
+    def recognize(self, config=None, audio=None, timeout: Optional[float] = None, **kwargs) -> SimpleNamespace:
+        """Return an object shaped like speech.RecognizeResponse (results[].alternatives[].transcript)."""
+        latency, outcome = self.faults.draw()
+        if outcome == 'timeout':
+            time.sleep(self.faults.hang_seconds(timeout))
+            raise _timed_out()
+        time.sleep(latency)
+        if outcome == 'rate_limit':
+            raise _rate_limited()
+
+        if self.observer is not None:
+            self.observer('stt', latency)
+        if outcome == 'malformed':
+            # Nothing recognised, as for silent or unintelligible audio
+            return SimpleNamespace(results=[])
+        return SimpleNamespace(results=[
+            SimpleNamespace(alternatives=[SimpleNamespace(transcript=self.transcript, confidence=0.95)])
+        ])
+
+
+def fake_probe() -> None:
+    """Health probe for the fake upstreams, which are always reachable."""
@@ -0,0 +1,186 @@
+"""
+Gaze-guided foveated cropping of snapshots before the LLM call.
+"""
+import math
+from PIL import Image
+from typing import Optional, Tuple
+
+from app.utils.image_processing import ResizePolicy, estimate_image_tokens
+
+
+def project_gaze(gaze_vector: dict, fov_degrees: Tuple[float, float]) -> Optional[Tuple[float, float]]:
+    """
+    Project a head-relative gaze direction onto normalized image coordinates.
+
+    Uses a pinhole model of the passthrough camera: +x is right, +y is up and
+    +z is forward.
+
+    Args:
+        gaze_vector: {"x": float, "y": float, "z": float}
+        fov_degrees: (horizontal, vertical) field of view of the camera
+
+    Returns:
+        (u, v) in [0, 1] with (0, 0) at the top-left, or None if the gaze
+        does not point into the camera's view
+    """
+    x, y, z = (float(gaze_vector.get(axis, 0)) for axis in ('x', 'y', 'z'))
+    if z <= 0:
+        return None
+
+    half_width = math.tan(math.radians(fov_degrees[0]) / 2)
+    half_height = math.tan(math.radians(fov_degrees[1]) / 2)
+
+    u = 0.5 + (x / z) / (2 * half_width)
+    v = 0.5 - (y / z) / (2 * half_height)
+
+    if not (0 <= u <= 1 and 0 <= v <= 1):
+        return None
+
+    return u, v
+
+
+class FoveatedSnapshot:
+    """
+    The encoded high-resolution crop around the gaze point.
+
+    Attributes:
+        data: Encoded crop bytes
+        mime_type: MIME type of data
+        box: (left, top, right, bottom) of the crop in original image pixels
+        dimensions: (width, height) of the encoded crop
+    """
+
+    def __init__(self, data: bytes, mime_type: str, box: Tuple[int, int, int, int],
+                 dimensions: Tuple[int, int]):
+        self.data = data
+        self.mime_type = mime_type
+        self.box = box
+        self.dimensions = dimensions
+
+
+class FoveationPolicy:
+    """
+    Splits a snapshot into a low-resolution context frame plus a
+    high-resolution crop centred on where the user is looking.
+
+    This buys detail, not tokens. Gemini bills every image at least one
+    258-token tile, so the two images cost at least 516 tokens. The default
+    ResizePolicy sends the whole frame as one 768px tile for 258. With the
+    defaults, the crop shows the gaze area at roughly twice the linear
+    resolution of the full 768px frame.
+    """
+
+    def __init__(self, fov_degrees: Tuple[float, float] = (80, 80), crop_fraction: float = 0.35,
+                 fovea_size: Tuple[int, int] = (384, 384), context_size: Tuple[int, int] = (384, 384),
+                 output_format: str = 'JPEG', quality: int = 85):
+        """
+        Initialize the policy.
+
+        Args:
+            fov_degrees: (horizontal, vertical) field of view of the passthrough camera
+            crop_fraction: Side of the square crop as a fraction of the shorter image side
+            fovea_size: Maximum (width, height) of the encoded crop
+            context_size: Maximum (width, height) of the downscaled context frame
+            output_format: 'JPEG' or 'WEBP'
+            quality: Encoder quality for both images
+        """
+        self.fov_degrees = tuple(fov_degrees)
+        self.crop_fraction = crop_fraction
+        self.context_policy = ResizePolicy(target_size=context_size, max_tiles=0,
+                                           output_format=output_format, quality=quality)
+        self.fovea_policy = ResizePolicy(target_size=fovea_size, max_tiles=0,
+                                         output_format=output_format, quality=quality)
+
+    @property
+    def decode_size(self) -> Tuple[int, int]:
+        """
+        Smallest decode size at which the crop still has full fovea resolution.
+
+        Pass this to ingest_image so JPEG draft decoding does not throw away
+        detail the crop needs.
+        """
+        fovea_w, fovea_h = self.fovea_policy.target_size
+        return (math.ceil(fovea_w / self.crop_fraction), math.ceil(fovea_h / self.crop_fraction))
+
+    def crop_box(self, image_size: Tuple[int, int], center: Tuple[float, float]) -> Tuple[int, int, int, int]:
+        """
+        Compute the square crop around a normalized gaze point, shifted to stay inside the image.
+
+        Args:
+            image_size: (width, height) of the decoded image
+            center: (u, v) gaze point in [0, 1]
+
+        Returns:
+            (left, top, right, bottom) in image pixels
+        """
+        width, height = image_size
+        side = max(1, int(min(width, height) * self.crop_fraction))
+
+        left = min(max(0, round(center[0] * width - side / 2)), width - side)
+        top = min(max(0, round(center[1] * height - side / 2)), height - side)
+
+        return left, top, left + side, top + side
+
+    def crop(self, img: Image.Image, gaze_vector: dict,
+             original_dimensions: Tuple[int, int]) -> Optional[FoveatedSnapshot]:
+        """
+        Encode the high-resolution crop around the gaze point.
+
+        Args:
+            img: Decoded image (possibly DCT-downscaled)
+            gaze_vector: Head-relative gaze direction
+            original_dimensions: (width, height) of the upload, used to report the crop box
+
+        Returns:
+            FoveatedSnapshot, or None if the gaze does not land in the image
+        """
+        center = project_gaze(gaze_vector, self.fov_degrees)
+        if center is None:
+            return None
+
+        box = self.crop_box(img.size, center)
+        data, _ = self.fovea_policy.apply(img.crop(box))
+
+        # Report the box in upload coordinates even if the decode was downscaled
+        scale_x = original_dimensions[0] / img.width
+        scale_y = original_dimensions[1] / img.height
+        original_box = (
+            int(box[0] * scale_x), int(box[1] * scale_y),
+            int(box[2] * scale_x), int(box[3] * scale_y)
+        )
+        dimensions = self.fovea_policy.target_dimensions(box[2] - box[0], box[3] - box[1])
+
+        return FoveatedSnapshot(data, self.fovea_policy.mime_type, original_box, dimensions)
+
+
+def foveation_report(baseline_dimensions: Tuple[int, int], context_bytes: int,
+                     context_dimensions: Tuple[int, int], fovea: FoveatedSnapshot) -> dict:
+    """
+    Summarize what foveation sent compared to the non-foveated request.
+
+    Tokens are compared with the ResizePolicy output for the same frame, not
+    the raw upload. tokens_saved is negative when foveation costs more, which
+    it does for the default sizes (see FoveationPolicy). Bytes are not
+    compared, since that would mean encoding the frame a second time.
+
+    Args:
+        baseline_dimensions: (width, height) the ResizePolicy would send for the frame
+        context_bytes: Size of the encoded context frame
+        context_dimensions: (width, height) of the context frame
+        fovea: The encoded crop
+
+    Returns:
+        Dict with byte totals and baseline/output token estimates
+    """
+    baseline_tokens = estimate_image_tokens(*baseline_dimensions)
+    output_tokens = estimate_image_tokens(*context_dimensions) + estimate_image_tokens(*fovea.dimensions)
+
+    return {
+        'context_bytes': context_bytes,
+        'fovea_bytes': len(fovea.data),
+        'output_bytes': context_bytes + len(fovea.data),
+        'baseline_tokens': baseline_tokens,
+        'output_tokens': output_tokens,
+        'tokens_saved': baseline_tokens - output_tokens,
+        'fovea_box': list(fovea.box)
+    }
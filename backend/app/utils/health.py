@@ -0,0 +1,171 @@
+"""
+Cached upstream health for the liveness, readiness and /health endpoints.
+"""
+import socket
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+
+GEMINI_MODELS_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}"
+SPEECH_HOST = "speech.googleapis.com"
+
+
+def gemini_probe(api_key: str, model: str = "gemini-2.5-flash", timeout: float = 5) -> Callable[[], None]:
+    """
+    Build a probe that fetches the model's metadata.
+
+    models.get does not generate anything, so it checks reachability and the
+    API key without using generation quota.
+    """
+    def probe():
+        request = urllib.request.Request(
+            GEMINI_MODELS_URL.format(model=model),
+            headers={'x-goog-api-key': api_key}
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+
+    return probe
+
+
+def speech_probe(timeout: float = 5) -> Callable[[], None]:
+    """Build a probe that opens a TCP connection to the Speech-to-Text endpoint."""
+    def probe():
+        socket.create_connection((SPEECH_HOST, 443), timeout=timeout).close()
+
+    return probe
+
+
+class UpstreamHealthMonitor:
+    """
+    Tracks upstream health from background probes and real traffic.
+
+    Probes run on a daemon thread every interval_seconds. Request handlers
+    report each upstream call with record(). Reads only return cached
+    state, so health endpoints never call an upstream.
+
+    Status per upstream:
+    - "down": the latest probe failed
+    - "degraded": at least error_rate_threshold of the calls in the last
+      window_seconds failed (given at least min_requests calls)
+    - "ok": otherwise, once there has been a probe or traffic
+    - "unknown": nothing observed yet
+    """
+
+    def __init__(self, probes: Dict[str, Callable[[], None]], interval_seconds: float = 60,
+                 window_seconds: float = 300, error_rate_threshold: float = 0.5, min_requests: int = 5):
+        """
+        Initialize the monitor.
+
+        Args:
+            probes: Upstream name -> callable that raises if the upstream is unreachable
+            interval_seconds: Time between probe rounds
+            window_seconds: Traffic window for the error rate
+            error_rate_threshold: Error rate at which an upstream is degraded
+            min_requests: Calls needed in the window before the error rate counts
+        """
+        self.probes = probes
+        self.interval_seconds = interval_seconds
+        self.window_seconds = window_seconds
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+
+        self._calls: Dict[str, deque] = {}  # name -> deque of (monotonic time, ok)
+        self._probe_results: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, name: str, ok: bool) -> None:
+        """Record the outcome of one real upstream call."""
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.setdefault(name, deque())
+            calls.append((now, ok))
+            self._trim(calls, now)
+
+    def probe_now(self) -> None:
+        """Run every probe once and cache the results."""
+        for name, probe in self.probes.items():
+            started = time.monotonic()
+            try:
+                probe()
+                result = {'ok': True, 'error': None}
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+
+            result['latency_ms'] = int((time.monotonic() - started) * 1000)
+            result['checked_at'] = datetime.utcnow().isoformat() + 'Z'
+
+            with self._lock:
+                self._probe_results[name] = result
+
+    def status(self, name: str) -> dict:
+        """Return the cached status of one upstream."""
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.get(name, deque())
+            self._trim(calls, now)
+            total = len(calls)
+            errors = sum(1 for _, ok in calls if not ok)
+            probe = self._probe_results.get(name)
+
+        error_rate = errors / total if total else 0.0
+
+        if probe is not None and not probe['ok']:
+            status = 'down'
+        elif total >= self.min_requests and error_rate >= self.error_rate_threshold:
+            status = 'degraded'
+        elif probe is None and total == 0:
+            status = 'unknown'
+        else:
+            status = 'ok'
+
+        return {
+            'status': status,
+            'error_rate': round(error_rate, 3),
+            'requests': total,
+            'last_probe': probe
+        }
+
+    def snapshot(self) -> dict:
+        """Return the cached status of every probed or recorded upstream."""
+        with self._lock:
+            names = set(self.probes) | set(self._calls)
+        return {name: self.status(name) for name in sorted(names)}
+
+    def start(self) -> None:
+        """Start the background probe thread (no-op if already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='upstream-health-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background probe thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_seconds)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.probe_now()
+            self._stop.wait(self.interval_seconds)
+
+    def _trim(self, calls: deque, now: float) -> None:
+        """Drop calls older than the window. Caller must hold the lock."""
+        while calls and now - calls[0][0] > self.window_seconds:
+            calls.popleft()
+
+
+def record_upstream(app, name: str, ok: bool) -> None:
+    """Report an upstream call outcome to the app's monitor, if there is one."""
+    monitor = getattr(app, 'upstream_monitor', None)
+    if monitor is not None:
+        monitor.record(name, ok)
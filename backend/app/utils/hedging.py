@@ -0,0 +1,194 @@
+"""
+Hedged requests: start a second identical model call when the first is slow.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Optional, TypeVar
+
+
+T = TypeVar('T')
+
+
+class HedgePolicy:
+    """
+    Issue a backup call once the primary has run longer than a percentile of
+    recent latencies, and return whichever valid result arrives first.
+
+    Hedges are paid for from a token bucket: every request adds budget_ratio
+    tokens (up to max_tokens) and every hedge spends one, so at most about
+    budget_ratio extra calls are made per request on average.
+
+    Once hedging has started, each call runs on its own thread so the
+    caller can start the hedge while the primary is still waiting. The
+    losing call is abandoned, not stopped: it keeps going upstream until it
+    returns or its RPC timeout (see call_timeout) expires. Each hedge is
+    therefore a full extra upstream request.
+    """
+
+    def __init__(self, percentile: float = 0.95, budget_ratio: float = 0.05, min_samples: int = 20,
+                 min_delay: float = 0.5, window: int = 200, max_tokens: float = 10,
+                 max_call_seconds: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the policy.
+
+        Args:
+            percentile: Latency percentile (0-1) after which the hedge is sent
+            budget_ratio: Extra calls allowed per request (0.05 = 5%)
+            min_samples: Latencies needed before hedging starts
+            min_delay: Never hedge earlier than this many seconds
+            window: Number of recent latencies kept
+            max_tokens: Cap on saved-up hedge budget
+            max_call_seconds: RPC timeout for each hedged call, which bounds
+                how long an abandoned loser keeps running (None = no cap)
+            clock: Monotonic clock (overridable in tests)
+        """
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_tokens = max_tokens
+        self.max_call_seconds = max_call_seconds
+        self._clock = clock
+
+        self._latencies: deque = deque(maxlen=window)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.abandoned = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None until there are enough samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def call_timeout(self, remaining: Optional[float] = None) -> Optional[float]:
+        """
+        RPC timeout for a hedged call: the tighter of max_call_seconds and
+        the time left before the request deadline.
+
+        Args:
+            remaining: Seconds left before the deadline (None = no deadline)
+
+        Returns:
+            Timeout in seconds, or None for no limit
+        """
+        limits = [limit for limit in (self.max_call_seconds, remaining) if limit is not None]
+        return min(limits) if limits else None
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def run(self, call: Callable[[], T], is_valid: Callable[[T], bool] = lambda result: True) -> T:
+        """
+        Run call(), hedging with a second call() if the first is slow.
+
+        The first call to return a result accepted by is_valid wins and the
+        other is abandoned (see the class docstring). If neither is valid,
+        the primary's outcome is returned (or raised).
+
+        Args:
+            call: Factory for the model call; invoked once or twice. It
+                should bound the call with call_timeout()
+            is_valid: Returns False for results that should not win (e.g. truncated JSON)
+
+        Returns:
+            The winning result
+        """
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.budget_ratio)
+
+        delay = self.hedge_delay()
+        if delay is None:
+            # Still collecting latencies: no hedge is possible, so call on this thread
+            started = self._clock()
+            result = call()
+            self.record_latency(self._clock() - started)
+            return result
+
+        primary = self._start(call)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._spend_token():
+            # No hedge was launched, so there is no race to win
+            result, elapsed = primary.result()
+            self.record_latency(elapsed)
+            return result
+
+        hedge = self._start(call)
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None and is_valid(future.result()[0]):
+                        result, elapsed = future.result()
+                        self.record_latency(elapsed)
+                        with self._lock:
+                            if future is hedge:
+                                self.hedge_wins += 1
+                            else:
+                                self.primary_wins += 1
+                        return result
+        finally:
+            if pending:
+                with self._lock:
+                    self.abandoned += len(pending)
+
+        return primary.result()[0]
+
+    def stats(self) -> dict:
+        """Return hedge counters. hedge_wins and primary_wins count hedged requests only."""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'primary_wins': self.primary_wins,
+                'abandoned': self.abandoned,
+                'hedge_delay': delay
+            }
+
+    def _spend_token(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _start(self, call: Callable[[], T]) -> Future:
+        """
+        Start call() on a new thread (carrying the caller's trace context).
+        The future's result is (result, elapsed seconds).
+
+        A thread per call rather than a pool, so a hedge never queues behind
+        the slow calls it is meant to work around.
+        """
+        future: Future = Future()
+        context = contextvars.copy_context()
+
+        def timed():
+            started = self._clock()
+            try:
+                result = call()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result((result, self._clock() - started))
+
+        threading.Thread(target=context.run, args=(timed,), name='hedged-call', daemon=True).start()
+        return future
@@ -2,32 +2,347 @@
 Image processing utilities for the backend API.
 """
 import io
+import math
 from PIL import Image
-from typing import Tuple
+from typing import Optional, Tuple
 
+from app.utils.metrics import stage_timer
 
-def compress_image(image_bytes: bytes, target_size: Tuple[int, int] = (768, 768)) -> bytes:
+
+SUPPORTED_IMAGE_TYPES = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG'
+}
+SUPPORTED_MIME_TYPES = {image_format: mime for mime, image_format in SUPPORTED_IMAGE_TYPES.items()}
+
+
+# Gemini bills images by 768x768 tile; images up to 384px on both sides are one tile
+TILE_SIZE = 768
+SMALL_IMAGE_SIZE = 384
+TOKENS_PER_TILE = 258
+
+OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp'
+}
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimate the vision tokens Gemini charges for an image.
+    
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        
+    Returns:
+        Estimated token count
+    """
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return TOKENS_PER_TILE
+    
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return tiles * TOKENS_PER_TILE
+
+
+class CompressionReport:
+    """
+    Before/after sizes for one image run through a ResizePolicy.
+    """
+    
+    def __init__(self, original_bytes: int, output_bytes: int, original_dimensions: Tuple[int, int],
+                 output_dimensions: Tuple[int, int], output_format: str, quality: Optional[int]):
+        self.original_bytes = original_bytes
+        self.output_bytes = output_bytes
+        self.original_dimensions = original_dimensions
+        self.output_dimensions = output_dimensions
+        self.output_format = output_format
+        self.quality = quality
+        self.original_tokens = estimate_image_tokens(*original_dimensions)
+        self.output_tokens = estimate_image_tokens(*output_dimensions)
+    
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.output_bytes
+    
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.output_tokens
+    
+    def to_dict(self) -> dict:
+        return {
+            'original_bytes': self.original_bytes,
+            'output_bytes': self.output_bytes,
+            'bytes_saved': self.bytes_saved,
+            'original_dimensions': list(self.original_dimensions),
+            'output_dimensions': list(self.output_dimensions),
+            'original_tokens': self.original_tokens,
+            'output_tokens': self.output_tokens,
+            'tokens_saved': self.tokens_saved,
+            'output_format': self.output_format,
+            'quality': self.quality
+        }
+
+
+class ResizePolicy:
+    """
+    Decides the output resolution, format and quality for snapshots sent to the model.
+    
+    Every image is scaled to fit both target_size and the max_tiles vision
+    token budget. It is then encoded as output_format at the highest quality
+    (between min_quality and quality) that fits within max_bytes.
+    """
+    
+    def __init__(self, target_size: Tuple[int, int] = (768, 768), max_tiles: int = 1,
+                 output_format: str = 'JPEG', quality: int = 85, min_quality: int = 40,
+                 max_bytes: int = 0):
+        """
+        Initialize the policy.
+        
+        Args:
+            target_size: Maximum (width, height) of the output
+            max_tiles: Maximum number of 768x768 model tiles (0 disables the tile budget)
+            output_format: 'JPEG' or 'WEBP'
+            quality: Starting (and highest) encoder quality
+            min_quality: Lowest quality the byte-budget search may use
+            max_bytes: Byte budget for the encoded image (0 disables the search)
+        """
+        output_format = output_format.upper()
+        if output_format not in OUTPUT_MIME_TYPES:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        
+        self.target_size = tuple(target_size)
+        self.max_tiles = max_tiles
+        self.output_format = output_format
+        self.quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.max_bytes = max_bytes
+    
+    @property
+    def mime_type(self) -> str:
+        return OUTPUT_MIME_TYPES[self.output_format]
+    
+    def target_dimensions(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Compute the output size for an image, preserving aspect ratio.
+        
+        Args:
+            width: Source width
+            height: Source height
+            
+        Returns:
+            (width, height) that fits target_size and the tile budget
+        """
+        scale = min(1.0, self.target_size[0] / width, self.target_size[1] / height)
+        out_w, out_h = max(1, int(width * scale)), max(1, int(height * scale))
+        
+        if self.max_tiles > 0:
+            while estimate_image_tokens(out_w, out_h) > self.max_tiles * TOKENS_PER_TILE:
+                scale *= 0.9
+                out_w, out_h = max(1, int(width * scale)), max(1, int(height * scale))
+        
+        return out_w, out_h
+    
+    def can_pass_through(self, data: bytes, source_format: str, dimensions: Tuple[int, int]) -> bool:
+        """True if the upload already satisfies the policy and can be sent unchanged."""
+        return (
+            source_format == self.output_format
+            and self.target_dimensions(*dimensions) == tuple(dimensions)
+            and (not self.max_bytes or len(data) <= self.max_bytes)
+        )
+    
+    def apply(self, img: Image.Image) -> Tuple[bytes, Optional[int]]:
+        """
+        Resize and encode a decoded image.
+        
+        Args:
+            img: Decoded PIL image
+            
+        Returns:
+            Tuple of (encoded_bytes, quality_used)
+        """
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        size = self.target_dimensions(*img.size)
+        if size != img.size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        
+        encoded = self._encode(img, self.quality)
+        if not self.max_bytes or len(encoded) <= self.max_bytes:
+            return encoded, self.quality
+        
+        # Binary search for the highest quality that fits the byte budget
+        best, best_quality = None, None
+        low, high = self.min_quality, self.quality - 1
+        while low <= high:
+            mid = (low + high) // 2
+            candidate = self._encode(img, mid)
+            if len(candidate) <= self.max_bytes:
+                best, best_quality = candidate, mid
+                low = mid + 1
+            else:
+                high = mid - 1
+        
+        if best is None:
+            return self._encode(img, self.min_quality), self.min_quality
+        
+        return best, best_quality
+    
+    def _encode(self, img: Image.Image, quality: int) -> bytes:
+        output = io.BytesIO()
+        if self.output_format == 'JPEG':
+            img.save(output, format='JPEG', quality=quality, optimize=True)
+        else:
+            img.save(output, format='WEBP', quality=quality, method=4)
+        return output.getvalue()
+
+
+class IngestedImage:
+    """
+    A snapshot that has been read, decoded and (if needed) re-encoded once.
+    
+    Attributes:
+        data: Image bytes to send to the model
+        image: Decoded PIL image (may be DCT-downscaled for JPEG)
+        format: Source format ('JPEG' or 'PNG')
+        mime_type: MIME type of data
+        report: CompressionReport with bytes and estimated tokens saved
+    """
+    
+    def __init__(self, data: bytes, image: Image.Image, format: str, mime_type: str,
+                 report: CompressionReport):
+        self.data = data
+        self.image = image
+        self.format = format
+        self.mime_type = mime_type
+        self.report = report
+    
+    @property
+    def reencoded(self) -> bool:
+        return self.report.quality is not None
+
+
+def ingest_image(file, max_size: int = 5 * 1024 * 1024, policy: Optional[ResizePolicy] = None,
+                 decode_size: Optional[Tuple[int, int]] = None) -> Tuple[bool, Optional[IngestedImage], str]:
+    """
+    Read, validate and compress an uploaded image with a single decode.
+    
+    The upload is read once. Decoding it fully is the validation step, and the
+    decoded image is reused to apply the resize policy. JPEGs use PIL draft
+    mode, so the decoder does DCT-domain downscaling straight to the policy's
+    target size. Uploads that already meet the policy are sent unchanged.
+    
+    Args:
+        file: FileStorage object from Flask request
+        max_size: Maximum upload size in bytes
+        policy: ResizePolicy to apply (default: ResizePolicy())
+        decode_size: Minimum size to keep when decoding, for callers that
+            need more detail from the decoded image than the policy output
+        
+    Returns:
+        Tuple of (is_valid, ingested_image, error_message)
+    """
+    # Check file type
+    if file.content_type not in SUPPORTED_IMAGE_TYPES:
+        return False, None, "Invalid image type. Must be JPEG or PNG"
+    
+    # Read once, one byte past the limit so oversized uploads are detected
+    file.seek(0)
+    data = file.read(max_size + 1)
+    
+    return ingest_image_data(data, max_size, policy, decode_size)
+
+
+def read_stream(stream, max_size: int, content_length: Optional[int] = None,
+                chunk_size: int = 64 * 1024) -> Tuple[bool, Optional[bytes], str]:
     """
-    Compresses image to target size while maintaining aspect ratio.
+    Read a raw upload body in chunks, stopping as soon as it passes max_size.
+    
+    A declared Content-Length over the limit is rejected before anything is
+    read, and the limit is enforced again while reading in case the header
+    is missing or wrong.
     
     Args:
-        image_bytes: Original image bytes
-        target_size: Target size tuple (width, height)
+        stream: Readable body stream (e.g. request.stream)
+        max_size: Maximum body size in bytes
+        content_length: Declared body size, if known
+        chunk_size: Bytes per read
         
     Returns:
-        Compressed image bytes (JPEG format)
+        Tuple of (is_valid, data, error_message)
     """
-    img = Image.open(io.BytesIO(image_bytes))
+    too_large = f"Image too large. Maximum {max_size // (1024 * 1024)}MB"
+    if content_length is not None and content_length > max_size:
+        return False, None, too_large
     
-    # Convert RGBA to RGB if needed
-    if img.mode == 'RGBA':
-        img = img.convert('RGB')
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(min(chunk_size, max_size + 1 - size))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            return False, None, too_large
     
-    # Resize maintaining aspect ratio
-    img.thumbnail(target_size, Image.Resampling.LANCZOS)
+    # A single chunk is used as is, without a join copy
+    if len(chunks) == 1:
+        return True, chunks[0], ""
+    return True, b''.join(chunks), ""
+
+
+def ingest_image_data(data: bytes, max_size: int = 5 * 1024 * 1024, policy: Optional[ResizePolicy] = None,
+                      decode_size: Optional[Tuple[int, int]] = None) -> Tuple[bool, Optional[IngestedImage], str]:
+    """
+    Validate and compress image bytes that have already been read.
     
-    # Compress to JPEG
-    output = io.BytesIO()
-    img.save(output, format='JPEG', quality=85, optimize=True)
+    Same as ingest_image, for uploads that are not a multipart file (raw
+    request bodies). The format is taken from the image itself.
     
-    return output.getvalue()
+    Returns:
+        Tuple of (is_valid, ingested_image, error_message)
+    """
+    policy = policy or ResizePolicy()
+    
+    # The full decode is the validation step
+    with stage_timer('image_validation'):
+        if len(data) > max_size:
+            return False, None, f"Image too large. Maximum {max_size // (1024 * 1024)}MB"
+        
+        if not data:
+            return False, None, "Invalid image file: empty upload"
+        
+        try:
+            img = Image.open(io.BytesIO(data))
+            source_format = img.format
+            if source_format not in SUPPORTED_IMAGE_TYPES.values():
+                return False, None, f"Invalid image file: unsupported format {source_format}"
+            
+            original_dimensions = img.size
+            pass_through = policy.can_pass_through(data, source_format, original_dimensions)
+            
+            # DCT-scaled decode: to the output size when re-encoding, otherwise
+            # the smallest scale, which still checks the whole JPEG stream
+            if decode_size:
+                img.draft('RGB', decode_size)
+            else:
+                img.draft('RGB', (1, 1) if pass_through else policy.target_dimensions(*original_dimensions))
+            img.load()
+            
+        except Exception as e:
+            return False, None, f"Invalid image file: {str(e)}"
+    
+    if pass_through:
+        report = CompressionReport(len(data), len(data), original_dimensions, original_dimensions,
+                                   source_format, None)
+        return True, IngestedImage(data, img, source_format, SUPPORTED_MIME_TYPES[source_format], report), ""
+    
+    with stage_timer('compression'):
+        output, quality = policy.apply(img)
+    report = CompressionReport(len(data), len(output), original_dimensions,
+                               policy.target_dimensions(*img.size), policy.output_format, quality)
+    
+    return True, IngestedImage(output, img, source_format, policy.mime_type, report), ""
+
@@ -0,0 +1,145 @@
+"""
+In-process blob store for request images.
+
+Snapshots are stored once as raw bytes and passed through the workflow as
+small ImageHandle references. Messages refer to images by a "blob:" URL;
+the base64 data URLs the Gemini client needs are only built by
+materialize(), right before the call, and dropped with the call's
+message list. A request keeps one copy of each image instead of the
+upload, a base64 string, a data URL and the copy held in state["messages"].
+"""
+import base64
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from langchain_core.messages import BaseMessage
+
+from app.utils.metrics import stage_timer
+
+
+BLOB_URL_PREFIX = 'blob:'
+
+
+class ImageHandle:
+    """
+    Reference to an image in an ImageBlobStore.
+
+    Attributes:
+        id: Store key
+        mime_type: MIME type of the stored bytes
+        size: Size of the stored bytes
+    """
+
+    __slots__ = ('id', 'mime_type', 'size')
+
+    def __init__(self, id: str, mime_type: str, size: int):
+        self.id = id
+        self.mime_type = mime_type
+        self.size = size
+
+    @property
+    def url(self) -> str:
+        """Reference used in message content in place of a data URL."""
+        return BLOB_URL_PREFIX + self.id
+
+    def __repr__(self) -> str:
+        return f'ImageHandle({self.id!r}, {self.mime_type!r}, {self.size} bytes)'
+
+
+class ImageBlobStore:
+    """
+    Thread-safe map of handle IDs to image bytes.
+
+    Images live until released; the routes release a request's images when
+    the request ends (see app.routes.assist.store_image).
+    """
+
+    def __init__(self):
+        self._blobs: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes, mime_type: str) -> ImageHandle:
+        handle = ImageHandle(os.urandom(8).hex(), mime_type, len(data))
+        with self._lock:
+            self._blobs[handle.id] = (data, mime_type)
+        return handle
+
+    def get(self, handle: Union[ImageHandle, str]) -> bytes:
+        """
+        Return the bytes for a handle, handle ID or blob: URL.
+
+        Raises:
+            KeyError: If the image was released
+        """
+        with self._lock:
+            return self._blobs[_blob_id(handle)][0]
+
+    def release(self, *handles: ImageHandle) -> None:
+        with self._lock:
+            for handle in handles:
+                self._blobs.pop(handle.id, None)
+
+    def data_url(self, handle: Union[ImageHandle, str]) -> str:
+        """Build the base64 data URL for an image (the only base64 copy made)."""
+        with self._lock:
+            data, mime_type = self._blobs[_blob_id(handle)]
+        with stage_timer('base64'):
+            return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def materialize(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """
+        Return the messages with every blob: image URL replaced by its data URL.
+
+        Messages without blob references are returned as they are; the
+        others are copied, so the originals keep their references.
+        """
+        materialized = []
+        for message in messages:
+            content = message.content
+            if isinstance(content, list) and any(_is_blob_part(part) for part in content):
+                content = [
+                    {**part, 'image_url': self.data_url(_image_url(part))} if _is_blob_part(part) else part
+                    for part in content
+                ]
+                message = message.copy(update={'content': content})
+            materialized.append(message)
+        return materialized
+
+    def stats(self) -> dict:
+        """Return the number of stored images and their total size."""
+        with self._lock:
+            return {'images': len(self._blobs), 'bytes': sum(len(data) for data, _ in self._blobs.values())}
+
+
+def _blob_id(handle: Union[ImageHandle, str]) -> str:
+    if isinstance(handle, ImageHandle):
+        return handle.id
+    return handle[len(BLOB_URL_PREFIX):] if handle.startswith(BLOB_URL_PREFIX) else handle
+
+
+def _image_url(part: dict) -> Optional[str]:
+    url = part.get('image_url')
+    if isinstance(url, dict):
+        url = url.get('url')
+    return url
+
+
+def _is_blob_part(part) -> bool:
+    if not isinstance(part, dict) or part.get('type') != 'image_url':
+        return False
+    url = _image_url(part)
+    return isinstance(url, str) and url.startswith(BLOB_URL_PREFIX)
+
+
+def image_url(image: Union[ImageHandle, str], mime_type: str = 'image/jpeg') -> str:
+    """
+    URL for an image in message content: a blob: reference for a handle,
+    or a data URL for a base64 string (callers that already encoded it).
+    """
+    if isinstance(image, ImageHandle):
+        return image.url
+    return f"data:{mime_type};base64,{image}"
+
+
+image_store = ImageBlobStore()
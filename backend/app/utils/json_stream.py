@@ -0,0 +1,303 @@
+"""
+Incremental JSON parsing utilities for streamed model output.
+"""
+import json
+import threading
+from typing import List, Optional, Tuple
+
+
+VALID_HAPTIC_CUES = ["guide_to_target", "success_pulse", "none"]
+
+# Gemini response schema (Schema proto in dict form) for the /assist
+# instruction object. Sent with response_mime_type=application/json so the
+# model can only produce this shape.
+INSTRUCTION_RESPONSE_SCHEMA = {
+    "type_": "OBJECT",
+    "properties": {
+        "image_analysis": {"type_": "STRING"},
+        "instruction": {
+            "type_": "OBJECT",
+            "properties": {
+                "steps": {"type_": "ARRAY", "items": {"type_": "STRING"}},
+                "target_id": {"type_": "STRING"},
+                "haptic_cue": {"type_": "STRING", "enum": VALID_HAPTIC_CUES},
+            },
+            "required": ["steps", "target_id", "haptic_cue"],
+        },
+    },
+    "required": ["image_analysis", "instruction"],
+}
+
+
+class IncrementalJSONParser:
+    """
+    Incrementally parses a JSON document fed in arbitrary text chunks.
+
+    Every time a string value is fully received, its path in the document
+    is reported, e.g. ('instruction', 'steps', 0). Text before the first
+    '{' (such as a markdown code fence) is ignored.
+    """
+
+    def __init__(self):
+        self._started = False
+        self._complete = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level object has been closed."""
+        return self._complete
+
+    def feed(self, chunk: str) -> List[Tuple[tuple, str]]:
+        """
+        Feed the next chunk of text into the parser.
+
+        Args:
+            chunk: Next piece of the streamed response
+
+        Returns:
+            List of (path, value) tuples for string values completed by this chunk
+        """
+        completed = []
+
+        for char in chunk:
+            if self._complete:
+                break
+
+            if not self._started:
+                if char == '{':
+                    self._started = True
+                    self._stack.append({'type': 'object', 'path': (), 'key': None, 'expect_key': True})
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._string_chars.append(char)
+                    self._escape = False
+                elif char == '\\':
+                    self._string_chars.append(char)
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    value = self._finish_string()
+                    if value is not None:
+                        completed.append(value)
+                else:
+                    self._string_chars.append(char)
+                continue
+
+            frame = self._stack[-1]
+
+            if char == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif char in '{[':
+                self._stack.append({
+                    'type': 'object' if char == '{' else 'array',
+                    'path': frame['path'] + (self._slot(frame),),
+                    'key': None,
+                    'index': 0,
+                    'expect_key': char == '{'
+                })
+            elif char in '}]':
+                self._stack.pop()
+                if not self._stack:
+                    self._complete = True
+            elif char == ',':
+                if frame['type'] == 'object':
+                    frame['expect_key'] = True
+                else:
+                    frame['index'] += 1
+
+        return completed
+
+    def _slot(self, frame: dict):
+        """Return the key or index that the next value in frame occupies."""
+        return frame['key'] if frame['type'] == 'object' else frame['index']
+
+    def _finish_string(self) -> Optional[Tuple[tuple, str]]:
+        """Decode the buffered string and either record it as a key or report it as a value."""
+        raw = ''.join(self._string_chars)
+        self._string_chars = []
+
+        try:
+            text = json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            text = raw
+
+        frame = self._stack[-1]
+        if frame['type'] == 'object' and frame['expect_key']:
+            frame['key'] = text
+            frame['expect_key'] = False
+            return None
+
+        return frame['path'] + (self._slot(frame),), text
+
+
+def instruction_event(path: tuple, value: str) -> Optional[dict]:
+    """
+    Map a completed value from the instruction JSON to a client-facing event.
+
+    Args:
+        path: Path of the value in the response document
+        value: Decoded string value
+
+    Returns:
+        Event dict, or None if the value is not streamed to the client
+    """
+    if path == ('image_analysis',):
+        return {'event': 'image_analysis', 'image_analysis': value}
+
+    if len(path) == 3 and path[:2] == ('instruction', 'steps') and isinstance(path[2], int):
+        return {'event': 'step', 'index': path[2], 'text': value}
+
+    if path == ('instruction', 'target_id'):
+        return {'event': 'target_id', 'target_id': value}
+
+    if path == ('instruction', 'haptic_cue'):
+        cue = value if value in VALID_HAPTIC_CUES else 'none'
+        return {'event': 'haptic_cue', 'haptic_cue': cue}
+
+    return None
+
+
+def parse_model_json(text: str) -> Tuple[Optional[dict], str]:
+    """
+    Parse a model's JSON object, repairing common damage.
+
+    Handles text or markdown fences around the object, trailing commas and
+    truncation (an unterminated string, or objects and arrays left open when
+    the output hit the token limit). Truncated output keeps every complete
+    value and drops the partial one where possible.
+
+    Args:
+        text: Raw model output
+
+    Returns:
+        Tuple of (parsed object or None, status), where status is "ok"
+        (parsed as is), "repaired" or "failed"
+    """
+    start = text.find('{') if isinstance(text, str) else -1
+    if start == -1:
+        return None, "failed"
+
+    body = text[start:]
+    for status, candidate in _json_candidates(body):
+        try:
+            result = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result, status
+
+    return None, "failed"
+
+
+def missing_fields(result, schema: dict = INSTRUCTION_RESPONSE_SCHEMA, prefix: str = '') -> List[str]:
+    """
+    List the schema's required fields that result lacks, as dotted paths.
+
+    Repair accepts any prefix of an object (even "{"), so a repaired result
+    is only usable if nothing the schema requires was cut off.
+
+    Args:
+        result: Parsed model output
+        schema: Response schema (INSTRUCTION_RESPONSE_SCHEMA format)
+        prefix: Path of result within the whole object
+
+    Returns:
+        Missing paths, e.g. ["instruction.haptic_cue"]; empty if complete
+    """
+    missing = []
+    for name in schema.get("required", []):
+        if not isinstance(result, dict) or name not in result:
+            missing.append(prefix + name)
+            continue
+        field = schema["properties"].get(name, {})
+        if field.get("type_") == "OBJECT":
+            missing.extend(missing_fields(result[name], field, prefix + name + "."))
+    return missing
+
+
+def _json_candidates(body: str):
+    """
+    Yield (status, text) candidates for parse_model_json, most complete first.
+
+    The first is the object as written (or closed, if truncated); the rest
+    cut it back to each earlier comma, closing whatever is open there.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    commas = []  # (position, closers open at that comma)
+
+    for i, char in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                yield ("ok", body[:i + 1])
+                # A complete object that still fails (e.g. a trailing comma)
+                for position, closers in reversed(commas):
+                    yield ("repaired", body[:position] + closers)
+                return
+        elif char == ',':
+            commas.append((i, ''.join(reversed(stack))))
+
+    # Truncated. If output stopped right after a complete value, closing the
+    # open containers keeps it; otherwise the last value may be partial
+    # (e.g. half a step), so prefer cutting back to the previous comma.
+    closers = ''.join(reversed(stack))
+    if not in_string and body.rstrip().endswith(('"', '}', ']')):
+        yield ("repaired", body + closers)
+
+    for position, comma_closers in reversed(commas):
+        yield ("repaired", body[:position] + comma_closers)
+
+    # Last resort: keep the partial string rather than nothing
+    tail = body[:-1] if escape else body
+    if in_string:
+        tail += '"'
+    yield ("repaired", tail + closers)
+
+
+class ParseStats:
+    """Counts model output parse outcomes, for the parse-failure rate."""
+
+    def __init__(self):
+        self.counts = {"ok": 0, "repaired": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def record(self, status: str) -> None:
+        with self._lock:
+            self.counts[status] += 1
+
+    def snapshot(self) -> dict:
+        """Return the counts plus repair and failure rates."""
+        with self._lock:
+            counts = dict(self.counts)
+
+        total = sum(counts.values())
+        return {
+            **counts,
+            "total": total,
+            "repair_rate": round(counts["repaired"] / total, 4) if total else 0.0,
+            "failure_rate": round(counts["failed"] / total, 4) if total else 0.0,
+        }
+
@@ -0,0 +1,241 @@
+"""
+Non-blocking, sampled JSON logging.
+
+Request threads only filter a record and put it on a queue. A listener
+thread formats it as JSON and writes it to stdout, so neither json
+encoding nor a slow stdout adds to request latency. Records can be
+sampled per level and per message kind (the sample_key extra), with one
+decision per request so a sampled request keeps all its debug lines.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, Optional
+
+from app.utils.tracing import current_span
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used without it
+    orjson = None
+
+
+# Record attributes passed with extra= that are copied into the JSON line
+EXTRA_FIELDS = ('session_id', 'endpoint', 'task', 'step', 'duration_ms', 'status', 'image',
+                'trace_id', 'span_id')
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=str, check_circular=False)
+
+# Per-request sampling roll in [0, 1); None outside a request
+_sample_roll: contextvars.ContextVar = contextvars.ContextVar('log_sample_roll', default=None)
+
+
+def dumps(obj) -> str:
+    """Encode a log line as compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode('utf-8')
+    return _encoder.encode(obj)
+
+
+def parse_rates(spec: Optional[str]) -> Dict[str, float]:
+    """
+    Parse sampling rates.
+
+    Args:
+        spec: Comma-separated NAME=RATE pairs, e.g. "DEBUG=0.01,model_payload=0.05"
+
+    Returns:
+        Dict of name to rate in [0, 1]
+
+    Raises:
+        ValueError: If a pair or rate is malformed
+    """
+    rates = {}
+    for pair in (spec or '').split(','):
+        if not pair.strip():
+            continue
+        name, _, rate = pair.partition('=')
+        try:
+            value = float(rate)
+        except ValueError:
+            raise ValueError(f"Invalid sampling rate: {pair!r}")
+        if not name.strip() or not 0 <= value <= 1:
+            raise ValueError(f"Invalid sampling rate: {pair!r}")
+        rates[name.strip()] = value
+    return rates
+
+
+def start_request_sampling(rng: Callable[[], float] = random.random) -> None:
+    """Draw the sampling roll for the current request (call from before_request)."""
+    _sample_roll.set(rng())
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record):
+        log_data = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno
+        }
+
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                log_data[field] = value
+
+        if record.exc_info:
+            log_data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_data['exception'] = record.exc_text
+
+        return dumps(log_data)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of records by level or by sample_key.
+
+    A record's rate is its sample_key's rate if one is configured, else its
+    level's rate. Levels without a rate are kept at or above min_level and
+    dropped below it, so DEBUG=0.01 with an INFO min_level turns debug
+    logging on for 1% of requests.
+    """
+
+    def __init__(self, min_level: int = logging.INFO, level_rates: Optional[Dict[int, float]] = None,
+                 message_rates: Optional[Dict[str, float]] = None, rng: Callable[[], float] = random.random):
+        super().__init__()
+        self.min_level = min_level
+        self.level_rates = level_rates or {}
+        self.message_rates = message_rates or {}
+        self._rng = rng
+        self.dropped = 0
+
+    @property
+    def capture_level(self) -> int:
+        """Lowest level that can pass, which loggers must be set to."""
+        sampled = [level for level, rate in self.level_rates.items() if rate > 0]
+        if self.message_rates:
+            sampled.append(logging.DEBUG)
+        return min([self.min_level] + sampled)
+
+    def filter(self, record) -> bool:
+        key = getattr(record, 'sample_key', None)
+        if key in self.message_rates:
+            rate = self.message_rates[key]
+        else:
+            rate = self.level_rates.get(record.levelno, 1.0 if record.levelno >= self.min_level else 0.0)
+
+        if rate >= 1:
+            return True
+        if rate > 0:
+            roll = _sample_roll.get()
+            if (roll if roll is not None else self._rng()) < rate:
+                return True
+        self.dropped += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without ever blocking the caller.
+
+    The message and traceback are rendered here, while the arguments are
+    still current, and the trace IDs are copied from the current span; the
+    JSON formatting happens in the listener thread. Records are dropped
+    and counted when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        span = current_span()
+        if span is not None and getattr(record, 'trace_id', None) is None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return record
+
+    def enqueue(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_pipeline: Dict[str, object] = {}
+
+
+def configure_logging(level: int = logging.INFO, level_rates: Optional[Dict[int, float]] = None,
+                      message_rates: Optional[Dict[str, float]] = None, queue_size: int = 10000,
+                      stream=None, loggers=('app', 'llm')) -> NonBlockingQueueHandler:
+    """
+    Route the root logger through the queue and a JSON listener thread.
+
+    Safe to call again (e.g. once per create_app): the previous listener is
+    flushed and replaced.
+
+    Args:
+        level: Minimum level logged without sampling
+        level_rates: Sampling rate per level below or above level, e.g. {DEBUG: 0.01}
+        message_rates: Sampling rate per sample_key extra
+        queue_size: Records buffered before new ones are dropped
+        stream: Output stream (default stdout)
+        loggers: Application loggers opened up to the lowest sampled level;
+            third-party loggers stay at level
+
+    Returns:
+        The installed queue handler (its filter and dropped counter)
+    """
+    stop_logging()
+
+    sampling = SamplingFilter(level, level_rates, message_rates)
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(sampling)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter())
+    listener = QueueListener(log_queue, output)
+    listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in loggers:
+        logging.getLogger(name).setLevel(sampling.capture_level)
+
+    _pipeline.update(handler=handler, listener=listener)
+    return handler
+
+
+def stop_logging() -> None:
+    """Flush queued records and detach the pipeline from the root logger."""
+    handler = _pipeline.pop('handler', None)
+    listener = _pipeline.pop('listener', None)
+    if handler is not None:
+        logging.getLogger().removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,350 @@
+"""
+Process-wide metrics registry, rendered in the Prometheus text format at /metrics.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from flask import g, request
+
+
+# Seconds; covers sub-millisecond parsing up to a slow Gemini call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# A collected sample: (metric name suffix, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items()))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base for labelled metrics; children are keyed by their label values."""
+
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [('_total', self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [('', self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, +Inf last), sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the with block, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1])) for key, entry in self._values.items())
+        for key, (counts, total) in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and collectors, and renders them for Prometheus.
+
+    Collectors export counters that other components already keep (cache
+    hits, breaker states, hedges) when /metrics is scraped, so those
+    components do not need to know about the registry.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, List[Sample]]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], List[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """
+        Add a function called on every render.
+
+        It returns a list of (name, type, help, samples) families, where
+        samples are (suffix, labels, value) tuples.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def clear_collectors(self) -> None:
+        """Drop all collectors (a new app replaces the previous one's)."""
+        with self._lock:
+            self._collectors.clear()
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format (0.0.4).
+
+        Families are registered under their base name. In this format a
+        counter's HELP and TYPE lines must name the sample itself, so they
+        use <base>_total, matching the <base>_total samples.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        families = [(metric.name, metric.kind, metric.help, metric.samples()) for metric in metrics]
+        for collector in collectors:
+            families.extend(collector())
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            family = f'{name}_total' if kind == 'counter' else name
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    'lucid_stage_duration_seconds',
+    'Time spent in each request stage (auth, multipart_parse, image_validation, compression, base64, '
+    'llm_call, json_parse, context_save, session_load, stt)',
+    ['stage']
+)
+REQUEST_SECONDS = metrics.histogram(
+    'lucid_request_duration_seconds', 'Time to answer a request', ['endpoint', 'status']
+)
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    'lucid_requests_in_flight', 'Requests currently being handled', ['endpoint']
+)
+
+
+def stage_timer(stage: str):
+    """Context manager recording the with block's duration as a stage."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def app_collector(app) -> Callable[[], list]:
+    """
+    Collector exporting the counters kept by the app's shared components:
+    response cache, model output parsing, retries, circuit breakers,
+    single-flight and hedging. Components that are disabled are skipped.
+    """
+
+    def collect() -> list:
+        families = []
+
+        resilience = getattr(app, 'resilience', None)
+        if resilience is not None:
+            families.append(('lucid_llm_retries', 'counter', 'Model call retries per upstream', [
+                ('_total', {'upstream': name}, count) for name, count in resilience.retry_counts().items()
+            ]))
+            families.append(('lucid_circuit_breaker_state', 'gauge', 'Circuit breaker state per upstream (1 = current)', [
+                ('', {'upstream': name, 'state': state}, 1 if state == current else 0)
+                for name, current in resilience.stats().items()
+                for state in ('closed', 'open', 'half_open')
+            ]))
+
+        workflow = getattr(app, 'workflow', None)
+        if workflow is not None:
+            parse = workflow.parse_stats.snapshot()
+            families.append(('lucid_model_output', 'counter', 'Parsed /assist model outputs by outcome', [
+                ('_total', {'outcome': outcome}, parse[outcome]) for outcome in ('ok', 'repaired', 'failed')
+            ]))
+
+        cache = getattr(app, 'response_cache', None)
+        if cache is not None:
+            cache_stats = cache.stats()
+            families.append(('lucid_response_cache_hits', 'counter', 'Response cache hits',
+                             [('_total', {}, cache_stats['hits'])]))
+            families.append(('lucid_response_cache_misses', 'counter', 'Response cache misses',
+                             [('_total', {}, cache_stats['misses'])]))
+            families.append(('lucid_response_cache_entries', 'gauge', 'Entries in the response cache',
+                             [('', {}, cache_stats['size'])]))
+
+        flight = getattr(app, 'single_flight', None)
+        if flight is not None:
+            flight_stats = flight.stats()
+            families.append(('lucid_singleflight_shared', 'counter', 'Duplicate requests answered by an in-flight call',
+                             [('_total', {}, flight_stats['shared'])]))
+
+        hedging = getattr(app, 'hedging', None)
+        if hedging is not None:
+            hedge_stats = hedging.stats()
+            families.append(('lucid_hedges', 'counter', 'Extra upstream model calls sent as hedges',
+                             [('_total', {}, hedge_stats['hedges'])]))
+            families.append(('lucid_hedge_wins', 'counter', 'Hedged calls that answered first',
+                             [('_total', {}, hedge_stats['hedge_wins'])]))
+            families.append(('lucid_hedge_abandoned_calls', 'counter',
+                             'Losing hedged calls abandoned while still running upstream',
+                             [('_total', {}, hedge_stats['abandoned'])]))
+
+        return families
+
+    return collect
+
+
+def install_metrics(app, registry: MetricsRegistry = metrics) -> None:
+    """
+    Time every request and count requests in flight, and export the app's
+    component counters on each /metrics scrape.
+
+    Requests are labelled by route rule rather than path, so unknown URLs
+    cannot create new series.
+    """
+    registry.clear_collectors()
+    registry.register_collector(app_collector(app))
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def observe_request(response):
+        if 'metrics_started' in g:
+            REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_started,
+                                    endpoint=g.metrics_endpoint, status=str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
@@ -0,0 +1,343 @@
+"""
+Circuit breakers, jittered backoff and a retry budget for upstream model calls.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, TypeVar
+
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+
+T = TypeVar('T')
+
+# HTTP statuses worth retrying: rate limited, unavailable, deadline exceeded
+RETRYABLE_STATUS_CODES = {429, 503, 504}
+RETRYABLE_MARKERS = ('RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', '429', '503', '504')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Return True if an upstream error is transient and worth retrying.
+
+    Checks the exception and its causes for timeouts, a status code of
+    429/503/504 (google.api_core errors expose it as .code) or the matching
+    gRPC status names in the message. Bad requests, auth failures and
+    parse errors are not retryable.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+
+        if isinstance(exc, CircuitOpenError):
+            return False
+        if isinstance(exc, (TimeoutError, asyncio.TimeoutError)):
+            return True
+
+        code = getattr(exc, 'code', None)
+        if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+            return True
+
+        message = str(exc)
+        if any(marker in message for marker in RETRYABLE_MARKERS):
+            return True
+
+        exc = exc.__cause__ or exc.__context__
+
+    return False
+
+
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 8.0,
+                  rng: Callable[[float, float], float] = random.uniform) -> float:
+    """
+    Full-jitter exponential backoff: uniform(0, min(max_delay, base_delay * 2**attempt)).
+
+    Jitter spreads retries from many clients over time instead of having them
+    hit a recovering upstream at the same moment.
+    """
+    return rng(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    - closed: calls go through; failure_threshold consecutive failures open it
+    - open: calls fail fast with CircuitOpenError for recovery_seconds
+    - half_open: up to half_open_max_calls trial calls go through; a success
+      closes the circuit, a failure opens it again
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_seconds: float = 30,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a trial call through."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_seconds - (self._clock() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Return True if a call may go through now (reserving a half-open trial slot)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        """
+        Give back a half-open trial slot without recording an outcome, for
+        calls that were cancelled before the upstream answered.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._half_open_calls = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._half_open_calls = 0
+
+    def _maybe_half_open(self) -> None:
+        """Move open -> half_open once recovery_seconds have passed. Caller must hold the lock."""
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.recovery_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent requests.
+
+    Within window_seconds, retries are allowed while
+    retries < min_retries + ratio * requests. When an upstream is failing
+    everywhere, this keeps retries from multiplying the load on it.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window_seconds: float = 10,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._clock = clock
+
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = self._clock()
+            self._requests.append(now)
+            self._trim(now)
+
+    def try_spend(self) -> bool:
+        """Return True and count a retry if the budget allows one."""
+        with self._lock:
+            now = self._clock()
+            self._trim(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        for times in (self._requests, self._retries):
+            while times and times[0] < cutoff:
+                times.popleft()
+
+
+class Resilience:
+    """
+    Shared retry policy for model calls: one circuit breaker per upstream
+    name, jittered exponential backoff and a process-wide retry budget.
+    Only retryable errors (see is_retryable) are retried or count against
+    a breaker.
+
+    Calls bounded by a request deadline pass it in. Upstream calls use the
+    deadline's remaining time as their RPC timeout, so an error once the
+    deadline is spent is the caller's timeout, not an upstream failure: it
+    is raised as DeadlineExceeded without touching the breaker or retrying.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 failure_threshold: int = 5, recovery_seconds: float = 30,
+                 retry_budget_ratio: float = 0.2, retry_budget_min: int = 10,
+                 retry_budget_window_seconds: float = 10,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize the policy.
+
+        Args:
+            max_attempts: Attempts per call, including the first
+            base_delay: Backoff base in seconds
+            max_delay: Backoff cap in seconds
+            failure_threshold: Consecutive retryable failures that open a circuit
+            recovery_seconds: Time an open circuit fails fast before a trial call
+            retry_budget_ratio: Retries allowed per request in the budget window
+            retry_budget_min: Retries always allowed per budget window
+            retry_budget_window_seconds: Retry budget window
+            sleep: Sleep used between attempts (overridable in tests)
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.budget = RetryBudget(retry_budget_ratio, retry_budget_min, retry_budget_window_seconds)
+        self._sleep = sleep
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._retries: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        """Return the circuit breaker for an upstream, creating it on first use."""
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.recovery_seconds)
+                self._breakers[name] = breaker
+            return breaker
+
+    def call(self, name: str, fn: Callable[[], T], deadline: Optional[Deadline] = None,
+             stage: str = 'generation') -> T:
+        """Call fn() with the breaker and retry policy for upstream name, within an optional deadline."""
+        breaker = self.breaker(name)
+        self.budget.record_request()
+
+        for attempt in range(self.max_attempts):
+            self._acquire(breaker)
+            try:
+                result = fn()
+            except Exception as e:
+                self._check_deadline(breaker, e, deadline, stage)
+                if not self._should_retry(breaker, e, attempt):
+                    raise
+                self._sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+
+            breaker.record_success()
+            return result
+
+    def guard(self, name: str) -> CircuitBreaker:
+        """
+        Check the breaker before a call that cannot be retried (e.g. a stream
+        that has already produced output). The caller reports the outcome
+        with record_outcome().
+        """
+        breaker = self.breaker(name)
+        self._acquire(breaker)
+        return breaker
+
+    def release(self, name: str) -> None:
+        """Give back a guarded call's slot when it ended without an outcome (e.g. the client went away)."""
+        self.breaker(name).release()
+
+    def record_outcome(self, name: str, error: Optional[BaseException] = None,
+                       deadline: Optional[Deadline] = None, stage: str = 'generation') -> None:
+        """
+        Report the outcome of a guarded call to the upstream's breaker.
+
+        Raises:
+            DeadlineExceeded: If the call failed because the deadline was spent
+                (the slot is returned and nothing is recorded)
+        """
+        breaker = self.breaker(name)
+        if error is not None:
+            self._check_deadline(breaker, error, deadline, stage)
+        if error is not None and is_retryable(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def stats(self) -> dict:
+        """Return the state of every circuit breaker."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.state for name, breaker in sorted(breakers.items())}
+
+    def retry_counts(self) -> Dict[str, int]:
+        """Return the number of retries made per upstream name."""
+        with self._lock:
+            return dict(sorted(self._retries.items()))
+
+    def _acquire(self, breaker: CircuitBreaker) -> None:
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+    def _check_deadline(self, breaker: CircuitBreaker, error: BaseException,
+                        deadline: Optional[Deadline], stage: str) -> None:
+        """Raise DeadlineExceeded, returning the breaker slot, if the caller's deadline is spent."""
+        if isinstance(error, DeadlineExceeded) or (deadline is not None and deadline.remaining() <= 0):
+            breaker.release()
+            if isinstance(error, DeadlineExceeded):
+                raise error
+            raise DeadlineExceeded(stage) from error
+
+    def _should_retry(self, breaker: CircuitBreaker, error: Exception, attempt: int) -> bool:
+        """Record a failed attempt and decide whether to try again."""
+        if not is_retryable(error):
+            # The upstream answered; the request itself was bad
+            breaker.record_success()
+            return False
+
+        breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if not self.budget.try_spend():
+            return False
+
+        with self._lock:
+            self._retries[breaker.name] = self._retries.get(breaker.name, 0) + 1
+        return True
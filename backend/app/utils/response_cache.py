@@ -0,0 +1,164 @@
+"""
+Response cache for repeated /assist snapshots of the same scene.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from PIL import Image
+
+
+# Fields of the final workflow state that make up a cached answer
+CACHED_FIELDS = ['image_analysis', 'instruction_text', 'target_id', 'haptic_cue']
+
+
+def image_hash(img: Image.Image, hash_size: int = 8) -> int:
+    """
+    Compute a difference hash (dHash) of an already decoded image.
+
+    Near-identical frames (small camera shake, JPEG noise, lighting flicker)
+    produce hashes that differ in only a few bits.
+
+    Args:
+        img: Decoded PIL image
+        hash_size: Hash is hash_size * hash_size bits (default: 64 bits)
+
+    Returns:
+        Hash as an integer
+    """
+    img = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+
+    pixels = img.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    return value
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    """Number of differing bits between two perceptual hashes."""
+    return (hash_a ^ hash_b).bit_count()
+
+
+def quantize_gaze(gaze_vector: dict, step: float) -> Tuple[int, int, int]:
+    """
+    Snap a gaze vector to a grid so small head movements map to the same key.
+
+    Args:
+        gaze_vector: {"x": float, "y": float, "z": float}
+        step: Grid size for each component
+
+    Returns:
+        Tuple of grid coordinates
+    """
+    return tuple(int(round(float(gaze_vector.get(axis, 0)) / step)) for axis in ('x', 'y', 'z'))
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of /assist results keyed on session, task, step, gaze and scene.
+
+    Entries are grouped by (session_id, current_task, task_step, quantized
+    gaze). Answers depend on the session's earlier steps, so sessions never
+    share entries. Within a group, a lookup hits if a stored snapshot's
+    perceptual hash is within hamming_threshold bits of the new one.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 120,
+                 hamming_threshold: int = 6, gaze_step: float = 0.1):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses (LRU eviction)
+            ttl_seconds: Entries older than this are treated as misses
+            hamming_threshold: Maximum differing hash bits for the "same scene"
+            gaze_step: Quantization step for gaze vector components
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hamming_threshold = hamming_threshold
+        self.gaze_step = gaze_step
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # (group, image_hash) -> (stored_at, result)
+        self._groups: Dict[tuple, set] = {}  # group -> {image_hash, ...}
+        self._lock = threading.Lock()
+
+    def _group(self, current_task: str, task_step: str, gaze_vector: dict,
+               session_id: Optional[str]) -> tuple:
+        return (session_id, current_task, task_step, quantize_gaze(gaze_vector, self.gaze_step))
+
+    def get(self, current_task: str, task_step: str, gaze_vector: dict,
+            image_hash: int, session_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Look up a cached result for a near-duplicate snapshot.
+
+        Returns:
+            Copy of the cached result fields, or None on a miss
+        """
+        group = self._group(current_task, task_step, gaze_vector, session_id)
+        now = time.monotonic()
+
+        with self._lock:
+            best_key = None
+            best_distance = self.hamming_threshold + 1
+
+            for stored_hash in list(self._groups.get(group, ())):
+                key = (group, stored_hash)
+                stored_at, _ = self._entries[key]
+                if now - stored_at > self.ttl_seconds:
+                    self._remove(key)
+                    continue
+
+                distance = hamming_distance(image_hash, stored_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return copy.deepcopy(self._entries[best_key][1])
+
+    def put(self, current_task: str, task_step: str, gaze_vector: dict,
+            image_hash: int, result: dict, session_id: Optional[str] = None) -> None:
+        """Store the response fields of a completed workflow result."""
+        group = self._group(current_task, task_step, gaze_vector, session_id)
+        key = (group, image_hash)
+        value = copy.deepcopy({field: result.get(field) for field in CACHED_FIELDS})
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            self._groups.setdefault(group, set()).add(image_hash)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple) -> None:
+        """Drop an entry and its group index. Caller must hold the lock."""
+        group, image_hash = key
+        self._entries.pop(key, None)
+        hashes = self._groups.get(group)
+        if hashes is not None:
+            hashes.discard(image_hash)
+            if not hashes:
+                del self._groups[group]
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
@@ -1,19 +1,21 @@
 """
 Session context management utilities.
 """
-import json
-import os
-from pathlib import Path
 from typing import Dict, Optional
 
+from app.utils.session_store import SessionStore, JSONFileSessionStore
 
-def load_session_context(session_id: str, context_dir: str = "contexts") -> Optional[Dict]:
+
+def load_session_context(session_id: str, context_dir: str = "contexts",
+                         store: Optional[SessionStore] = None) -> Optional[Dict]:
     """
-    Load and parse session context from JSON file.
+    Load and parse session context from the session store.
     
     Args:
         session_id: The session identifier
-        context_dir: Directory where context files are stored (default: "contexts")
+        context_dir: Directory where context files are stored (default: "contexts"),
+            used when no store is given
+        store: SessionStore to read from (default: JSON files in context_dir)
     
     Returns:
         Dict with session context including:
@@ -25,22 +27,18 @@ def load_session_context(session_id: str, context_dir: str = "contexts") -> Opti
         - timestamp: str
         - gaze_vector: dict
         
-        Returns None if session file doesn't exist
+        Returns None if the session doesn't exist
     
     Raises:
-        ValueError: If the session file exists but contains invalid JSON
+        ValueError: If the session exists but contains invalid JSON
     """
-    # Build file path
-    context_path = Path(context_dir) / f"{session_id}.json"
-    
-    # Check if file exists
-    if not context_path.exists():
-        return None
+    if store is None:
+        store = JSONFileSessionStore(context_dir)
     
-    # Load and parse JSON
     try:
-        with open(context_path, 'r') as f:
-            context_data = json.load(f)
+        context_data = store.load(session_id)
+        if context_data is None:
+            return None
         
         # Validate required fields
         required_fields = ['session_id', 'task', 'step', 'image_analysis', 'instruction']
@@ -50,8 +48,8 @@ def load_session_context(session_id: str, context_dir: str = "contexts") -> Opti
             raise ValueError(f"Session context missing required fields: {', '.join(missing_fields)}")
         
         return context_data
-        
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON in session file: {str(e)}")
+    
+    except ValueError:
+        raise
     except Exception as e:
         raise ValueError(f"Error loading session context: {str(e)}")
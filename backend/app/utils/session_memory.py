@@ -0,0 +1,136 @@
+"""
+Bounded per-session memory of earlier /assist steps.
+
+Each session keeps a ring buffer of its most recent steps and a running
+summary of the older ones, both saved with the session context. When a
+step falls out of the buffer it is folded into the summary as one short
+line, and the summary drops its oldest lines to stay under a fixed size.
+The history section of the prompt therefore stays the same size whether
+the session is on its 3rd step or its 40th.
+"""
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+# Key of the memory in the session context dict
+MEMORY_KEY = 'memory'
+
+NO_HISTORY = 'No earlier steps in this session.'
+
+# Rest of a summary line after its "- task step N" label: ": ..." or " (3x): ..."
+REPEAT_PATTERN = re.compile(r'^(?: \((\d+)x\))?: ')
+
+
+def _clip(text, limit: int) -> str:
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + '...'
+
+
+class SessionMemory:
+    """
+    Ring buffer of recent steps plus a fixed-size running summary.
+
+    Memory is a plain dict so it can be stored with the session:
+    {"recent": [entry, ...], "summary": "line\\nline", "summarized_steps": int}
+    """
+
+    def __init__(self, max_recent: int = 5, max_summary_chars: int = 600, analysis_chars: int = 160):
+        """
+        Args:
+            max_recent: Steps kept in full in the ring buffer
+            max_summary_chars: Size limit of the running summary
+            analysis_chars: Image analysis kept per buffered step
+        """
+        self.max_recent = max(0, max_recent)
+        self.max_summary_chars = max(0, max_summary_chars)
+        self.analysis_chars = analysis_chars
+
+    def from_context(self, context: Optional[dict]) -> Tuple[List[dict], str, int]:
+        """
+        Read the memory saved with a session context.
+
+        Returns:
+            Tuple of (recent entries, summary, number of summarized steps);
+            empty for new sessions and sessions saved before memory existed
+        """
+        memory = (context or {}).get(MEMORY_KEY) or {}
+        return list(memory.get('recent') or []), memory.get('summary') or '', int(memory.get('summarized_steps') or 0)
+
+    def entry(self, task: str, step: str, image_analysis: str, instruction_steps: List[str],
+              target_id: str) -> dict:
+        """Build the compact record kept for one step."""
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'task': task,
+            'step': step,
+            'image_analysis': _clip(image_analysis, self.analysis_chars),
+            'instruction': _clip(instruction_steps[0] if instruction_steps else '', self.analysis_chars),
+            'target_id': target_id or ''
+        }
+
+    def record(self, recent: List[dict], summary: str, summarized_steps: int,
+               entry: dict) -> Tuple[List[dict], str, int]:
+        """
+        Add a step, folding whatever leaves the ring buffer into the summary.
+
+        Only the evicted entries are summarized, so each call costs the same
+        however long the session is. A step repeated right after itself (a
+        retry, or a response cache hit) replaces the last entry and counts
+        the visit instead of taking another slot.
+
+        Returns:
+            Tuple of (recent entries, summary, number of summarized steps)
+        """
+        last = recent[-1] if recent else None
+        if last is not None and (last.get('task'), last.get('step')) == (entry.get('task'), entry.get('step')):
+            recent = recent[:-1] + [dict(entry, visits=last.get('visits', 1) + 1)]
+        else:
+            recent = recent + [entry]
+        overflow = max(0, len(recent) - self.max_recent)
+        for evicted in recent[:overflow]:
+            summary = self._fold(summary, evicted)
+            summarized_steps += 1
+        return recent[overflow:], summary, summarized_steps
+
+    def to_context(self, recent: List[dict], summary: str, summarized_steps: int) -> dict:
+        """Return the memory in the form saved with the session context."""
+        return {'recent': recent, 'summary': summary, 'summarized_steps': summarized_steps}
+
+    def render(self, recent: List[dict], summary: str, summarized_steps: int = 0) -> str:
+        """Render the memory as the history section of the prompt."""
+        if not recent and not summary:
+            return NO_HISTORY
+
+        lines = []
+        if summary:
+            lines.append(f"Summary of {summarized_steps} earlier step(s), oldest first:")
+            lines.append(summary)
+        if recent:
+            lines.append("Most recent steps, oldest first:")
+            for index, entry in enumerate(recent, 1):
+                lines.append(
+                    f"{index}. {entry.get('task', '')} step {entry.get('step', '')}: "
+                    f"saw \"{entry.get('image_analysis', '')}\"; told \"{entry.get('instruction', '')}\""
+                    + (f" (target {entry['target_id']})" if entry.get('target_id') else '')
+                )
+        return "\n".join(lines)
+
+    def _fold(self, summary: str, entry: dict) -> str:
+        """Append one step to the summary as a line, merging repeats of the same step."""
+        label = f"- {entry.get('task', '')} step {entry.get('step', '')}"
+        instruction = _clip(entry.get('instruction', ''), 80)
+
+        visits = entry.get('visits', 1)
+
+        lines = summary.split('\n') if summary else []
+        repeat = REPEAT_PATTERN.match(lines[-1][len(label):]) if lines and lines[-1].startswith(label) else None
+        if repeat:
+            # The user stayed on this step; count the visits instead of repeating the line
+            visits += int(repeat.group(1) or 1)
+            lines.pop()
+        lines.append(f"{label} ({visits}x): {instruction}" if visits > 1 else f"{label}: {instruction}")
+
+        while lines and len('\n'.join(lines)) > self.max_summary_chars:
+            lines.pop(0)
+        return '\n'.join(lines)
@@ -0,0 +1,392 @@
+"""
+Pluggable storage for per-session context.
+"""
+import copy
+import json
+import os
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+
+class SessionStore(ABC):
+    """
+    Interface for loading and saving session context dicts by session_id.
+
+    Context dicts use the format written by VRContextWorkflow.save_context:
+    session_id, timestamp, task, step, gaze_vector, image_analysis,
+    instruction and optionally follow_up_qa (sessions saved before follow-ups
+    moved to their own log).
+
+    Follow-up Q&A entries are kept in a separate append-only log, so an /ask
+    costs the same however long the session has been running.
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Dict]:
+        """
+        Load a session context.
+
+        Returns:
+            Context dict, or None if the session does not exist
+
+        Raises:
+            ValueError: If the stored context cannot be decoded
+        """
+
+    @abstractmethod
+    def save(self, session_id: str, context: Dict) -> None:
+        """Create or replace a session context."""
+
+    @abstractmethod
+    def append_follow_up(self, session_id: str, entry: Dict) -> None:
+        """Append one follow-up Q&A entry to the session's log."""
+
+    @abstractmethod
+    def recent_follow_ups(self, session_id: str, limit: int) -> List[Dict]:
+        """
+        Read the newest follow-up entries, oldest first.
+
+        Args:
+            session_id: The session identifier
+            limit: Maximum number of entries to return
+        """
+
+
+class JSONFileSessionStore(SessionStore):
+    """
+    One pretty-printed JSON file per session: {context_dir}/{session_id}.json
+
+    Follow-ups are appended as JSON lines to {session_id}.followups.jsonl.
+    Once that log reaches compact_at lines, all but the newest keep_recent
+    are moved to {session_id}.followups.archive.jsonl. The live log, and
+    therefore a tail read, stays bounded.
+
+    Contexts are written to a temporary file and renamed over the old one, so
+    a crash mid-write never leaves a truncated session behind.
+    """
+
+    def __init__(self, context_dir: str = "contexts", compact_at: int = 500, keep_recent: int = 100,
+                 tracked_logs: int = 1024):
+        """
+        Args:
+            context_dir: Directory for session files, created on first write
+            compact_at: Follow-up log length that triggers compaction
+            keep_recent: Follow-ups kept in the live log after compaction
+            tracked_logs: Live-log line counts kept in memory; the least
+                recently appended are dropped and recounted from disk
+        """
+        self.context_dir = context_dir
+        self.compact_at = compact_at
+        self.keep_recent = min(keep_recent, compact_at)
+        self.tracked_logs = max(1, tracked_logs)
+        self._dir_ready = False
+
+        self._log_lines = OrderedDict()  # session_id -> lines in the live log
+        self._log_lock = threading.Lock()
+
+    def path(self, session_id: str) -> str:
+        return f"{self.context_dir}/{session_id}.json"
+
+    def follow_up_path(self, session_id: str) -> str:
+        return f"{self.context_dir}/{session_id}.followups.jsonl"
+
+    def archive_path(self, session_id: str) -> str:
+        return f"{self.context_dir}/{session_id}.followups.archive.jsonl"
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        # A single open() instead of exists() + open()
+        try:
+            with open(self.path(session_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in session file: {str(e)}")
+
+    def save(self, session_id: str, context: Dict) -> None:
+        if not self._dir_ready:
+            os.makedirs(self.context_dir, exist_ok=True)
+            self._dir_ready = True
+
+        # Unique per thread, so concurrent saves of one session never share a temp file
+        path = self.path(session_id)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(context, f, indent=2)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def append_follow_up(self, session_id: str, entry: Dict) -> None:
+        if not self._dir_ready:
+            os.makedirs(self.context_dir, exist_ok=True)
+            self._dir_ready = True
+
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        path = self.follow_up_path(session_id)
+
+        with self._log_lock:
+            if session_id in self._log_lines:
+                self._log_lines.move_to_end(session_id)
+            else:
+                self._log_lines[session_id] = _count_lines(path)
+                while len(self._log_lines) > self.tracked_logs:
+                    self._log_lines.popitem(last=False)
+
+            with open(path, "a") as f:
+                f.write(line)
+            self._log_lines[session_id] += 1
+
+            if self._log_lines[session_id] >= self.compact_at:
+                self._compact(session_id)
+
+    def recent_follow_ups(self, session_id: str, limit: int) -> List[Dict]:
+        if limit <= 0:
+            return []
+        try:
+            lines = _tail_lines(self.follow_up_path(session_id), limit)
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in lines]
+
+    def _compact(self, session_id: str) -> None:
+        """Move all but the newest keep_recent entries to the archive. Caller must hold the log lock."""
+        path = self.follow_up_path(session_id)
+        with open(path, "r") as f:
+            lines = f.readlines()
+
+        split = max(0, len(lines) - self.keep_recent)
+        with open(self.archive_path(session_id), "a") as f:
+            f.writelines(lines[:split])
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.writelines(lines[split:])
+        os.replace(temp_path, path)
+
+        # Recounting keep_recent lines on the next append is cheap
+        del self._log_lines[session_id]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a single SQLite database in WAL mode.
+
+    Lookups go through the session_id primary key. WAL lets /ask reads run
+    concurrently with /assist writes. Connections come from a small pool
+    shared by all threads, since gunicorn spreads requests over many threads
+    and a connection per thread would be reopened for nearly every request.
+    Follow-ups are rows in follow_ups, indexed by (session_id, id), so
+    appends are single inserts and tail reads never need compaction.
+    """
+
+    def __init__(self, db_path: str = "contexts/sessions.db", pool_size: int = 8):
+        """
+        Args:
+            db_path: Database file, created if missing
+            pool_size: Idle connections kept for reuse; more are opened
+                under load and closed when returned to a full pool
+        """
+        self.db_path = db_path
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=max(1, pool_size))
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    updated_at TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+                CREATE TABLE IF NOT EXISTS follow_ups (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_follow_ups_session ON follow_ups (session_id, id);
+            """)
+            conn.commit()
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled connection, opening one if none is idle."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            # Used by one thread at a time, but not always the one that opened it
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            # WAL is durable at commit boundaries with NORMAL, without an fsync per write
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in session store: {str(e)}")
+
+    def save(self, session_id: str, context: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO sessions (session_id, updated_at, data) VALUES (?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data
+                """,
+                (session_id, datetime.utcnow().isoformat(), json.dumps(context, separators=(',', ':')))
+            )
+            conn.commit()
+
+    def append_follow_up(self, session_id: str, entry: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO follow_ups (session_id, data) VALUES (?, ?)",
+                (session_id, json.dumps(entry, separators=(',', ':')))
+            )
+            conn.commit()
+
+    def recent_follow_ups(self, session_id: str, limit: int) -> List[Dict]:
+        if limit <= 0:
+            return []
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT data FROM follow_ups WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+
+class CachedSessionStore(SessionStore):
+    """
+    In-process LRU read-through, write-through cache in front of another store.
+
+    Repeated /ask calls for an active session are served from memory. The
+    cache is per process, so it assumes one worker process per store, which
+    is how the Dockerfile runs gunicorn.
+    """
+
+    def __init__(self, backend: SessionStore, max_entries: int = 1024):
+        self.backend = backend
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()  # session_id -> context
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            if session_id in self._entries:
+                self._entries.move_to_end(session_id)
+                return copy.deepcopy(self._entries[session_id])
+
+        context = self.backend.load(session_id)
+        if context is not None:
+            self._remember(session_id, context)
+        return context
+
+    def save(self, session_id: str, context: Dict) -> None:
+        self.backend.save(session_id, context)
+        self._remember(session_id, context)
+
+    def append_follow_up(self, session_id: str, entry: Dict) -> None:
+        self.backend.append_follow_up(session_id, entry)
+
+    def recent_follow_ups(self, session_id: str, limit: int) -> List[Dict]:
+        return self.backend.recent_follow_ups(session_id, limit)
+
+    def _remember(self, session_id: str, context: Dict) -> None:
+        context = copy.deepcopy(context)
+        with self._lock:
+            self._entries[session_id] = context
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _count_lines(path: str) -> int:
+    try:
+        with open(path, "rb") as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+
+def _tail_lines(path: str, limit: int, block_size: int = 4096) -> List[bytes]:
+    """Read the last `limit` lines of a file by seeking backwards from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+
+        # One extra newline guarantees the first kept line is complete
+        while position > 0 and data.count(b"\n") <= limit:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    return lines[-limit:]
+
+
+def create_session_store(backend: str = "json", context_dir: str = "contexts",
+                         db_path: Optional[str] = None, cache_entries: int = 1024,
+                         follow_up_compact_at: int = 500, follow_up_keep: int = 100,
+                         sqlite_pool_size: int = 8) -> SessionStore:
+    """
+    Build the session store selected by configuration.
+
+    Args:
+        backend: "json" (one file per session) or "sqlite"
+        context_dir: Directory for JSON files and the default database
+        db_path: SQLite database path (default: {context_dir}/sessions.db)
+        cache_entries: Size of the in-process LRU cache (0 disables it)
+        follow_up_compact_at: JSON backend only, follow-up log length that triggers compaction
+        follow_up_keep: JSON backend only, follow-ups kept in the live log after compaction
+        sqlite_pool_size: SQLite backend only, idle connections kept for reuse
+
+    Returns:
+        SessionStore
+    """
+    backend = backend.lower()
+    if backend == "json":
+        store = JSONFileSessionStore(context_dir, compact_at=follow_up_compact_at, keep_recent=follow_up_keep)
+    elif backend == "sqlite":
+        store = SQLiteSessionStore(db_path or os.path.join(context_dir, "sessions.db"), pool_size=sqlite_pool_size)
+    else:
+        raise ValueError(f"Unknown session store backend: {backend}")
+
+    if cache_entries > 0:
+        store = CachedSessionStore(store, max_entries=cache_entries)
+
+    return store
@@ -0,0 +1,105 @@
+"""
+Single-flight coalescing of concurrent identical requests.
+"""
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+
+def content_hash(*parts: Union[str, bytes, None]) -> str:
+    """
+    Hash request content into a coalescing key component.
+
+    Args:
+        parts: Strings or bytes that identify the request payload
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b''
+        elif isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time and shares its outcome with concurrent duplicates.
+
+    The first caller for a key (the leader) runs the work. Callers that
+    arrive with the same key while it is in flight wait for it and receive
+    the same result, or the same exception. Once the call finishes the key
+    is released, so later requests run normally.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn, or wait for an in-flight call with the same key.
+
+        Args:
+            key: Coalescing key, e.g. (session_id, endpoint, content_hash)
+            fn: Function that does the work
+
+        Returns:
+            Tuple of (result, shared) where shared is True if the result came
+            from another request's call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+        return result, False
+
+    def stats(self) -> dict:
+        """Return leader/shared counters and the number of calls in flight."""
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'in_flight': len(self._calls)
+            }
+
+
+def coalesce(flight: Optional[SingleFlight], key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """
+    Run fn through a SingleFlight, or directly if coalescing is disabled.
+
+    Returns:
+        Tuple of (result, shared)
+    """
+    if flight is None:
+        return fn(), False
+    return flight.do(key, fn)
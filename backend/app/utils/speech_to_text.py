@@ -2,8 +2,17 @@
 Speech-to-text utilities using Google Cloud Speech-to-Text API.
 """
 from google.cloud import speech
-from typing import Tuple
-import io
+from typing import Optional, Tuple
+
+from app.utils.clients import get_speech_client
+from app.utils.tracing import tracer, SPAN_KIND_CLIENT
+
+
+NO_SPEECH_ERROR = "No speech detected in audio"
+INVALID_AUDIO_ERROR = "Invalid audio format or corrupted file"
+
+# Failures caused by the recording rather than the Speech API
+CLIENT_AUDIO_ERRORS = (NO_SPEECH_ERROR, INVALID_AUDIO_ERROR)
 
 
 def get_encoding_from_content_type(content_type: str) -> speech.RecognitionConfig.AudioEncoding:
@@ -30,7 +39,29 @@ def get_encoding_from_content_type(content_type: str) -> speech.RecognitionConfi
     return encoding_map.get(content_type, speech.RecognitionConfig.AudioEncoding.LINEAR16)
 
 
-def transcribe_audio(audio_bytes: bytes, content_type: str, language_code: str = 'en-US') -> Tuple[bool, str, str]:
+def build_recognition_config(content_type: str, language_code: str = 'en-US') -> speech.RecognitionConfig:
+    """
+    Build the recognition config for a transcription request.
+    
+    Args:
+        content_type: MIME type of the audio file
+        language_code: Language code for transcription (default: en-US)
+        
+    Returns:
+        RecognitionConfig for the request
+    """
+    # Match Unity's audio settings: 16000 Hz sample rate, mono audio
+    return speech.RecognitionConfig(
+        encoding=get_encoding_from_content_type(content_type),
+        sample_rate_hertz=16000,  # Match Unity's SAMPLE_RATE constant
+        language_code=language_code,
+        enable_automatic_punctuation=True,
+        model='default',
+    )
+
+
+def transcribe_audio(audio_bytes: bytes, content_type: str, language_code: str = 'en-US',
+                     timeout: Optional[float] = None) -> Tuple[bool, str, str]:
     """
     Transcribe audio to text using Google Cloud Speech-to-Text API.
     
@@ -38,57 +69,63 @@ def transcribe_audio(audio_bytes: bytes, content_type: str, language_code: str =
         audio_bytes: Audio file content as bytes
         content_type: MIME type of the audio file
         language_code: Language code for transcription (default: en-US)
+        timeout: Optional RPC timeout in seconds (the request's remaining deadline)
         
     Returns:
         Tuple of (success, transcribed_text, error_message)
     """
     try:
-        # Initialize the Speech client
-        client = speech.SpeechClient()
+        # Shared Speech client (reuses its gRPC channel)
+        client = get_speech_client()
         
         # Prepare the audio
         audio = speech.RecognitionAudio(content=audio_bytes)
         
         # Configure recognition
-        # Match Unity's audio settings: 16000 Hz sample rate, mono audio
-        config = speech.RecognitionConfig(
-            encoding=get_encoding_from_content_type(content_type),
-            sample_rate_hertz=16000,  # Match Unity's SAMPLE_RATE constant
-            language_code=language_code,
-            enable_automatic_punctuation=True,
-            model='default',
-        )
-        
-        # Perform the transcription
-        response = client.recognize(config=config, audio=audio)
-        
-        # Extract transcription from response
-        if not response.results:
-            return False, "", "No speech detected in audio"
-        
-        # Combine all transcription results
-        transcription = ' '.join(
-            result.alternatives[0].transcript
-            for result in response.results
-            if result.alternatives
-        )
+        config = build_recognition_config(content_type, language_code)
         
-        if not transcription.strip():
-            return False, "", "No speech detected in audio"
+        # Perform the transcription; only override the client's default
+        # timeout when a deadline applies
+        kwargs = {'timeout': timeout} if timeout else {}
+        with tracer.span('speech.recognize', SPAN_KIND_CLIENT, {'audio.bytes': len(audio_bytes)}):
+            response = client.recognize(config=config, audio=audio, **kwargs)
         
-        return True, transcription.strip(), ""
+        return _parse_recognition_response(response)
         
     except Exception as e:
-        error_msg = str(e)
-        
-        # Provide more user-friendly error messages
-        if 'INVALID_ARGUMENT' in error_msg:
-            return False, "", "Invalid audio format or corrupted file"
-        elif 'UNAUTHENTICATED' in error_msg:
-            return False, "", "Speech-to-Text API authentication failed"
-        elif 'PERMISSION_DENIED' in error_msg:
-            return False, "", "Speech-to-Text API access denied"
-        elif 'RESOURCE_EXHAUSTED' in error_msg:
-            return False, "", "Speech-to-Text API quota exceeded"
-        else:
-            return False, "", f"Transcription failed: {error_msg}"
+        return _transcription_error(e)
+
+
+def _parse_recognition_response(response) -> Tuple[bool, str, str]:
+    """Extract the combined transcription from a RecognizeResponse."""
+    if not response.results:
+        return False, "", NO_SPEECH_ERROR
+    
+    # Combine all transcription results
+    transcription = ' '.join(
+        result.alternatives[0].transcript
+        for result in response.results
+        if result.alternatives
+    )
+    
+    if not transcription.strip():
+        return False, "", NO_SPEECH_ERROR
+    
+    return True, transcription.strip(), ""
+
+
+def _transcription_error(e: Exception) -> Tuple[bool, str, str]:
+    """Map a Speech API exception to a user-friendly error tuple."""
+    error_msg = str(e)
+    
+    # Provide more user-friendly error messages
+    if 'INVALID_ARGUMENT' in error_msg:
+        return False, "", INVALID_AUDIO_ERROR
+    elif 'UNAUTHENTICATED' in error_msg:
+        return False, "", "Speech-to-Text API authentication failed"
+    elif 'PERMISSION_DENIED' in error_msg:
+        return False, "", "Speech-to-Text API access denied"
+    elif 'RESOURCE_EXHAUSTED' in error_msg:
+        return False, "", "Speech-to-Text API quota exceeded"
+    else:
+        return False, "", f"Transcription failed: {error_msg}"
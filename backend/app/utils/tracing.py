@@ -0,0 +1,380 @@
+"""
+Request tracing with an OpenTelemetry-compatible span model.
+
+Spans carry W3C trace and span IDs, parent links, attributes and a status,
+and are exported as OTLP/JSON: one ExportTraceServiceRequest per line to a
+local file, or POSTed to an OTLP/HTTP collector (/v1/traces). The trace
+context of an incoming traceparent header is continued, so a headset or
+gateway trace covers the backend stages too.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from flask import g, request
+
+
+TRACEPARENT_HEADER = 'traceparent'
+
+# version-trace_id-parent_id-flags, see https://www.w3.org/TR/trace-context/
+TRACEPARENT_PATTERN = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# OTLP SpanKind and StatusCode values
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header.
+
+    Returns:
+        Tuple of (trace_id, parent_span_id, sampled), or None if the header
+        is absent or invalid (a new trace is started then)
+    """
+    if not value:
+        return None
+    match = TRACEPARENT_PATTERN.match(value.strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+class Span:
+    """One timed operation in a trace."""
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events: List[dict] = []
+        self.status = STATUS_UNSET
+        self.status_message = ''
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1e6
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        """Mark the span failed and attach the exception as an event, as OpenTelemetry does."""
+        self.status = STATUS_ERROR
+        self.status_message = str(exc)
+        self.events.append({
+            'name': 'exception',
+            'time_ns': time.time_ns(),
+            'attributes': {'exception.type': type(exc).__name__, 'exception.message': str(exc)}
+        })
+
+    def end(self) -> None:
+        if self.end_time_ns is None:
+            self.end_time_ns = time.time_ns()
+
+    def to_otlp(self) -> dict:
+        """Return the span in the OTLP/JSON encoding."""
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_time_ns),
+            'endTimeUnixNano': str(self.end_time_ns or self.start_time_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': self.status}
+        }
+        if self.parent_span_id:
+            span['parentSpanId'] = self.parent_span_id
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        if self.events:
+            span['events'] = [
+                {'name': event['name'], 'timeUnixNano': str(event['time_ns']),
+                 'attributes': _otlp_attributes(event['attributes'])}
+                for event in self.events
+            ]
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> List[dict]:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class FileSpanExporter:
+    """Appends each batch as one OTLP/JSON line to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, payload: dict) -> None:
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(payload) + '\n')
+
+
+class OTLPHttpSpanExporter:
+    """POSTs each batch to an OTLP/HTTP collector as JSON."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, payload: dict) -> None:
+        req = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class BatchSpanProcessor:
+    """
+    Queues finished spans and exports them from a background thread.
+
+    Requests never wait on the exporter. When the queue is full (the
+    exporter is down or too slow), new spans are dropped and counted.
+    """
+
+    def __init__(self, exporter, service_name: str = 'lucid-backend', max_queue_size: int = 2048,
+                 max_batch_size: int = 256, flush_interval_seconds: float = 1.0):
+        """
+        Initialize the processor and start its worker thread.
+
+        Args:
+            exporter: Object with export(payload) taking an OTLP/JSON request
+            service_name: Reported as the service.name resource attribute
+            max_queue_size: Spans buffered before new ones are dropped
+            max_batch_size: Spans per export
+            flush_interval_seconds: Longest time a span waits to be exported
+        """
+        self.exporter = exporter
+        self.service_name = service_name
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.dropped = 0
+        self.export_errors = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        self._worker = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self._worker.start()
+
+    def on_end(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.max_batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        """Export everything queued so far."""
+        with self._flush_lock:
+            while True:
+                batch = []
+                try:
+                    while len(batch) < self.max_batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch:
+                    return
+                self._export(batch)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def _export(self, spans: List[Span]) -> None:
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+                'scopeSpans': [{
+                    'scope': {'name': 'lucid.tracing'},
+                    'spans': [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        try:
+            self.exporter.export(payload)
+        except Exception:
+            # Tracing must never take the service down with it
+            self.export_errors += len(spans)
+
+
+class Tracer:
+    """
+    Creates spans and tracks the current one per request.
+
+    The current span lives in a context variable, so it follows the request
+    into asyncio tasks and into threads that run with a copy of the context
+    (asyncio.to_thread, hedged model calls).
+    Without a processor tracing is off and span() only yields None.
+    """
+
+    def __init__(self, processor: Optional[BatchSpanProcessor] = None):
+        self.processor = processor
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[dict] = None,
+                   traceparent: Optional[str] = None) -> Span:
+        """
+        Start a span under the current one, or under the remote parent in
+        traceparent, or as the root of a new trace.
+        """
+        remote = parse_traceparent(traceparent)
+        parent = _current_span.get()
+        if remote is not None:
+            trace_id, parent_span_id, _ = remote
+        elif parent is not None:
+            trace_id, parent_span_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_span_id = os.urandom(16).hex(), None
+        return Span(name, trace_id, parent_span_id, kind, attributes)
+
+    def end_span(self, span: Span) -> None:
+        span.end()
+        if self.processor is not None:
+            self.processor.on_end(span)
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL,
+             attributes: Optional[dict] = None) -> Iterator[Optional[Span]]:
+        """Trace the with block as a child of the current span."""
+        if self.processor is None:
+            yield None
+            return
+
+        span = self.start_span(name, kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+
+tracer = Tracer()
+
+
+def configure_tracing(processor: Optional[BatchSpanProcessor]) -> Tracer:
+    """Install the span processor on the process-wide tracer (None turns tracing off)."""
+    tracer.processor = processor
+    return tracer
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def traced(name: str, fn: Callable, kind: int = SPAN_KIND_INTERNAL) -> Callable:
+    """Wrap a sync or async function so each call is traced as a span."""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with tracer.span(name, kind):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with tracer.span(name, kind):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def install_tracing(app) -> None:
+    """
+    Trace every request as a server span, continuing the caller's trace when
+    a traceparent header is present. The response carries the request
+    span's traceparent so clients can find the trace.
+    """
+
+    @app.before_request
+    def start_request_span():
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        span = tracer.start_span(
+            f'{request.method} {rule}',
+            kind=SPAN_KIND_SERVER,
+            attributes={'http.request.method': request.method, 'http.route': rule},
+            traceparent=request.headers.get(TRACEPARENT_HEADER)
+        )
+        g.trace_span = span
+        g.trace_previous_span = _current_span.get()
+        _current_span.set(span)
+
+    @app.after_request
+    def finish_request_span(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.response.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = STATUS_ERROR
+            response.headers[TRACEPARENT_HEADER] = span.traceparent
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.record_exception(exc)
+        _current_span.set(g.pop('trace_previous_span', None))
+        tracer.end_span(span)
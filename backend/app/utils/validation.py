@@ -2,43 +2,9 @@
 Input validation utilities for the backend API.
 """
 import json
-import os
-from PIL import Image
 from typing import Tuple
 
 
-def validate_image(file) -> Tuple[bool, str]:
-    """
-    Validates uploaded image file.
-    
-    Args:
-        file: FileStorage object from Flask request
-        
-    Returns:
-        Tuple of (is_valid, error_message)
-    """
-    # Check file type
-    if not file.content_type in ['image/jpeg', 'image/png']:
-        return False, "Invalid image type. Must be JPEG or PNG"
-    
-    # Check file size
-    file.seek(0, os.SEEK_END)
-    size = file.tell()
-    file.seek(0)
-    
-    if size > 5 * 1024 * 1024:  # 5MB
-        return False, "Image too large. Maximum 5MB"
-    
-    # Validate it's actually an image
-    try:
-        img = Image.open(file)
-        img.verify()
-        file.seek(0)
-        return True, ""
-    except Exception as e:
-        return False, f"Invalid image file: {str(e)}"
-
-
 def validate_gaze_vector(gaze_str: str) -> Tuple[bool, dict, str]:
     """
     Validates and parses gaze vector JSON.
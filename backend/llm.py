@@ -1,21 +1,44 @@
-import base64
+import logging
 import os
-import json
 from datetime import datetime
-from typing import TypedDict, List, Optional, Annotated
-import operator
-from langgraph.graph import StateGraph, MessagesState, START, END
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import TypedDict, List, Optional, Iterator, Tuple, Union
+from langgraph.graph import StateGraph, END
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from app.utils.json_stream import (
+    IncrementalJSONParser, instruction_event, missing_fields, parse_model_json, ParseStats,
+    INSTRUCTION_RESPONSE_SCHEMA
+)
+from app.utils.session_store import SessionStore, JSONFileSessionStore
+from app.utils.session_memory import SessionMemory, MEMORY_KEY, NO_HISTORY
+from app.utils.clients import call_options, get_chat_model
+from app.utils.resilience import Resilience, CircuitOpenError
+from app.utils.hedging import HedgePolicy
+from app.utils.deadline import Deadline, DeadlineExceeded
+from app.utils.prompts import prompt_registry
+from app.utils.metrics import stage_timer
+from app.utils.tracing import tracer, traced, SPAN_KIND_CLIENT
+from app.utils.image_store import ImageHandle, image_store, image_url
+
+logger = logging.getLogger(__name__)
+
+
+def _remaining(deadline: Optional[Deadline]) -> Optional[float]:
+    """Seconds left before the deadline, used as the RPC timeout (None = no deadline)"""
+    return deadline.remaining() if deadline is not None else None
+
 
 class VRContextState(TypedDict):
     """State for VR context information"""
     # Input fields
-    current_image: Optional[str]  # base64 encoded image
+    current_image: Optional[Union[ImageHandle, str]]  # image store handle, or base64 encoded image
+    image_mime_type: Optional[str]  # MIME type of a base64 current_image (default image/jpeg)
+    focus_image: Optional[Union[ImageHandle, str]]  # high-resolution crop around the gaze point (foveation)
+    extra_frames: Optional[List[dict]]  # other views of the scene: {"image", "image_mime_type", "gaze_vector"}
     task_step: Optional[str]
     current_task: Optional[str]
     gaze_vector: Optional[dict]  # {"x": float, "y": float, "z": float}
     session_id: Optional[str]
+    deadline: Optional[Deadline]  # When the request must be answered by (None = no limit)
 
     # Intermediate fields
     image_analysis: Optional[str]
@@ -24,9 +47,15 @@ class VRContextState(TypedDict):
     instruction_text: Optional[List[str]]  # List of instruction steps
     target_id: Optional[str]
     haptic_cue: Optional[str]
-
-    # Context history
-    context_history: Annotated[List[dict], operator.add]  # Accumulate context over time
+    parse_error: Optional[str]  # Set when the model output could not be parsed
+    parse_status: Optional[str]  # "ok", "repaired" (truncated or malformed output) or "failed"
+    retry_after: Optional[float]  # Set when Gemini was skipped because its circuit is open
+    deadline_exceeded: Optional[str]  # Stage that was running when the deadline passed
+
+    # Session memory, loaded from and saved with the session context
+    context_history: List[dict]  # Ring buffer of the most recent steps
+    context_summary: Optional[str]  # Running summary of the steps that left the buffer
+    summarized_steps: Optional[int]  # Number of steps folded into context_summary
     
     # Messages for LangGraph
     messages: Optional[List]
@@ -36,8 +65,22 @@ class VRContextWorkflow:
     LangGraph workflow for procesing VR headset images with context awareness
     """
 
-    def __init__(self, api_key: str, max_context_history: int = 10):
-        """Initialize the VR context workflow"""
+    def __init__(self, api_key: str, max_context_history: int = 10,
+                 session_store: Optional[SessionStore] = None,
+                 resilience: Optional[Resilience] = None,
+                 hedging: Optional[HedgePolicy] = None,
+                 max_summary_chars: int = 600):
+        """
+        Initialize the VR context workflow
+        
+        Args:
+            api_key: Gemini API key
+            max_context_history: Earlier steps of a session kept in full in the prompt
+            session_store: Where session contexts are loaded from and saved
+            resilience: Retries and circuit breakers for model calls
+            hedging: Optional hedge policy for slow calls
+            max_summary_chars: Size of the running summary of older steps
+        """
 
         # self.llm = ChatAnthropic(
         #     model="claude-sonnet-4-5-20250929",
@@ -45,24 +88,56 @@ class VRContextWorkflow:
         #     max_tokens=1024,
         #     temperature=0.2
         # )
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key,
-            max_tokens=4096,
-            temperature=0.2,
-            response_mime_type="application/json"
-        )
+        self.api_key = api_key
+        self._llm = None
         self.max_context_history = max_context_history
+        self.memory = SessionMemory(max_recent=max_context_history, max_summary_chars=max_summary_chars)
+        self.session_store = session_store or JSONFileSessionStore("contexts")
+        self.model_name = "gemini-2.5-flash"
+        self.resilience = resilience or Resilience()
+        self.hedging = hedging  # opt-in; not used by stream()
+        
+        # The static coaching instructions are built once and sent first on
+        # every call, so Gemini can serve the repeated prefix from its cache
+        self.prompt = prompt_registry.get("assist")
+        self.parse_stats = ParseStats()
+        self.system_message = SystemMessage(content=self.prompt.system)
         self.workflow = self.build_workflow()
 
+    @property
+    def llm(self):
+        """
+        The shared Gemini client from the process-wide registry, bound to
+        JSON output constrained by INSTRUCTION_RESPONSE_SCHEMA.
+        
+        Looked up on each use rather than stored, so a worker forked after
+        the workflow was built gets its own client. Assigning llm replaces it
+        (used by tests).
+        """
+        if self._llm is not None:
+            return self._llm
+        return get_chat_model(
+            self.api_key,
+            model=self.model_name,
+            temperature=0.2,
+            max_tokens=4096
+        ).bind(generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": INSTRUCTION_RESPONSE_SCHEMA
+        })
+    
+    @llm.setter
+    def llm(self, value):
+        self._llm = value
+    
     def build_workflow(self) -> StateGraph:
         """Build the LangGraph workflow"""
 
         workflow = StateGraph(VRContextState)
 
         # Add nodes and edges to the workflow as needed
-        workflow.add_node("analyze_and_instruct", self.analyze_and_instruct)
-        workflow.add_node("save_context", self.save_context)
+        workflow.add_node("analyze_and_instruct", traced("workflow.analyze_and_instruct", self.analyze_and_instruct))
+        workflow.add_node("save_context", traced("workflow.save_context", self.save_context))
 
         workflow.set_entry_point("analyze_and_instruct")
         workflow.add_edge("analyze_and_instruct", "save_context")
@@ -73,15 +148,12 @@ class VRContextWorkflow:
     
     def save_context(self, state: VRContextState) -> VRContextState:
         """
-        Node to save the context to JSON file
+        Node to save the context to the session store
         """
         try:
             if state.get("error"):
                 return state
             
-            import os
-            import json
-            
             # Create context data
             instruction_text = state.get("instruction_text", [])
             # Ensure it's always a list
@@ -91,6 +163,17 @@ class VRContextWorkflow:
             session_id = state.get("session_id", "unknown")
             task_step = state.get("task_step", "unknown")
             
+            # The step joins the ring buffer; whatever it pushes out is folded into the summary
+            entry = self.memory.entry(state.get("current_task", ""), task_step, state.get("image_analysis", ""),
+                                      instruction_text, state.get("target_id", ""))
+            recent, summary, summarized_steps = self.memory.record(
+                state.get("context_history") or [], state.get("context_summary") or "",
+                state.get("summarized_steps") or 0, entry
+            )
+            state["context_history"] = recent
+            state["context_summary"] = summary
+            state["summarized_steps"] = summarized_steps
+            
             context_data = {
                 "session_id": session_id,
                 "timestamp": datetime.utcnow().isoformat(),
@@ -103,36 +186,14 @@ class VRContextWorkflow:
                     "target_id": state.get("target_id", ""),
                     "haptic_cue": state.get("haptic_cue", "none")
                 },
-                "error": state.get("error", None)
-            }
-            
-            # Ensure contexts directory exists
-            os.makedirs("contexts", exist_ok=True)
-            
-            # Save to file
-            filepath = f"contexts/{session_id}.json"
-            with open(filepath, "w") as f:
-                json.dump(context_data, f, indent=2)
-            
-            print(f"Context saved: {filepath}")
-            
-            # Also update context_history for in-memory tracking
-            context_entry = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "task": state.get("current_task", ""),
-                "step": task_step,
-                "image_analysis": state.get("image_analysis", ""),
-                "step_text": state.get("instruction_text", ""),
+                "error": state.get("error", None),
+                MEMORY_KEY: self.memory.to_context(recent, summary, summarized_steps)
             }
             
-            if "context_history" not in state:
-                state["context_history"] = []
+            with stage_timer("context_save"), tracer.span("session.save", attributes={"session.id": session_id}):
+                self.session_store.save(session_id, context_data)
             
-            state["context_history"].append(context_entry)
-            
-            # Trim history if needed
-            if len(state["context_history"]) > self.max_context_history:
-                state["context_history"] = state["context_history"][-self.max_context_history:]
+            logger.debug("Context saved for session %s", session_id)
             
             return state
             
@@ -145,250 +206,288 @@ class VRContextWorkflow:
         Combined node: Analyze image and generate instruction in one LLM call
         """
         try:
-            if state.get("error"):
+            message = self._start_analysis(state)
+            if message is None:
                 return state
             
-            image_data = state.get("current_image")
-            if not image_data:
-                state["error"] = "No image data provided"
-                state["image_analysis"] = "Error: No image data"
-                state["instruction_text"] = "Error: No image to analyze"
-                state["target_id"] = ""
-                state["haptic_cue"] = "none"
-                return state
-            
-            task = state.get("current_task", "Unknown task")
-            step = state.get("task_step", "Unknown step")
-            gaze = state.get("gaze_vector", {})
-            
-            # AR Hands-On Coach prompt for Meta Quest 3
-            prompt = f"""You are a Hands-On Coach for Meta Quest 3 AR, guiding users through physical tasks in real-time.
-
-CURRENT CONTEXT:
-Task: {task}
-Current Step: {step}
-User's Gaze Direction: {gaze}
-
-YOUR ROLE:
-You analyze what the user sees through their AR headset and provide clear, actionable guidance for hands-on tasks like assembly, repair, installation, or learning procedures.
-
-CORE PRINCIPLES:
-
-1. SAFETY FIRST
-   - Always mention safety considerations when relevant (power off, grounding, sharp edges, etc.)
-   - Warn about potential hazards before they become issues
-   - If something looks unsafe, address it immediately
-
-2. BE SPECIFIC AND SPATIAL
-   - Use precise spatial language: "on the left side", "the blue connector near the top-right", "the metal bracket closest to you"
-   - Reference what the user is looking at based on gaze direction
-   - Describe components by visual characteristics (color, shape, size, labels)
-
-3. STEP-BY-STEP CLARITY
-   - Break complex actions into simple, sequential steps
-   - Each step should be one clear action the user can complete
-   - Use action verbs: "Locate", "Align", "Insert", "Rotate", "Press", "Connect"
-   - Assume the user has their hands free and is actively working
-
-4. CONTEXT AWARENESS
-   - Acknowledge what's visible in the current view
-   - If components are missing or incorrect, point it out
-   - If the user seems stuck (same step repeatedly), offer troubleshooting
-   - Adapt guidance based on what you observe
-
-5. CONCISE BUT COMPLETE
-   - Keep each step to 1-2 sentences maximum
-   - Provide 3-6 steps per instruction set
-   - No filler words or unnecessary explanations
-   - Get straight to what the user needs to do next
-
-INSTRUCTION QUALITY EXAMPLES:
-
-GOOD:
-- "Locate the 24-pin power connector on the right side of the motherboard"
-- "Align the notch on the RAM stick with the slot, then press firmly until it clicks"
-- "Remove the four screws securing the PSU bracket using a Phillips screwdriver"
-
-BAD:
-- "You'll want to find the connector" (vague, not actionable)
-- "Install the component properly" (not specific enough)
-- "Let me help you with this task" (unnecessary meta-commentary)
-
-RESPONSE FORMAT:
-
-Analyze the image and provide:
-
-1. IMAGE ANALYSIS (2-3 sentences):
-   - What components/objects are visible
-   - Current state of the task (what's done, what's next)
-   - Any issues, misalignments, or concerns you notice
-
-2. INSTRUCTION STEPS (3-6 steps):
-   - Clear, numbered action steps
-   - Specific to the current task and step number
-   - Spatially aware based on what's visible
-   - Progressive (each step builds toward completion)
-
-3. TARGET ID:
-   - If there's a specific component to highlight, provide its identifier
-   - Use descriptive names like "psu_connector", "ram_slot_2", "mounting_screw_top_left"
-   - Leave empty if no specific target
-
-4. HAPTIC CUE:
-   - "guide_to_target": When user needs to locate something specific
-   - "success_pulse": When a step is completed correctly
-   - "none": For general guidance or observation
-
-Respond in this EXACT JSON format:
-{{
-  "image_analysis": "Brief analysis of what's visible and current task state",
-  "instruction": {{
-    "steps": [
-      "First specific action step",
-      "Second specific action step",
-      "Third specific action step",
-      "Fourth specific action step",
-      "Fifth specific action step",
-      "Sixth specific action step (if needed)"
-    ],
-    "target_id": "component_identifier or empty string",
-    "haptic_cue": "guide_to_target | success_pulse | none"
-  }}
-}}
-
-Respond ONLY with valid JSON. No additional text.""" 
-            
-            # Create multimodal message
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": f"data:image/jpeg;base64,{image_data}"
-                    }
-                ]
-            )
+            # The sync client cannot be cancelled; the deadline is checked up front and bounds the RPC
+            self._check_deadline(state)
             
-            print(f"DEBUG - Processing image for task: {task}, step: {step}")
+            # Invoke with backoff, retry budget and circuit breaker
+            with stage_timer("llm_call"):
+                response = self.resilience.call(self.model_name, lambda: self._invoke(message, state.get("deadline")),
+                                                state.get("deadline"))
+            logger.debug("Model response received: %d chars", len(response.content))
             
-            # Invoke with retry
-            max_retries = 2
-            for attempt in range(max_retries):
-                try:
-                    response = self.llm.invoke([message])
-                    print(f"DEBUG - Response received: {len(response.content)} chars")
-                    break
-                except Exception as e:
-                    print(f"ERROR - Attempt {attempt + 1} failed: {e}")
-                    if attempt < max_retries - 1:
-                        import time
-                        time.sleep(2)
-                    else:
-                        raise
+            self._finish_analysis(state, message, response)
+            return state
             
-            # Parse JSON response
-            import json
-            import re
+        except Exception as e:
+            self._fail_analysis(state, e)
+            return state
+    
+    def _check_deadline(self, state: VRContextState) -> None:
+        """Raise DeadlineExceeded if the request's deadline has passed"""
+        deadline = state.get("deadline")
+        if deadline is not None:
+            deadline.check("generation")
+    
+    def _messages(self, message: HumanMessage) -> list:
+        """
+        The model input: the static system instruction, then the request's
+        message with its image references turned into data URLs
+        """
+        return image_store.materialize([self.system_message, message])
+    
+    def _invoke(self, message: HumanMessage, deadline: Optional[Deadline] = None):
+        """
+        Call the model once (one attempt, traced as its own span), bounded by
+        the deadline, hedging with a second identical call when the first is
+        slower than usual and a hedge policy is configured.
+        
+        The first response that parses as complete JSON wins; the other call
+        is abandoned and runs on upstream until it returns or its RPC timeout
+        (the deadline's remaining time, capped by the hedge policy's per-call
+        limit) expires.
+        """
+        with tracer.span("gemini.generate", SPAN_KIND_CLIENT, {"gen_ai.request.model": self.model_name,
+                                                               "hedging": self.hedging is not None}):
+            messages = self._messages(message)
+            if self.hedging is None:
+                return self.llm.invoke(messages, **call_options(_remaining(deadline)))
             
+            return self.hedging.run(
+                lambda: self.llm.invoke(messages, **call_options(self.hedging.call_timeout(_remaining(deadline)))),
+                self._is_complete_response)
+    
+    def _is_complete_response(self, response) -> bool:
+        """Return True if the model response parses as JSON without repair (not truncated or malformed)"""
+        content = response.content if isinstance(response.content, str) else ""
+        return parse_model_json(content)[1] == "ok"
+    
+    def _start_analysis(self, state: VRContextState) -> Optional[HumanMessage]:
+        """
+        Validate the state and build the model message.
+        
+        Returns None (with the error fields set when needed) if analysis should be skipped.
+        """
+        if state.get("error"):
+            return None
+        
+        image_data = state.get("current_image")
+        if not image_data:
+            state["error"] = "No image data provided"
+            state["image_analysis"] = "Error: No image data"
+            state["instruction_text"] = "Error: No image to analyze"
+            state["target_id"] = ""
+            state["haptic_cue"] = "none"
+            return None
+        
+        task = state.get("current_task", "Unknown task")
+        step = state.get("task_step", "Unknown step")
+        
+        self._load_memory(state)
+        message = self._build_message(state)
+        
+        logger.debug("Processing image for task %s, step %s", task, step)
+        
+        return message
+    
+    def _finish_analysis(self, state: VRContextState, message: HumanMessage, response) -> None:
+        """Parse the model response into the state and record the exchanged messages"""
+        self._apply_result(state, *self._parse_response(response.content))
+        
+        # Store messages
+        if "messages" not in state or state["messages"] is None:
+            state["messages"] = []
+        state["messages"].append(message)
+        state["messages"].append(response)
+        
+        # Payload dump: only kept for sampled requests (LOG_MESSAGE_SAMPLE_RATES=model_payload=...)
+        logger.debug(
+            "Model result: analysis=%.100s instruction=%s target_id=%s haptic=%s",
+            state["image_analysis"], state["instruction_text"], state["target_id"], state["haptic_cue"],
+            extra={"sample_key": "model_payload", "session_id": state.get("session_id")}
+        )
+    
+    def _fail_analysis(self, state: VRContextState, e: Exception) -> None:
+        """Set the error fields after a failed analysis"""
+        error_msg = f"Analysis and instruction failed: {str(e)}"
+        state["error"] = error_msg
+        state["image_analysis"] = f"Error: {str(e)}"
+        state["instruction_text"] = "System error. Please try again."
+        state["target_id"] = ""
+        state["haptic_cue"] = "none"
+        if isinstance(e, CircuitOpenError):
+            # Failed fast without calling Gemini; the route answers 503
+            state["retry_after"] = e.retry_after
+        if isinstance(e, DeadlineExceeded):
+            # The route answers 504 with a "try again" response
+            state["deadline_exceeded"] = e.stage
+        if isinstance(e, (CircuitOpenError, DeadlineExceeded)):
+            logger.warning(error_msg, extra={"session_id": state.get("session_id")})
+        else:
+            logger.error(error_msg, exc_info=e, extra={"session_id": state.get("session_id")})
+    
+    def _load_memory(self, state: VRContextState) -> None:
+        """Load the session's recent steps and running summary into the state"""
+        session_id = state.get("session_id")
+        context = None
+        if session_id:
             try:
-                content = response.content.strip()
-                
-                print(f"DEBUG - Raw response: {content[:300]}")  # Show first 300 chars
-                
-                # Extract JSON if wrapped in markdown
-                if "```" in content:
-                    start_idx = content.find('{')
-                    end_idx = content.rfind('}')
-                    if start_idx != -1 and end_idx != -1:
-                        content = content[start_idx:end_idx + 1]
-                        print(f"DEBUG - Extracted JSON from markdown")
-                
-                result = json.loads(content)
-                print(f"DEBUG - Parsed JSON successfully")
-                print(f"DEBUG - Keys in result: {result.keys()}")
-                
-            except (json.JSONDecodeError, AttributeError) as e:
-                print(f"ERROR - JSON parsing failed: {e}")
-                print(f"ERROR - Content: {content[:500]}")
-                
-                # Fallback
-                result = {
-                    "image_analysis": "Error parsing analysis",
-                    "step_text": "Unable to process image. Please try again.",
-                    "target_id": "",
-                    "haptic_cue": "none"
+                with stage_timer("session_load"), tracer.span("session.load", attributes={"session.id": session_id}):
+                    context = self.session_store.load(session_id)
+            except Exception as e:
+                # An unreadable session only costs the history, not the request
+                logger.warning("Session memory unavailable: %s", e, extra={"session_id": session_id})
+        
+        state["context_history"], state["context_summary"], state["summarized_steps"] = self.memory.from_context(context)
+    
+    def _build_prompt(self, task: str, step: str, gaze: dict, history: str = NO_HISTORY) -> str:
+        """Build the per-request part of the AR Hands-On Coach prompt (the rest is in system_message)"""
+        return self.prompt.render(task=task, step=step, gaze=gaze, history=history)
+    
+    def _build_message(self, state: VRContextState) -> HumanMessage:
+        """Create the multimodal message for the current image and task context"""
+        prompt = self._build_prompt(
+            state.get("current_task", "Unknown task"),
+            state.get("task_step", "Unknown step"),
+            state.get("gaze_vector", {}),
+            self.memory.render(state.get("context_history") or [], state.get("context_summary") or "",
+                               state.get("summarized_steps") or 0)
+        )
+        
+        # Handles become blob: references, resolved only when the model is called
+        mime_type = state.get('image_mime_type') or 'image/jpeg'
+        content = [
+            {"type": "text", "text": prompt},
+            {
+                "type": "image_url",
+                "image_url": image_url(state.get('current_image'), mime_type)
+            }
+        ]
+        
+        if state.get("focus_image"):
+            content.extend([
+                {
+                    "type": "text",
+                    "text": "The image above is a low-resolution view of the whole scene. The next image is a "
+                            "high-resolution crop centred on where the user is looking; use it to read small "
+                            "labels, connectors and components."
+                },
+                {
+                    "type": "image_url",
+                    "image_url": image_url(state.get('focus_image'), mime_type)
                 }
+            ])
+        
+        for index, frame in enumerate(state.get("extra_frames") or [], 2):
+            frame_mime_type = frame.get("image_mime_type") or "image/jpeg"
+            content.extend([
+                {
+                    "type": "text",
+                    "text": f"View {index} of the same scene from another angle (gaze: {frame.get('gaze_vector', {})}). "
+                            "Use all views together and give one set of instructions."
+                },
+                {
+                    "type": "image_url",
+                    "image_url": image_url(frame.get("image"), frame_mime_type)
+                }
+            ])
+        
+        return HumanMessage(content=content)
+    
+    def _parse_response(self, content: str) -> Tuple[dict, str]:
+        """
+        Parse the JSON response from the model, repairing it if needed, falling back to an error payload.
+        
+        Returns:
+            Tuple of (result, parse status: "ok", "repaired" or "failed")
+        """
+        with stage_timer("json_parse"):
+            result, status = parse_model_json(content)
+        self.parse_stats.record(status)
+        
+        if status == "repaired":
+            logger.warning("Repaired malformed or truncated model JSON (%d chars)", len(content or ""))
+            missing = missing_fields(result)
+            if missing:
+                result["parse_error"] = f"Model output is missing {', '.join(missing)}"
+        
+        if result is None:
+            logger.error("Model JSON parsing failed (%d chars)", len(content or ""))
+            logger.debug("Unparseable model output: %.500s", content or "", extra={"sample_key": "model_payload"})
             
-            # Validate and set state - FIXED to use step_text
-            valid_cues = ["guide_to_target", "success_pulse", "none"]
-            
-            state["image_analysis"] = result.get("image_analysis", "No analysis available")
-            
-            # Handle nested instruction object
-            instruction = result.get("instruction", {})
-            if isinstance(instruction, dict):
-                # Get steps as a list
-                steps = instruction.get("steps", [])
-                if isinstance(steps, list) and len(steps) > 0:
-                    state["instruction_text"] = steps  # Store as list
-                else:
-                    # Fallback to text field if steps not provided
-                    text = instruction.get("text", "No instruction available")
-                    state["instruction_text"] = [text] if isinstance(text, str) else ["No instruction available"]
-                
-                state["target_id"] = instruction.get("target_id", "")
-                state["haptic_cue"] = instruction.get("haptic_cue", "none")
+            # Fallback
+            result = {
+                "image_analysis": "Error parsing analysis",
+                "step_text": "Unable to process image. Please try again.",
+                "target_id": "",
+                "haptic_cue": "none",
+                "parse_error": "Model output is not a JSON object"
+            }
+        
+        return result, status
+    
+    def _apply_result(self, state: VRContextState, result: dict, status: str) -> None:
+        """Validate the parsed model output and copy it into the state"""
+        valid_cues = ["guide_to_target", "success_pulse", "none"]
+        
+        state["image_analysis"] = result.get("image_analysis", "No analysis available")
+        state["parse_error"] = result.get("parse_error")
+        state["parse_status"] = status
+        
+        # Handle nested instruction object
+        instruction = result.get("instruction", {})
+        if isinstance(instruction, dict):
+            # Get steps as a list
+            steps = instruction.get("steps", [])
+            if isinstance(steps, list) and len(steps) > 0:
+                state["instruction_text"] = steps  # Store as list
             else:
-                # Fallback for flat structure
-                text = result.get("instruction_text", "No instruction available")
+                # Fallback to text field if steps not provided
+                text = instruction.get("text", "No instruction available")
                 state["instruction_text"] = [text] if isinstance(text, str) else ["No instruction available"]
-                state["target_id"] = result.get("target_id", "")
-                state["haptic_cue"] = result.get("haptic_cue", "none")
-            
-            if state["haptic_cue"] not in valid_cues:
-                state["haptic_cue"] = "none"
-            
-            # Store messages
-            if "messages" not in state or state["messages"] is None:
-                state["messages"] = []
-            state["messages"].append(message)
-            state["messages"].append(response)
-            
-            print(f"DEBUG - Analysis: {state['image_analysis'][:100] if state['image_analysis'] else 'None'}...")
-            print(f"DEBUG - Instruction: {state['instruction_text']}")
-            print(f"DEBUG - Target ID: {state['target_id']}")
-            print(f"DEBUG - Haptic: {state['haptic_cue']}")
-            
-            return state
             
-        except Exception as e:
-            error_msg = f"Analysis and instruction failed: {str(e)}"
-            state["error"] = error_msg
-            state["image_analysis"] = f"Error: {str(e)}"
-            state["instruction_text"] = "System error. Please try again."
-            state["target_id"] = ""
+            state["target_id"] = instruction.get("target_id", "")
+            state["haptic_cue"] = instruction.get("haptic_cue", "none")
+        else:
+            # Fallback for flat structure
+            text = result.get("instruction_text", "No instruction available")
+            state["instruction_text"] = [text] if isinstance(text, str) else ["No instruction available"]
+            state["target_id"] = result.get("target_id", "")
+            state["haptic_cue"] = result.get("haptic_cue", "none")
+        
+        if state["haptic_cue"] not in valid_cues:
             state["haptic_cue"] = "none"
-            print(f"ERROR - {error_msg}")
-            import traceback
-            traceback.print_exc()
-            return state
     
-    def _build_context_summary(self, context_history: List[dict]) -> str:
-        """Build a summary of recent context history"""
-        if not context_history:
-            return "No previous context available."
-        
-        summary_lines = ["Recent Context History:"]
-        for i, entry in enumerate(context_history[-5:], 1):  # Last 5 entries
-            summary_lines.append(
-                f"{i}. [{entry['timestamp']}] Scene: {entry['scene']}, "
-                f"Action: {entry['action']}"
-            )
-        
-        return "\n".join(summary_lines)
-        
-    def run(self, image_base64: str, task_step: str, current_task: str, 
-            gaze_vector: dict, session_id: str) -> dict:
+    def _initial_state(self, image: Union[ImageHandle, str], task_step: str, current_task: str,
+                       gaze_vector: dict, session_id: str,
+                       image_mime_type: str = "image/jpeg",
+                       focus_image: Optional[Union[ImageHandle, str]] = None,
+                       deadline: Optional[Deadline] = None,
+                       extra_frames: Optional[List[dict]] = None) -> VRContextState:
+        """Create the initial workflow state for a request"""
+        return {
+            "current_image": image,
+            "image_mime_type": image.mime_type if isinstance(image, ImageHandle) else image_mime_type,
+            "focus_image": focus_image,
+            "extra_frames": extra_frames or [],
+            "task_step": task_step,
+            "current_task": current_task,
+            "gaze_vector": gaze_vector,
+            "session_id": session_id,
+            "deadline": deadline,
+            "context_history": [],
+            "context_summary": "",
+            "summarized_steps": 0,
+            "messages": []
+        }
+    
+    def run(self, image: Union[ImageHandle, str], task_step: str, current_task: str, 
+            gaze_vector: dict, session_id: str, image_mime_type: str = "image/jpeg",
+            focus_image: Optional[Union[ImageHandle, str]] = None, deadline: Optional[Deadline] = None,
+            extra_frames: Optional[List[dict]] = None) -> dict:
         """
         Run the workflow with a new AR assistance request.
         
@@ -396,11 +495,21 @@ Respond ONLY with valid JSON. No additional text."""
         It creates the initial state, runs the workflow, and returns the result.
         
         Args:
-            image_base64: Base64 encoded image from VR headset
+            image: ImageHandle from the image store (the bytes are only
+                base64 encoded for the model call), or a base64 encoded image
             task_step: Current step in the task (e.g., "4")
             current_task: Name/ID of the current task (e.g., "PSU_Install")
             gaze_vector: User's gaze direction {"x": float, "y": float, "z": float}
             session_id: Session identifier for context persistence
+            image_mime_type: MIME type of a base64 image (default: image/jpeg;
+                handles carry their own)
+            focus_image: Optional high-resolution crop around the gaze point,
+                handle or base64 (same MIME type), sent as a second image
+            deadline: Optional request deadline; checked before the Gemini
+                call and used as its RPC timeout
+            extra_frames: Optional other views of the scene, each a dict with
+                image (handle or base64), image_mime_type and gaze_vector; sent in the
+                same call after the main image
             
         Returns:
             Final state dict with:
@@ -409,23 +518,103 @@ Respond ONLY with valid JSON. No additional text."""
                 - haptic_cue: Haptic feedback type
                 - session_id: Session identifier
                 - error: Error message if something went wrong
+                - deadline_exceeded: Stage name if the deadline passed
         """
-        # Create initial state
-        initial_state = {
-            "current_image": image_base64,
-            "task_step": task_step,
-            "current_task": current_task,
-            "gaze_vector": gaze_vector,
-            "session_id": session_id,
-            "context_history": [],
-            "messages": []
-        }
+        initial_state = self._initial_state(image, task_step, current_task, gaze_vector, session_id,
+                                            image_mime_type, focus_image, deadline, extra_frames)
         
         # Run workflow
-        result = self.workflow.invoke(initial_state)
+        with tracer.span("workflow.run", attributes=self._span_attributes(initial_state)):
+            result = self.workflow.invoke(initial_state)
         
         return result
     
+    def _span_attributes(self, state: VRContextState) -> dict:
+        """Trace attributes identifying a workflow run"""
+        return {
+            "session.id": state.get("session_id"),
+            "task": state.get("current_task"),
+            "task.step": state.get("task_step"),
+            "frame_count": 1 + len(state.get("extra_frames") or [])
+        }
+    
+    def stream(self, image: Union[ImageHandle, str], task_step: str, current_task: str,
+               gaze_vector: dict, session_id: str, image_mime_type: str = "image/jpeg",
+               focus_image: Optional[Union[ImageHandle, str]] = None, deadline: Optional[Deadline] = None) -> Iterator[dict]:
+        """
+        Run an AR assistance request, yielding instruction fields as they are generated.
+        
+        Uses the model's streaming output and incrementally parses the JSON
+        response so each instruction step, the target_id and the haptic_cue
+        are emitted as soon as they are complete. The context is saved once
+        the full response has been received.
+        
+        Args:
+            image: ImageHandle from the image store (the bytes are only
+                base64 encoded for the model call), or a base64 encoded image
+            task_step: Current step in the task (e.g., "4")
+            current_task: Name/ID of the current task (e.g., "PSU_Install")
+            gaze_vector: User's gaze direction {"x": float, "y": float, "z": float}
+            session_id: Session identifier for context persistence
+            image_mime_type: MIME type of a base64 image (default: image/jpeg;
+                handles carry their own)
+            focus_image: Optional high-resolution crop around the gaze point,
+                handle or base64 (same MIME type), sent as a second image
+            deadline: Optional request deadline; streaming stops once it passes
+            
+        Yields:
+            Event dicts: "image_analysis", "step", "target_id" and "haptic_cue"
+            while streaming, then a final "complete" event whose "result" is
+            the same final state dict returned by run()
+        """
+        state = self._initial_state(image, task_step, current_task, gaze_vector, session_id,
+                                    image_mime_type, focus_image, deadline)
+        
+        try:
+            self._load_memory(state)
+            message = self._build_message(state)
+            parser = IncrementalJSONParser()
+            chunks = []
+            
+            # Events are yielded as they arrive, so a stream is never retried;
+            # it still fails fast when the circuit is open
+            self._check_deadline(state)
+            self.resilience.guard(self.model_name)
+            try:
+                for chunk in self.llm.stream(self._messages(message), **call_options(_remaining(state.get("deadline")))):
+                    # Stop reading (and drop the upstream stream) once the deadline passes
+                    self._check_deadline(state)
+                    text = chunk.content if isinstance(chunk.content, str) else ""
+                    chunks.append(text)
+                    for path, value in parser.feed(text):
+                        event = instruction_event(path, value)
+                        if event:
+                            yield event
+            except Exception as e:
+                # Raises DeadlineExceeded instead if the RPC hit the client's deadline
+                self.resilience.record_outcome(self.model_name, e, state.get("deadline"))
+                raise
+            except BaseException:
+                # The client went away mid-stream (GeneratorExit): no outcome, but the slot is returned
+                self.resilience.release(self.model_name)
+                raise
+            self.resilience.record_outcome(self.model_name)
+            
+            content = "".join(chunks)
+            self._apply_result(state, *self._parse_response(content))
+            state["messages"] = [message, AIMessage(content=content)]
+            state = self.save_context(state)
+            
+        except Exception as e:
+            state["error"] = f"Analysis and instruction failed: {str(e)}"
+            if isinstance(e, CircuitOpenError):
+                state["retry_after"] = e.retry_after
+            if isinstance(e, DeadlineExceeded):
+                state["deadline_exceeded"] = e.stage
+            logger.error(state["error"], exc_info=not isinstance(e, (CircuitOpenError, DeadlineExceeded)))
+        
+        yield {"event": "complete", "result": state}
+    
 # Example usage and testing
 if __name__ == "__main__":
     import os
@@ -446,4 +635,4 @@ if __name__ == "__main__":
     print("2. Analyze image with Claude Vision")
     print("3. Store context with timestamp")
     print("4. Generate context-aware LLM response")
-    print("\nTo use: workflow.run(image_base64, user_query)")
+    print("\nTo use: workflow.run(image, task_step, current_task, gaze_vector, session_id)")
@@ -0,0 +1,345 @@
+"""
+Replay a captured request corpus against the Flask app with fake upstreams.
+
+Record a corpus by running the server with CAPTURE_ENABLED=true (see
+app/utils/capture.py), then:
+
+    python replay.py replay_corpus --concurrency 8 --rate 20 --requests 500
+
+Requests are sent in-process through the Flask test client, so no server,
+network or Gemini/Speech quota is needed. Gemini and Speech-to-Text are
+the in-process fakes (app/utils/fakes.py): model calls take a latency
+drawn from the corpus' recorded durations (or a given distribution), and
+429s, timeouts and malformed output can be injected.
+
+Reports throughput and p50/p95/p99 latency per endpoint, plus the fake
+model and STT stages.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Config is read when app.main is imported: never capture a replay, never
+# probe the real upstreams, and make sure the workflow is built
+os.environ['CAPTURE_ENABLED'] = 'false'
+os.environ['HEALTH_MONITOR_ENABLED'] = 'false'
+os.environ.setdefault('GEMINI_API_KEY', 'replay-fake-key')
+os.environ.setdefault('API_KEY', 'replay-api-key')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.capture import load_corpus
+from app.utils.clients import use_fake_backends
+from app.utils.fakes import FaultInjector, parse_latency
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0-100) of values; 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(seconds: List[float]) -> dict:
+    """Count, mean and p50/p95/p99/max of latencies, in milliseconds."""
+    ms = [value * 1000 for value in seconds]
+    return {
+        'count': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 1) if ms else 0.0,
+        'p50_ms': round(percentile(ms, 50), 1),
+        'p95_ms': round(percentile(ms, 95), 1),
+        'p99_ms': round(percentile(ms, 99), 1),
+        'max_ms': round(max(ms), 1) if ms else 0.0
+    }
+
+
+class LatencySampler:
+    """Draws fake upstream latencies (seconds) from recorded samples."""
+
+    def __init__(self, samples: List[float], scale: float = 1.0):
+        self.samples = samples or [0.0]
+        self.scale = scale
+
+    def __call__(self, rng: random.Random) -> float:
+        return rng.choice(self.samples) * self.scale
+
+    @classmethod
+    def from_spec(cls, spec: str, recorded: List[float], scale: float = 1.0):
+        """
+        Build a latency function from a command line value.
+
+        Args:
+            spec: "recorded" to replay recorded durations, or a latency spec
+                (see fakes.parse_latency)
+            recorded: Recorded durations in seconds
+            scale: Multiplier applied to every sample
+
+        Returns:
+            Function drawing seconds from a Random
+        """
+        if spec == 'recorded':
+            return cls(recorded, scale)
+        latency = parse_latency(spec)
+        return lambda rng: latency(rng) * scale
+
+
+class StageTimings:
+    """Thread-safe latency samples per stage; pass record as the fakes' observer."""
+
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {stage: list(samples) for stage, samples in self._samples.items()}
+
+
+def recorded_durations(corpus: List[dict]) -> List[float]:
+    """
+    Recorded server durations (seconds) of successful requests.
+
+    These include server overhead, so they are an upper bound on the
+    upstream latency they stand in for.
+    """
+    return [entry['duration_ms'] / 1000 for entry in corpus if entry.get('status_code') == 200]
+
+
+def seed_sessions(app, corpus: List[dict]) -> None:
+    """Save a context for every session /ask entries refer to, so they do not 404."""
+    for entry in corpus:
+        if entry['endpoint'] != '/ask':
+            continue
+        session_id = (entry.get('json') or {}).get('session_id') or (entry['form'].get('session_id') or [None])[0]
+        if not session_id:
+            continue
+        app.session_store.save(session_id, {
+            "session_id": session_id,
+            "timestamp": "replay",
+            "task": "PSU_Install",
+            "step": "1",
+            "gaze_vector": {"x": 0.0, "y": 0.0, "z": 1.0},
+            "image_analysis": "Replay seed context",
+            "instruction": {"steps": ["Slide the PSU into the bay"], "target_id": "psu_bay", "haptic_cue": "none"},
+            "error": None
+        })
+
+
+def send(client, entry: dict, api_key: str):
+    """Send one captured request and read the full response body."""
+    headers = {name: value for name, value in entry['headers'].items() if name != 'Content-Type'}
+    headers['Authorization'] = f'Bearer {api_key}'
+
+    if entry.get('body') is not None:
+        # Raw snapshot upload: the fields are in the headers and query string
+        response = client.post(entry['endpoint'], data=entry['body'], headers=headers,
+                               query_string=entry.get('query'),
+                               content_type=entry['headers'].get('Content-Type', 'application/octet-stream'))
+    elif entry.get('json') is not None:
+        response = client.post(entry['endpoint'], json=entry['json'], headers=headers,
+                               query_string=entry.get('query'))
+    else:
+        data = dict(entry['form'])
+        for field, uploads in entry['files'].items():
+            data[field] = [(io.BytesIO(upload['data']), upload['filename'], upload['content_type'])
+                           for upload in uploads]
+        response = client.post(entry['endpoint'], data=data, headers=headers,
+                               query_string=entry.get('query'), content_type='multipart/form-data')
+
+    # Streamed responses are only complete once the body has been read
+    response.get_data()
+    return response
+
+
+def run_replay(app, corpus: List[dict], concurrency: int = 4, rate: float = 0.0,
+               total_requests: Optional[int] = None, seed: Optional[int] = None) -> dict:
+    """
+    Send the corpus (cycled up to total_requests) through the app.
+
+    With rate > 0 requests arrive open-loop as a Poisson process at that
+    many per second, and latency is measured from the scheduled arrival so
+    queueing behind busy workers counts. With rate 0 each of the concurrency
+    workers sends its next request as soon as the previous one finishes.
+
+    Returns:
+        Dict with per-endpoint latencies (seconds), status code counts and
+        the wall-clock duration
+    """
+    total_requests = total_requests or len(corpus)
+    rng = random.Random(seed)
+    api_key = app.config['API_KEY']
+    work: queue.Queue = queue.Queue()
+    latencies: Dict[str, List[float]] = {}
+    statuses: Dict[str, Dict[int, int]] = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            entry, scheduled = item
+            if scheduled is None:
+                scheduled = time.monotonic()
+            try:
+                status_code = send(client, entry, api_key).status_code
+            except Exception:
+                status_code = 0
+            elapsed = time.monotonic() - scheduled
+            with lock:
+                latencies.setdefault(entry['endpoint'], []).append(elapsed)
+                counts = statuses.setdefault(entry['endpoint'], {})
+                counts[status_code] = counts.get(status_code, 0) + 1
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in workers:
+        thread.start()
+
+    arrival = started
+    for index in range(total_requests):
+        entry = corpus[index % len(corpus)]
+        if rate > 0:
+            arrival += rng.expovariate(rate)
+            time.sleep(max(0.0, arrival - time.monotonic()))
+            work.put((entry, arrival))
+        else:
+            work.put((entry, None))
+
+    for _ in workers:
+        work.put(None)
+    for thread in workers:
+        thread.join()
+
+    return {
+        'latencies': latencies,
+        'statuses': statuses,
+        'wall_seconds': time.monotonic() - started
+    }
+
+
+def build_report(results: dict, timings: Optional[StageTimings] = None) -> dict:
+    """Throughput and latency percentiles per endpoint and per fake upstream stage."""
+    wall = results['wall_seconds'] or 1e-9
+    endpoints = {}
+    for endpoint, seconds in sorted(results['latencies'].items()):
+        endpoints[endpoint] = dict(
+            summarize(seconds),
+            throughput_rps=round(len(seconds) / wall, 2),
+            statuses={str(code): count for code, count in sorted(results['statuses'][endpoint].items())}
+        )
+
+    total = sum(len(seconds) for seconds in results['latencies'].values())
+    return {
+        'requests': total,
+        'wall_seconds': round(results['wall_seconds'], 3),
+        'throughput_rps': round(total / wall, 2),
+        'endpoints': endpoints,
+        'stages': {stage: summarize(seconds) for stage, seconds in sorted((timings.snapshot() if timings else {}).items())}
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['requests']} requests in {report['wall_seconds']}s ({report['throughput_rps']} req/s)")
+    print(f"\n{'endpoint / stage':<20}{'count':>7}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<20}{row['count']:>7}{row['throughput_rps']:>8}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}  {row['statuses']}")
+    for stage, row in report['stages'].items():
+        print(f"{'  ' + stage:<20}{row['count']:>7}{'':>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def install_fakes(corpus: List[dict], model_latency: str = 'recorded', stt_latency: str = '0.5',
+                  latency_scale: float = 1.0, seed: Optional[int] = None, **fault_rates) -> StageTimings:
+    """
+    Route every Gemini and Speech-to-Text call to the fakes.
+
+    Args:
+        corpus: Loaded corpus, for the recorded latency distribution
+        model_latency: "recorded" or a latency spec for Gemini calls
+        stt_latency: Latency spec for transcriptions
+        latency_scale: Multiplier applied to every latency
+        seed: Random seed for latencies and faults
+        fault_rates: rate_limit_rate, timeout_rate, malformed_rate and
+            timeout_seconds for FaultInjector
+
+    Returns:
+        StageTimings the fakes report their latencies to
+    """
+    timings = StageTimings()
+    use_fake_backends(
+        FaultInjector(LatencySampler.from_spec(model_latency, recorded_durations(corpus), latency_scale),
+                      seed=seed, **fault_rates),
+        FaultInjector(LatencySampler.from_spec(stt_latency, [], latency_scale), seed=seed, **fault_rates),
+        observer=timings.record
+    )
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', help='Corpus directory written by CAPTURE_ENABLED=true')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients (default: 4)')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Open-loop arrival rate in requests/s (default: 0 = closed loop)')
+    parser.add_argument('--requests', type=int, default=None, help='Requests to send (default: corpus size)')
+    parser.add_argument('--model-latency', default='recorded',
+                        help='"recorded" (corpus durations) or a latency spec such as lognormal:1.5,0.4 '
+                             '(default: recorded)')
+    parser.add_argument('--stt-latency', default='0.5', help='Latency spec for transcriptions (default: 0.5)')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Multiply every fake latency')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of upstream calls failing with 429')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction of upstream calls that time out')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='Fraction of upstream calls returning truncated or empty output')
+    parser.add_argument('--timeout-seconds', type=float, default=30.0, help='How long a timed-out call hangs')
+    parser.add_argument('--no-response-cache', action='store_true', help='Disable the /assist response cache')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for arrivals and latencies')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No captured requests in {args.corpus}")
+        return 1
+
+    from app.main import create_app
+    app = create_app()
+    if args.no_response_cache:
+        app.response_cache = None
+
+    timings = install_fakes(
+        corpus, args.model_latency, args.stt_latency, args.latency_scale, args.seed,
+        rate_limit_rate=args.rate_limit_rate,
+        timeout_rate=args.timeout_rate,
+        malformed_rate=args.malformed_rate,
+        timeout_seconds=args.timeout_seconds
+    )
+    seed_sessions(app, corpus)
+    results = run_replay(app, corpus, concurrency=args.concurrency, rate=args.rate,
+                         total_requests=args.requests, seed=args.seed)
+
+    report = build_report(results, timings)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
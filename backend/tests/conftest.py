@@ -0,0 +1,12 @@
+"""
+Shared test setup.
+
+Config reads the environment when app.main is first imported, so the test
+environment is set here, before any test module imports the app.
+"""
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_gemini_key')
+os.environ.setdefault('API_KEY', 'test_api_key')
+os.environ.setdefault('FLASK_ENV', 'testing')
+os.environ.setdefault('HEALTH_MONITOR_ENABLED', 'false')
@@ -17,6 +17,7 @@ sys.modules['google.cloud'] = MagicMock()
 sys.modules['google.cloud.speech'] = MagicMock()
 
 from app.main import create_app
+from app.utils.session_store import JSONFileSessionStore
 
 
 @pytest.fixture
@@ -29,6 +30,7 @@ def app():
     app.config['TESTING'] = True
     app.config['API_KEY'] = 'test-api-key'
     app.config['CONTEXT_DIR'] = temp_dir
+    app.session_store = JSONFileSessionStore(temp_dir)
     
     yield app
     
@@ -177,7 +179,7 @@ class TestAskEndpoint:
         assert response_data['status'] == 'error'
         assert response_data['error_code'] == 'NOT_FOUND'
     
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
     def test_successful_follow_up_question(self, mock_llm_class, client, app, sample_session_context):
         """Test successful follow-up question returns proper JSON structure"""
         session_id, context_data = sample_session_context
@@ -219,23 +221,50 @@ class TestAskEndpoint:
         # Verify LLM was called
         mock_llm.invoke.assert_called_once()
         
-        # Verify follow-up Q&A was saved to context file
+        # Verify follow-up Q&A was appended to the session's follow-up log
+        follow_ups = app.session_store.recent_follow_ups(session_id, 10)
+        
+        assert len(follow_ups) == 1
+        assert follow_ups[0]['question'] == 'What if the cable does not fit?'
+        assert 'answer_steps' in follow_ups[0]
+        assert isinstance(follow_ups[0]['answer_steps'], list)
+        assert len(follow_ups[0]['answer_steps']) > 0
+        assert 'timestamp' in follow_ups[0]
+        
+        # The context file itself is not rewritten
         from pathlib import Path
-        context_file = Path(app.config['CONTEXT_DIR']) / f"{session_id}.json"
-        assert context_file.exists()
-        
-        with open(context_file, 'r') as f:
-            updated_context = json.load(f)
-        
-        assert 'follow_up_qa' in updated_context
-        assert len(updated_context['follow_up_qa']) == 1
-        assert updated_context['follow_up_qa'][0]['question'] == 'What if the cable does not fit?'
-        assert 'answer_steps' in updated_context['follow_up_qa'][0]
-        assert isinstance(updated_context['follow_up_qa'][0]['answer_steps'], list)
-        assert len(updated_context['follow_up_qa'][0]['answer_steps']) > 0
-        assert 'timestamp' in updated_context['follow_up_qa'][0]
+        with open(Path(app.config['CONTEXT_DIR']) / f"{session_id}.json", 'r') as f:
+            assert 'follow_up_qa' not in json.load(f)
+    
+    @patch('app.routes.ask.get_chat_model')
+    def test_prompt_includes_recent_follow_ups(self, mock_llm_class, client, app, sample_session_context):
+        """Test that only the newest follow-ups from the log are included in the prompt"""
+        session_id, context_data = sample_session_context
+        app.config['ASK_FOLLOW_UP_HISTORY'] = 2
+        for i in range(3):
+            app.session_store.append_follow_up(session_id, {
+                'timestamp': '2025-11-15T10:31:00Z',
+                'question': f'Earlier question {i}',
+                'answer_steps': [f'Earlier answer {i}']
+            })
+        
+        headers = {'Authorization': 'Bearer test-api-key'}
+        mock_llm = Mock(invoke=Mock(return_value=Mock(content='1. Check the latch')))
+        mock_llm_class.return_value = mock_llm
+        
+        response = client.post('/ask',
+                             data=json.dumps({'session_id': session_id, 'question': 'Now what?'}),
+                             headers=headers,
+                             content_type='application/json')
+        
+        assert response.status_code == 200
+        prompt_content = mock_llm.invoke.call_args[0][0][-1].content
+        assert 'Earlier question 0' not in prompt_content
+        assert 'Earlier question 1' in prompt_content
+        assert 'Earlier answer 2' in prompt_content
+        assert len(app.session_store.recent_follow_ups(session_id, 10)) == 4
     
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
     def test_response_includes_previous_context(self, mock_llm_class, client, app, sample_session_context):
         """Test that response includes context from previous session"""
         session_id, context_data = sample_session_context
@@ -267,14 +296,34 @@ class TestAskEndpoint:
         
         # Verify the prompt included previous instruction
         call_args = mock_llm.invoke.call_args
-        prompt_message = call_args[0][0][0]
+        prompt_message = call_args[0][0][-1]
         prompt_content = prompt_message.content
         
         # Check that previous context was included in prompt
         assert 'PSU_Install' in prompt_content
         assert 'Locate the 8-pin PDU cable' in prompt_content
     
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
+    def test_static_instructions_sent_as_system_message(self, mock_llm_class, client, app, sample_session_context):
+        """Test that the coaching instructions are a fixed system message ahead of the per-request prompt"""
+        from langchain_core.messages import SystemMessage
+        session_id, _ = sample_session_context
+        
+        mock_llm = Mock(invoke=Mock(return_value=Mock(content='1. Check the latch')))
+        mock_llm_class.return_value = mock_llm
+        
+        headers = {'Authorization': 'Bearer test-api-key'}
+        for question in ('Where is the latch?', 'Is it tight enough?'):
+            client.post('/ask', data=json.dumps({'session_id': session_id, 'question': question}),
+                        headers=headers, content_type='application/json')
+        
+        first, second = [call[0][0] for call in mock_llm.invoke.call_args_list]
+        assert isinstance(first[0], SystemMessage)
+        assert first[0].content == second[0].content
+        assert 'Where is the latch?' not in first[0].content
+        assert 'Where is the latch?' in first[-1].content
+    
+    @patch('app.routes.ask.get_chat_model')
     def test_llm_error_handling(self, mock_llm_class, client, app, sample_session_context):
         """Test that LLM errors are handled properly"""
         session_id, _ = sample_session_context
@@ -301,7 +350,7 @@ class TestAskEndpoint:
         assert response_data['error_code'] == 'LLM_ERROR'
         assert 'Gemini API error' in response_data['error']
     
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
     def test_gemini_api_key_not_configured(self, mock_llm_class, client, app, sample_session_context):
         """Test error when GEMINI_API_KEY is not configured"""
         session_id, _ = sample_session_context
@@ -331,7 +380,7 @@ class TestAskEndpoint:
     # Voice input tests
     
     @patch('app.routes.ask.transcribe_audio')
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
     def test_ask_with_audio_file_returns_transcribed_answer(self, mock_llm_class, mock_transcribe, client, app, sample_session_context):
         """Test /ask with audio file returns transcribed answer"""
         session_id, context_data = sample_session_context
@@ -448,7 +497,7 @@ class TestAskEndpoint:
         assert response_data['status'] == 'error'
         assert response_data['error_code'] == 'IMAGE_TOO_LARGE'
     
-    @patch('app.routes.ask.ChatGoogleGenerativeAI')
+    @patch('app.routes.ask.get_chat_model')
     def test_backward_compatibility_with_text_only_requests(self, mock_llm_class, client, app, sample_session_context):
         """Test backward compatibility with text-only requests (no audio)"""
         session_id, context_data = sample_session_context
@@ -528,3 +577,71 @@ class TestAskEndpoint:
         response_data = json.loads(response.data)
         assert 'transcription failed' in response_data['message'].lower()
         assert 'No speech detected' in response_data['message']
+    
+    @patch('app.routes.ask.get_chat_model')
+    def test_deadline_exceeded_returns_504(self, mock_llm_class, client, app, sample_session_context):
+        """Test that a Gemini call outliving X-Request-Deadline ends at its RPC timeout with a 504"""
+        import time
+        session_id, _ = sample_session_context
+        
+        timeouts = []
+        
+        class DeadlineError(Exception):
+            code = 504
+        
+        def slow_invoke(messages, **kwargs):
+            # The RPC runs until its timeout, the request's remaining deadline
+            timeouts.append(kwargs['timeout'])
+            time.sleep(kwargs['timeout'])
+            raise DeadlineError('504 DEADLINE_EXCEEDED')
+        
+        mock_llm_class.return_value = Mock(invoke=slow_invoke)
+        app.config['DEADLINE_MIN_GENERATION_SECONDS'] = 0
+        
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': '100'}
+        response = client.post('/ask',
+                             data=json.dumps({'session_id': session_id, 'question': 'What next?'}),
+                             headers=headers,
+                             content_type='application/json')
+        
+        assert response.status_code == 504
+        response_data = json.loads(response.data)
+        assert response_data['error_code'] == 'DEADLINE_EXCEEDED'
+        assert response_data['stage'] == 'generation'
+        assert response_data['retryable'] is True
+        assert len(timeouts) == 1 and timeouts[0] <= 0.1
+    
+    @patch('app.routes.ask.get_chat_model')
+    def test_remaining_deadline_sent_as_rpc_timeout(self, mock_llm_class, client, app, sample_session_context):
+        """Test that the follow-up RPC is bounded by the time left before X-Request-Deadline"""
+        session_id, _ = sample_session_context
+        
+        calls = []
+        
+        def invoke(messages, **kwargs):
+            calls.append(kwargs)
+            return Mock(content='{"answer_steps": ["Check the cable"]}')
+        
+        mock_llm_class.return_value = Mock(invoke=invoke)
+        
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': '5000'}
+        response = client.post('/ask',
+                             data=json.dumps({'session_id': session_id, 'question': 'What next?'}),
+                             headers=headers,
+                             content_type='application/json')
+        
+        assert response.status_code == 200
+        assert 0 < calls[0]['timeout'] <= 5
+        assert calls[0]['retry'] is None
+    
+    def test_invalid_deadline_header_returns_400(self, client, sample_session_context):
+        """Test that a malformed X-Request-Deadline is rejected"""
+        session_id, _ = sample_session_context
+        
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': 'soon'}
+        response = client.post('/ask',
+                             data=json.dumps({'session_id': session_id, 'question': 'What next?'}),
+                             headers=headers,
+                             content_type='application/json')
+        
+        assert response.status_code == 400
@@ -11,6 +11,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.main import create_app
+from app.utils.image_store import ImageHandle, image_store
 
 
 @pytest.fixture
@@ -148,24 +149,20 @@ class TestAssistEndpoint:
         
         assert response.status_code == 400
     
-    @patch('app.routes.assist.compress_image')
-    def test_successful_request_with_mocked_workflow(self, mock_compress, client, app, valid_form_data):
+    def test_successful_request_with_mocked_workflow(self, client, app, valid_form_data):
         """Test successful request with mocked workflow"""
         headers = {'Authorization': 'Bearer test-api-key'}
         
         # Mock the workflow
         mock_workflow = Mock()
-        mock_workflow.run.return_value = {
+        mock_workflow.run = Mock(return_value={
             'instruction_text': 'Locate the 8-pin PDU cable',
             'target_id': 'J_PWR_1',
             'haptic_cue': 'guide_to_target',
             'session_id': 'test-session-123'
-        }
+        })
         app.workflow = mock_workflow
         
-        # Mock compress_image to return original
-        mock_compress.return_value = b'compressed_image_data'
-        
         response = client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
         
         assert response.status_code == 200
@@ -182,20 +179,18 @@ class TestAssistEndpoint:
         # Verify workflow was called
         mock_workflow.run.assert_called_once()
     
-    @patch('app.routes.assist.compress_image')
-    def test_session_id_generation(self, mock_compress, client, app, sample_image):
+    def test_session_id_generation(self, client, app, sample_image):
         """Test that session_id is generated if not provided"""
         headers = {'Authorization': 'Bearer test-api-key'}
         
         # Mock the workflow
         mock_workflow = Mock()
-        mock_workflow.run.return_value = {
+        mock_workflow.run = Mock(return_value={
             'instruction_text': 'Test instruction',
             'target_id': 'TEST_1',
             'haptic_cue': 'none'
-        }
+        })
         app.workflow = mock_workflow
-        mock_compress.return_value = b'compressed_image_data'
         
         data = {
             'snapshot': (sample_image, 'test.jpg', 'image/jpeg'),
@@ -220,9 +215,9 @@ class TestAssistEndpoint:
         
         # Mock the workflow to return an error
         mock_workflow = Mock()
-        mock_workflow.run.return_value = {
+        mock_workflow.run = Mock(return_value={
             'error': 'Gemini API failed'
-        }
+        })
         app.workflow = mock_workflow
         
         response = client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
@@ -232,6 +227,71 @@ class TestAssistEndpoint:
         assert data['status'] == 'error'
         assert 'Gemini API failed' in data['error']
     
+    def test_open_circuit_returns_503(self, client, app, valid_form_data):
+        """Test that a request skipped by an open Gemini circuit fails fast with 503"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(return_value={
+            'error': 'Analysis and instruction failed: circuit open',
+            'retry_after': 12.3
+        })
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '13'
+        data = json.loads(response.data)
+        assert data['error_code'] == 'SERVICE_UNAVAILABLE'
+    
+    def test_deadline_exceeded_in_workflow_returns_504(self, client, app, valid_form_data):
+        """Test that a generation cut off by the deadline returns a degraded 504 response"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(return_value={
+            'error': 'Analysis and instruction failed: Request deadline exceeded during generation',
+            'deadline_exceeded': 'generation'
+        })
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 504
+        data = json.loads(response.data)
+        assert data['error_code'] == 'DEADLINE_EXCEEDED'
+        assert data['retryable'] is True
+        assert data['session_id'] == 'test-session-123'
+    
+    def test_exhausted_deadline_skips_workflow(self, client, app, valid_form_data):
+        """Test that no Gemini call is started without enough remaining budget"""
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': '1'}
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock()
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 504
+        mock_workflow.run.assert_not_called()
+    
+    def test_deadline_passed_to_workflow(self, client, app, valid_form_data):
+        """Test that X-Request-Deadline bounds the workflow call"""
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': '4000'}
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(return_value={
+            'instruction_text': ['Go'], 'target_id': '', 'haptic_cue': 'none'
+        })
+        app.workflow = mock_workflow
+        
+        client.post('/assist', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        deadline = mock_workflow.run.call_args.kwargs['deadline']
+        assert deadline.timeout_seconds == 4.0
+    
     def test_workflow_not_initialized(self, client, app, valid_form_data):
         """Test error when workflow is not initialized"""
         headers = {'Authorization': 'Bearer test-api-key'}
@@ -244,3 +304,341 @@ class TestAssistEndpoint:
         assert response.status_code == 500
         data = json.loads(response.data)
         assert 'workflow' in data['error'].lower()
+
+
+class TestAssistRawUpload:
+    """Test suite for /assist with the snapshot as the raw request body"""
+    
+    @pytest.fixture
+    def workflow(self, app):
+        """Workflow mock returning a fixed instruction"""
+        app.workflow = Mock(run=Mock(return_value={
+            'image_analysis': 'PSU bay',
+            'instruction_text': ['Slide the PSU in'],
+            'target_id': 'psu_bay',
+            'haptic_cue': 'guide_to_target'
+        }))
+        return app.workflow
+    
+    def test_fields_in_headers(self, client, workflow, sample_image):
+        """Test that a raw JPEG body with the fields in headers is processed like a form upload"""
+        headers = {
+            'Authorization': 'Bearer test-api-key',
+            'X-Task-Step': '4',
+            'X-Current-Task': 'PSU_Install',
+            'X-Gaze-Vector': json.dumps({"x": 0.5, "y": -0.2, "z": 0.8}),
+            'X-Session-Id': 'raw-session'
+        }
+        
+        response = client.post('/assist', data=sample_image.getvalue(), headers=headers, content_type='image/jpeg')
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['session_id'] == 'raw-session'
+        kwargs = workflow.run.call_args.kwargs
+        assert kwargs['task_step'] == '4'
+        assert kwargs['current_task'] == 'PSU_Install'
+        assert kwargs['gaze_vector'] == {"x": 0.5, "y": -0.2, "z": 0.8}
+        assert isinstance(kwargs['image'], ImageHandle)
+    
+    def test_fields_in_query_string(self, client, workflow, sample_image):
+        """Test that an octet-stream body works with a compact query string and x,y,z gaze"""
+        response = client.post('/assist?step=2&task=RAM_Install&gaze=0,0.1,1', data=sample_image.getvalue(),
+                               headers={'Authorization': 'Bearer test-api-key'},
+                               content_type='application/octet-stream')
+        
+        assert response.status_code == 200
+        kwargs = workflow.run.call_args.kwargs
+        assert kwargs['current_task'] == 'RAM_Install'
+        assert kwargs['gaze_vector'] == {"x": 0.0, "y": 0.1, "z": 1.0}
+        assert kwargs['session_id']
+    
+    def test_missing_fields(self, client, workflow, sample_image):
+        """Test that a raw body without task fields returns 400"""
+        response = client.post('/assist?gaze=0,0,1', data=sample_image.getvalue(),
+                               headers={'Authorization': 'Bearer test-api-key'}, content_type='image/jpeg')
+        
+        assert response.status_code == 400
+        workflow.run.assert_not_called()
+    
+    def test_body_over_limit(self, client, app, workflow):
+        """Test that a body over MAX_IMAGE_SIZE returns 413"""
+        app.config['MAX_IMAGE_SIZE'] = 1024
+        
+        response = client.post('/assist?step=1&task=PSU_Install&gaze=0,0,1', data=b'\xff' * 4096,
+                               headers={'Authorization': 'Bearer test-api-key'}, content_type='image/jpeg')
+        
+        assert response.status_code == 413
+        workflow.run.assert_not_called()
+    
+    def test_invalid_body(self, client, workflow):
+        """Test that a raw body that is not an image returns 400"""
+        response = client.post('/assist?step=1&task=PSU_Install&gaze=0,0,1', data=b'not an image',
+                               headers={'Authorization': 'Bearer test-api-key'},
+                               content_type='application/octet-stream')
+        
+        assert response.status_code == 400
+
+
+class TestAssistStreamEndpoint:
+    """Test suite for /assist/stream endpoint"""
+    
+    def test_missing_authorization_header(self, client, valid_form_data):
+        """Test that auth errors are returned before streaming starts"""
+        response = client.post('/assist/stream', data=valid_form_data, content_type='multipart/form-data')
+        
+        assert response.status_code == 401
+        data = json.loads(response.data)
+        assert data['error_code'] == 'AUTH_FAILED'
+    
+    def test_streams_steps_then_done(self, client, app, valid_form_data):
+        """Test that each workflow event becomes one NDJSON line"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        
+        mock_workflow = Mock()
+        mock_workflow.stream.return_value = iter([
+            {'event': 'step', 'index': 0, 'text': 'Locate the 8-pin PDU cable'},
+            {'event': 'target_id', 'target_id': 'J_PWR_1'},
+            {'event': 'complete', 'result': {
+                'instruction_text': ['Locate the 8-pin PDU cable'],
+                'target_id': 'J_PWR_1',
+                'haptic_cue': 'guide_to_target'
+            }}
+        ])
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist/stream', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        
+        assert events[0] == {'event': 'step', 'index': 0, 'text': 'Locate the 8-pin PDU cable'}
+        assert events[1]['event'] == 'target_id'
+        assert events[2]['event'] == 'done'
+        assert events[2]['instruction_steps'] == ['Locate the 8-pin PDU cable']
+        assert events[2]['session_id'] == 'test-session-123'
+    
+    def test_workflow_error_emits_error_event(self, client, app, valid_form_data):
+        """Test that a failed generation ends the stream with an error event"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        
+        mock_workflow = Mock()
+        mock_workflow.stream.return_value = iter([
+            {'event': 'complete', 'result': {'error': 'Gemini API failed'}}
+        ])
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist/stream', data=valid_form_data, headers=headers, content_type='multipart/form-data')
+        
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert events[-1]['event'] == 'error'
+        assert 'Gemini API failed' in events[-1]['error']
+
+
+class TestAssistResponseCache:
+    """Test suite for the /assist response cache"""
+    
+    def test_repeated_snapshot_served_from_cache(self, client, app):
+        """Test that a repeated snapshot in the same session skips the workflow, but other sessions do not share it"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(return_value={
+            'image_analysis': 'Red panel',
+            'instruction_text': ['Locate the 8-pin PDU cable'],
+            'target_id': 'J_PWR_1',
+            'haptic_cue': 'guide_to_target'
+        })
+        mock_workflow.save_context.side_effect = lambda state: state
+        app.workflow = mock_workflow
+        
+        def form(session_id):
+            img_bytes = io.BytesIO()
+            Image.new('RGB', (100, 100), color='red').save(img_bytes, format='JPEG')
+            img_bytes.seek(0)
+            return {
+                'snapshot': (img_bytes, 'test.jpg', 'image/jpeg'),
+                'task_step': '4',
+                'current_task': 'PSU_Install',
+                'gaze_vector': json.dumps({"x": 0.5, "y": -0.2, "z": 0.8}),
+                'session_id': session_id
+            }
+        
+        first = client.post('/assist', data=form('session-a'), headers=headers, content_type='multipart/form-data')
+        second = client.post('/assist', data=form('session-a'), headers=headers, content_type='multipart/form-data')
+        
+        assert first.status_code == 200
+        assert second.status_code == 200
+        data = json.loads(second.data)
+        assert data['session_id'] == 'session-a'
+        assert data['instruction_steps'] == ['Locate the 8-pin PDU cable']
+        
+        mock_workflow.run.assert_called_once()
+        saved_state = mock_workflow.save_context.call_args[0][0]
+        assert saved_state['session_id'] == 'session-a'
+        assert app.response_cache.stats()['hits'] == 1
+        
+        # Answers depend on the session's history, so another session misses
+        third = client.post('/assist', data=form('session-b'), headers=headers, content_type='multipart/form-data')
+        
+        assert third.status_code == 200
+        assert mock_workflow.run.call_count == 2
+        assert app.response_cache.stats()['hits'] == 1
+    
+    def test_repaired_result_not_cached(self, app):
+        """Test that results repaired from truncated output are not cached, so a retry can get the full answer"""
+        from app.routes.assist import cache_result
+        
+        gaze = {"x": 0.5, "y": -0.2, "z": 0.8}
+        fields = {'current_task': 'PSU_Install', 'task_step': '4', 'gaze_vector': gaze, 'image_hash': 1,
+                  'session_id': 'session-a'}
+        
+        cache_result(app, fields, {'instruction_text': ['Lift the latch'], 'parse_status': 'repaired'})
+        assert app.response_cache.get('PSU_Install', '4', gaze, 1, session_id='session-a') is None
+        
+        cache_result(app, fields, {'instruction_text': ['Lift the latch'], 'parse_status': 'ok'})
+        assert app.response_cache.get('PSU_Install', '4', gaze, 1, session_id='session-a') is not None
+    
+    def test_cache_hit_keeps_session_memory(self, app, tmp_path):
+        """Test that a cache hit adds its step to the session's memory instead of replacing it"""
+        from app.routes.assist import get_cached_result
+        from app.utils.session_store import JSONFileSessionStore
+        from llm import VRContextWorkflow
+        
+        app.workflow = VRContextWorkflow(api_key='test-api-key', session_store=JSONFileSessionStore(str(tmp_path)))
+        gaze = {"x": 0.5, "y": -0.2, "z": 0.8}
+        for step in ('1', '2', '3'):
+            state = {'session_id': 'session-a', 'task_step': step, 'current_task': 'PSU_Install',
+                     'image_analysis': 'Bay', 'instruction_text': [f'Do step {step}'], 'target_id': ''}
+            app.workflow._load_memory(state)
+            app.workflow.save_context(state)
+        app.response_cache.put('PSU_Install', '4', gaze, 1, {'instruction_text': ['Do step 4']}, session_id='session-a')
+        
+        result = get_cached_result(app, {'current_task': 'PSU_Install', 'task_step': '4', 'gaze_vector': gaze,
+                                         'image_hash': 1, 'session_id': 'session-a'})
+        
+        assert result['instruction_text'] == ['Do step 4']
+        saved = app.workflow.session_store.load('session-a')['memory']
+        assert [entry['step'] for entry in saved['recent']] == ['1', '2', '3', '4']
+
+
+class TestAssistFoveation:
+    """Test suite for gaze-guided foveation on /assist"""
+    
+    def test_focus_crop_sent_with_context_frame(self, client, app):
+        """Test that a large snapshot is split into a context frame plus a crop at the gaze point"""
+        from app.utils.foveation import FoveationPolicy
+        
+        headers = {'Authorization': 'Bearer test-api-key'}
+        app.foveation = FoveationPolicy(fov_degrees=(90, 90), context_size=(256, 256))
+        app.response_cache = None
+        
+        sent = {}
+        
+        def run(**kwargs):
+            # Handles are released when the request ends, so read the images during the call
+            sent['context'] = image_store.get(kwargs['image'])
+            sent['focus'] = image_store.get(kwargs['focus_image'])
+            return {
+                'image_analysis': 'Motherboard',
+                'instruction_text': ['Seat the RAM'],
+                'target_id': 'ram_slot_2',
+                'haptic_cue': 'guide_to_target'
+            }
+        
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(side_effect=run)
+        app.workflow = mock_workflow
+        
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (1600, 1200), color='green').save(img_bytes, format='JPEG')
+        img_bytes.seek(0)
+        data = {
+            'snapshot': (img_bytes, 'test.jpg', 'image/jpeg'),
+            'task_step': '2',
+            'current_task': 'RAM_Install',
+            'gaze_vector': json.dumps({"x": 0.0, "y": 0.0, "z": 1.0})
+        }
+        
+        response = client.post('/assist', data=data, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 200
+        context = Image.open(io.BytesIO(sent['context']))
+        focus = Image.open(io.BytesIO(sent['focus']))
+        assert max(context.size) <= 256
+        assert focus.size == (384, 384)
+
+
+def jpeg(color):
+    """Return a small JPEG as a file-like object"""
+    img_bytes = io.BytesIO()
+    Image.new('RGB', (100, 100), color=color).save(img_bytes, format='JPEG')
+    img_bytes.seek(0)
+    return img_bytes
+
+
+class TestAssistBatchEndpoint:
+    """Test suite for /assist/batch endpoint"""
+    
+    def batch_form(self, count, gaze_count=None):
+        """Form data with count snapshots and gaze_count gaze vectors (default: one each)"""
+        return {
+            'snapshot': [(jpeg(color), f'view{i}.jpg', 'image/jpeg')
+                         for i, color in enumerate(['red', 'green', 'blue', 'white', 'black'][:count])],
+            'gaze_vector': [json.dumps({"x": i / 10, "y": 0.0, "z": 1.0})
+                            for i in range(count if gaze_count is None else gaze_count)],
+            'task_step': '4',
+            'current_task': 'PSU_Install',
+            'session_id': 'batch-session'
+        }
+    
+    def test_all_views_sent_in_one_call(self, client, app):
+        """Test that every snapshot reaches the workflow in a single call with its own gaze vector"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        mock_workflow = Mock()
+        mock_workflow.run = Mock(return_value={
+            'image_analysis': 'PSU bay from three angles',
+            'instruction_text': ['Slide the PSU in', 'Fasten the screws'],
+            'target_id': 'psu_bay',
+            'haptic_cue': 'guide_to_target'
+        })
+        app.workflow = mock_workflow
+        
+        response = client.post('/assist/batch', data=self.batch_form(3), headers=headers,
+                               content_type='multipart/form-data')
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['frame_count'] == 3
+        assert data['instruction_steps'] == ['Slide the PSU in', 'Fasten the screws']
+        
+        mock_workflow.run.assert_called_once()
+        kwargs = mock_workflow.run.call_args.kwargs
+        assert kwargs['gaze_vector'] == {"x": 0.0, "y": 0.0, "z": 1.0}
+        assert [frame['gaze_vector']['x'] for frame in kwargs['extra_frames']] == [0.1, 0.2]
+        assert all(isinstance(frame['image'], ImageHandle) for frame in kwargs['extra_frames'])
+        assert image_store.stats()['images'] == 0
+    
+    def test_gaze_vector_count_must_match(self, client, app):
+        """Test that each snapshot needs its own gaze vector"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        app.workflow = Mock()
+        
+        response = client.post('/assist/batch', data=self.batch_form(2, gaze_count=1), headers=headers,
+                               content_type='multipart/form-data')
+        
+        assert response.status_code == 400
+        assert 'one gaze_vector per snapshot' in json.loads(response.data)['message']
+        app.workflow.run.assert_not_called()
+    
+    def test_too_many_snapshots(self, client, app):
+        """Test that batches are capped at BATCH_MAX_FRAMES"""
+        headers = {'Authorization': 'Bearer test-api-key'}
+        app.config['BATCH_MAX_FRAMES'] = 4
+        app.workflow = Mock()
+        
+        response = client.post('/assist/batch', data=self.batch_form(5), headers=headers,
+                               content_type='multipart/form-data')
+        
+        assert response.status_code == 400
+        app.workflow.run.assert_not_called()
@@ -0,0 +1,94 @@
+"""
+Tests for request capture into a replay corpus.
+"""
+import io
+import json
+import pytest
+from unittest.mock import Mock
+from PIL import Image
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import create_app
+from app.utils.capture import CaptureRecorder, install_capture, load_corpus
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App with capture writing to a temporary corpus"""
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['API_KEY'] = 'test-api-key'
+    app.capture = CaptureRecorder(str(tmp_path / 'corpus'), max_entries=2)
+    install_capture(app, app.capture)
+    app.workflow = Mock(run=Mock(return_value={
+        'instruction_text': ['Seat the RAM'], 'target_id': 'ram_slot_2', 'haptic_cue': 'none'
+    }))
+    return app
+
+
+def assist_form():
+    img_bytes = io.BytesIO()
+    Image.new('RGB', (64, 64), color='red').save(img_bytes, format='JPEG')
+    return {
+        'snapshot': (io.BytesIO(img_bytes.getvalue()), 'frame.jpg', 'image/jpeg'),
+        'task_step': '2',
+        'current_task': 'RAM_Install',
+        'gaze_vector': json.dumps({"x": 0.0, "y": 0.0, "z": 1.0}),
+        'session_id': 'capture-session'
+    }, img_bytes.getvalue()
+
+
+class TestCapture:
+    """Tests for CaptureRecorder and install_capture"""
+    
+    def test_request_recorded_without_credentials(self, app):
+        """Test that the snapshot, form fields and deadline header are captured, but not the API key"""
+        form, image_bytes = assist_form()
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Request-Deadline': '4000'}
+        
+        response = app.test_client().post('/assist', data=form, headers=headers, content_type='multipart/form-data')
+        
+        assert response.status_code == 200
+        [entry] = load_corpus(app.capture.directory)
+        assert entry['endpoint'] == '/assist'
+        assert entry['status_code'] == 200
+        assert entry['form']['current_task'] == ['RAM_Install']
+        assert entry['files']['snapshot'][0]['data'] == image_bytes
+        assert entry['headers']['X-Request-Deadline'] == '4000'
+        assert 'Authorization' not in entry['headers']
+        assert 'test-api-key' not in json.dumps({k: v for k, v in entry.items() if k != 'files'})
+    
+    def test_raw_body_request_recorded(self, app):
+        """Test that a raw snapshot upload keeps its body, task headers and query string"""
+        _, image_bytes = assist_form()
+        headers = {'Authorization': 'Bearer test-api-key', 'X-Task-Step': '2', 'X-Current-Task': 'RAM_Install',
+                   'X-Session-Id': 'capture-session'}
+        
+        response = app.test_client().post('/assist?gaze=0,0,1', data=image_bytes, headers=headers,
+                                          content_type='image/jpeg')
+        
+        assert response.status_code == 200
+        [entry] = load_corpus(app.capture.directory)
+        assert entry['body'] == image_bytes
+        assert entry['query'] == {'gaze': ['0,0,1']}
+        assert entry['headers']['X-Current-Task'] == 'RAM_Install'
+        assert entry['headers']['Content-Type'] == 'image/jpeg'
+        assert entry['files'] == {}
+    
+    def test_recording_stops_at_max_entries(self, app):
+        """Test that the corpus is capped"""
+        client = app.test_client()
+        for _ in range(3):
+            client.post('/ask', json={'session_id': 'missing', 'question': 'Where?'},
+                        headers={'Authorization': 'Bearer test-api-key'})
+        
+        assert len(load_corpus(app.capture.directory)) == 2
+        assert app.capture.full()
+    
+    def test_other_endpoints_not_recorded(self, app):
+        """Test that probes are never captured"""
+        app.test_client().get('/livez')
+        
+        assert load_corpus(app.capture.directory) == []
@@ -0,0 +1,72 @@
+"""
+Tests for the shared Gemini and Speech client registry.
+"""
+import pytest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.clients import call_options, get_chat_model, get_speech_client, reset_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    """Start and end every test with an empty registry."""
+    reset_clients()
+    yield
+    reset_clients()
+
+
+class TestGetChatModel:
+    """Tests for get_chat_model."""
+
+    @patch('app.utils.clients.ChatGoogleGenerativeAI')
+    def test_same_configuration_reuses_client(self, mock_chat):
+        """Test that one client is built per configuration."""
+        mock_chat.side_effect = lambda **kwargs: MagicMock()
+
+        first = get_chat_model('key', temperature=0.5)
+        second = get_chat_model('key', temperature=0.5)
+        other = get_chat_model('key', temperature=0.2, response_mime_type='application/json')
+
+        assert first is second
+        assert other is not first
+        assert mock_chat.call_count == 2
+
+    @patch('app.utils.clients.ChatGoogleGenerativeAI')
+    def test_options_passed_to_client(self, mock_chat):
+        """Test that JSON mode and max_tokens are forwarded."""
+        get_chat_model('key', model='gemini-2.5-flash', temperature=0.2,
+                       response_mime_type='application/json', max_tokens=4096)
+
+        mock_chat.assert_called_once_with(
+            model='gemini-2.5-flash', google_api_key='key', temperature=0.2, max_retries=1,
+            response_mime_type='application/json', max_tokens=4096
+        )
+
+    def test_call_options_turn_off_grpc_retry(self):
+        """Test that every call disables the gRPC retry and carries the deadline as its timeout."""
+        assert call_options() == {'retry': None}
+        assert call_options(2.5) == {'retry': None, 'timeout': 2.5}
+        assert call_options(0)['timeout'] > 0
+
+    @patch('app.utils.clients.ChatGoogleGenerativeAI')
+    def test_reset_clients_forgets_instances(self, mock_chat):
+        """Test that reset_clients (run after fork) forces new clients."""
+        mock_chat.side_effect = lambda **kwargs: MagicMock()
+
+        before = get_chat_model('key')
+        reset_clients()
+
+        assert get_chat_model('key') is not before
+
+
+class TestGetSpeechClient:
+    """Tests for get_speech_client."""
+
+    @patch('app.utils.clients.speech.SpeechClient')
+    def test_speech_client_is_shared(self, mock_speech_client):
+        """Test that the Speech client is created once."""
+        assert get_speech_client() is get_speech_client()
+        mock_speech_client.assert_called_once()
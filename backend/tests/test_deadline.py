@@ -0,0 +1,73 @@
+"""
+Tests for request deadlines.
+"""
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.deadline import Deadline, DeadlineExceeded, parse_deadline_header, deadline_exceeded_body
+
+
+class TestParseDeadlineHeader:
+    """Tests for parse_deadline_header."""
+
+    def test_default_when_header_missing(self):
+        """Test that the endpoint default applies without a header."""
+        is_valid, deadline, error = parse_deadline_header(None, 10, 30)
+
+        assert is_valid
+        assert deadline.timeout_seconds == 10
+        assert error == ""
+
+    def test_header_is_milliseconds(self):
+        """Test that the header value is a relative budget in milliseconds."""
+        is_valid, deadline, _ = parse_deadline_header('4000', 10, 30)
+
+        assert is_valid
+        assert deadline.timeout_seconds == 4.0
+        assert 3.9 < deadline.remaining() <= 4.0
+
+    def test_budget_is_capped(self):
+        """Test that clients cannot ask for more than the maximum."""
+        _, deadline, _ = parse_deadline_header('600000', 10, 30)
+
+        assert deadline.timeout_seconds == 30
+
+    @pytest.mark.parametrize('value', ['soon', '-5', '0', 'nan', 'inf'])
+    def test_invalid_values(self, value):
+        """Test that non-numeric, non-positive and non-finite budgets are rejected."""
+        is_valid, deadline, error = parse_deadline_header(value, 10, 30)
+
+        assert not is_valid
+        assert deadline is None
+        assert 'X-Request-Deadline' in error
+
+
+class TestDeadline:
+    """Tests for Deadline."""
+
+    def test_check_with_min_remaining(self):
+        """Test that check fails when less than min_remaining is left."""
+        deadline = Deadline(1.0)
+
+        deadline.check('stage')
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            deadline.check('generation', min_remaining=5)
+
+        assert exc_info.value.stage == 'generation'
+
+    def test_expired(self):
+        """Test that a zero budget is expired immediately."""
+        deadline = Deadline(0)
+
+        assert deadline.expired()
+        assert deadline.remaining() == 0
+
+    def test_degraded_body(self):
+        """Test the structured "try again" response."""
+        body = deadline_exceeded_body('generation', 'session-1')
+
+        assert body['error_code'] == 'DEADLINE_EXCEEDED'
+        assert body['retryable'] is True
+        assert body['session_id'] == 'session-1'
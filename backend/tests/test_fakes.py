@@ -0,0 +1,140 @@
+"""
+Tests for the fake Gemini and Speech-to-Text backends.
+"""
+import json
+import random
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.fakes import FakeChatModel, FakeSpeechClient, FaultInjector, parse_latency, CANNED_TRANSCRIPT
+from app.utils.clients import get_chat_model, get_speech_client, use_fake_backends, use_google_backends
+from app.utils.json_stream import parse_model_json
+from app.utils.resilience import is_retryable
+from app.utils.speech_to_text import transcribe_audio, NO_SPEECH_ERROR
+
+JSON_CONFIG = {"response_mime_type": "application/json"}
+
+
+@pytest.fixture
+def fake_backends():
+    """Select the fakes for one test"""
+    observed = []
+    use_fake_backends(FaultInjector('0'), FaultInjector('0'), observer=lambda stage, seconds: observed.append(stage))
+    yield observed
+    use_google_backends()
+
+
+class TestParseLatency:
+    """Tests for parse_latency."""
+
+    @pytest.mark.parametrize('spec, low, high', [
+        ('0.25', 0.25, 0.25),
+        ('fixed:0.5', 0.5, 0.5),
+        ('uniform:0.1,0.2', 0.1, 0.2),
+        ('lognormal:1.0,0.5', 0.0, 100.0)
+    ])
+    def test_specs(self, spec, low, high):
+        """Test that each distribution draws values in range."""
+        draw = parse_latency(spec)
+        rng = random.Random(1)
+
+        assert all(low <= draw(rng) <= high for _ in range(50))
+
+    @pytest.mark.parametrize('spec', ['slow', 'uniform:1', 'gamma:1,2', 'lognormal:0,1'])
+    def test_invalid_specs(self, spec):
+        """Test that malformed specs are rejected."""
+        with pytest.raises(ValueError):
+            parse_latency(spec)
+
+
+class TestFakeChatModel:
+    """Tests for FakeChatModel."""
+
+    def test_json_output_matches_schema(self):
+        """Test that the JSON-bound model returns a parseable instruction."""
+        model = FakeChatModel(FaultInjector('0')).bind(generation_config=JSON_CONFIG)
+
+        result, status = parse_model_json(model.invoke([]).content)
+
+        assert status == 'ok'
+        assert result['instruction']['haptic_cue'] == 'guide_to_target'
+
+    def test_malformed_output_is_truncated(self):
+        """Test that malformed JSON output is cut off mid-response."""
+        model = FakeChatModel(FaultInjector('0', malformed_rate=1)).bind(generation_config=JSON_CONFIG)
+
+        assert parse_model_json(model.invoke([]).content)[1] != 'ok'
+
+    def test_rate_limit_is_retryable(self):
+        """Test that an injected 429 is treated as transient."""
+        model = FakeChatModel(FaultInjector('0', rate_limit_rate=1))
+
+        with pytest.raises(Exception) as exc_info:
+            model.invoke([])
+
+        assert exc_info.value.code == 429
+        assert is_retryable(exc_info.value)
+
+    def test_timeout_hangs_then_fails(self):
+        """Test that an injected timeout hangs for timeout_seconds and raises a retryable 504."""
+        model = FakeChatModel(FaultInjector('0', timeout_rate=1, timeout_seconds=0.01))
+
+        with pytest.raises(Exception) as exc_info:
+            model.invoke([])
+
+        assert exc_info.value.code == 504
+        assert is_retryable(exc_info.value)
+
+    def test_stream_yields_whole_response(self):
+        """Test that streamed chunks join to the full response."""
+        model = FakeChatModel(FaultInjector('0')).bind(generation_config=JSON_CONFIG)
+
+        content = ''.join(chunk.content for chunk in model.stream([]))
+
+        assert parse_model_json(content)[1] == 'ok'
+
+    def test_fault_counts(self):
+        """Test that outcomes follow the configured rates."""
+        faults = FaultInjector('0', rate_limit_rate=0.5, seed=3)
+        for _ in range(200):
+            faults.draw()
+
+        stats = faults.stats()
+        assert stats['timeout'] == stats['malformed'] == 0
+        assert 60 < stats['rate_limit'] < 140
+
+
+class TestFakeBackendSelection:
+    """Tests for routing the client registry to the fakes."""
+
+    def test_registry_returns_fakes(self, fake_backends):
+        """Test that both clients come from the fakes once selected."""
+        assert isinstance(get_chat_model('key'), FakeChatModel)
+        assert isinstance(get_speech_client(), FakeSpeechClient)
+
+    def test_transcription_through_fake(self, fake_backends):
+        """Test that the real transcription path works against the fake client."""
+        assert transcribe_audio(b'RIFF', 'audio/wav') == (True, CANNED_TRANSCRIPT, '')
+        assert fake_backends == ['stt']
+
+    def test_no_speech_when_malformed(self):
+        """Test that a malformed recognition reports no speech."""
+        use_fake_backends(FaultInjector('0'), FaultInjector('0', malformed_rate=1))
+        try:
+            assert transcribe_audio(b'RIFF', 'audio/wav') == (False, '', NO_SPEECH_ERROR)
+        finally:
+            use_google_backends()
+
+    def test_workflow_runs_against_fake(self, fake_backends, tmp_path):
+        """Test that VRContextWorkflow parses the fake's answer into instruction steps."""
+        from llm import VRContextWorkflow
+        from app.utils.session_store import JSONFileSessionStore
+
+        workflow = VRContextWorkflow('key', session_store=JSONFileSessionStore(str(tmp_path)))
+        result = workflow.run('aW1hZ2U=', '1', 'PSU_Install', {"x": 0, "y": 0, "z": 1}, 'fake-session')
+
+        assert result['target_id'] == 'psu_bay'
+        assert len(result['instruction_text']) == 2
+        assert fake_backends == ['assist_model']
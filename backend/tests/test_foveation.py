@@ -0,0 +1,107 @@
+"""
+Tests for gaze-guided foveated cropping.
+"""
+import io
+import pytest
+from PIL import Image
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.foveation import project_gaze, FoveationPolicy, foveation_report
+from app.utils.image_processing import ResizePolicy
+
+
+def quadrant_image(size=(1600, 1200)):
+    """Create an image whose top-left quadrant is red and the rest blue."""
+    img = Image.new('RGB', size, color='blue')
+    img.paste(Image.new('RGB', (size[0] // 2, size[1] // 2), color='red'), (0, 0))
+    return img
+
+
+class TestProjectGaze:
+    """Tests for project_gaze."""
+
+    def test_forward_gaze_hits_center(self):
+        """Test that looking straight ahead maps to the image center."""
+        assert project_gaze({"x": 0, "y": 0, "z": 1}, (90, 90)) == pytest.approx((0.5, 0.5))
+
+    def test_up_and_left_maps_to_top_left(self):
+        """Test that +y is up and -x is left in image coordinates."""
+        u, v = project_gaze({"x": -0.5, "y": 0.5, "z": 1}, (90, 90))
+
+        assert u == pytest.approx(0.25)
+        assert v == pytest.approx(0.25)
+
+    def test_gaze_behind_camera_returns_none(self):
+        """Test that a backwards gaze is not projected."""
+        assert project_gaze({"x": 0, "y": 0, "z": -1}, (90, 90)) is None
+
+    def test_gaze_outside_fov_returns_none(self):
+        """Test that a gaze outside the camera frustum is not projected."""
+        assert project_gaze({"x": 2, "y": 0, "z": 1}, (90, 90)) is None
+
+
+class TestFoveationPolicy:
+    """Tests for FoveationPolicy."""
+
+    def test_crop_box_is_clamped_to_image(self):
+        """Test that a crop near the edge is shifted to stay inside the image."""
+        policy = FoveationPolicy(crop_fraction=0.5)
+
+        assert policy.crop_box((1000, 800), (0.0, 1.0)) == (0, 400, 400, 800)
+
+    def test_decode_size_keeps_fovea_resolution(self):
+        """Test that the decode size leaves the crop at least fovea_size."""
+        policy = FoveationPolicy(crop_fraction=0.25, fovea_size=(384, 384))
+
+        assert policy.decode_size == (1536, 1536)
+
+    def test_crop_follows_gaze(self):
+        """Test that the crop is taken around the projected gaze point."""
+        policy = FoveationPolicy(fov_degrees=(90, 90), crop_fraction=0.25)
+        img = quadrant_image()
+
+        focus = policy.crop(img, {"x": -0.5, "y": 0.5, "z": 1}, img.size)
+
+        assert focus is not None
+        assert focus.box == (250, 150, 550, 450)
+        assert focus.mime_type == 'image/jpeg'
+        crop = Image.open(io.BytesIO(focus.data)).convert('RGB')
+        assert crop.size == focus.dimensions
+        red, green, blue = crop.getpixel((crop.width // 2, crop.height // 2))
+        assert red > 200 and blue < 60
+
+    def test_crop_box_reported_in_upload_coordinates(self):
+        """Test that the box is scaled back when the decode was downscaled."""
+        policy = FoveationPolicy(fov_degrees=(90, 90), crop_fraction=0.25)
+        img = quadrant_image((800, 600))
+
+        focus = policy.crop(img, {"x": 0, "y": 0, "z": 1}, (1600, 1200))
+
+        assert focus.box == (650, 450, 950, 750)
+
+    def test_crop_returns_none_when_gaze_misses(self):
+        """Test that no crop is produced for an out-of-view gaze."""
+        policy = FoveationPolicy()
+
+        assert policy.crop(quadrant_image(), {"x": 0, "y": 0, "z": -1}, (1600, 1200)) is None
+
+
+class TestFoveationReport:
+    """Tests for foveation_report."""
+
+    def test_reports_tokens_against_resize_policy(self):
+        """Test that tokens are compared to the non-foveated ResizePolicy output, not the upload."""
+        policy = FoveationPolicy(fov_degrees=(90, 90))
+        img = quadrant_image()
+        focus = policy.crop(img, {"x": 0, "y": 0, "z": 1}, img.size)
+        baseline = ResizePolicy().target_dimensions(*img.size)
+
+        report = foveation_report(baseline, 20000, (384, 288), focus)
+
+        assert report['fovea_bytes'] == len(focus.data)
+        assert report['output_bytes'] == 20000 + len(focus.data)
+        assert report['baseline_tokens'] == 258
+        assert report['output_tokens'] == 258 * 2
+        assert report['tokens_saved'] == -258
@@ -0,0 +1,96 @@
+"""
+Tests for the cached upstream health monitor.
+"""
+import time
+import pytest
+from unittest.mock import patch
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.health import UpstreamHealthMonitor
+
+
+def failing_probe():
+    raise ConnectionError('unreachable')
+
+
+class TestUpstreamHealthMonitor:
+    """Tests for UpstreamHealthMonitor."""
+
+    def test_unknown_before_any_observation(self):
+        """Test that an upstream with no probe or traffic is unknown."""
+        monitor = UpstreamHealthMonitor({'gemini': lambda: None})
+
+        assert monitor.status('gemini')['status'] == 'unknown'
+
+    def test_ok_after_successful_probe(self):
+        """Test that a successful probe reports ok."""
+        monitor = UpstreamHealthMonitor({'gemini': lambda: None})
+        monitor.probe_now()
+
+        status = monitor.status('gemini')
+        assert status['status'] == 'ok'
+        assert status['last_probe']['ok'] is True
+
+    def test_down_after_failed_probe(self):
+        """Test that a failed probe reports down with its error."""
+        monitor = UpstreamHealthMonitor({'gemini': failing_probe})
+        monitor.probe_now()
+
+        status = monitor.status('gemini')
+        assert status['status'] == 'down'
+        assert status['last_probe']['error'] == 'unreachable'
+
+    def test_degraded_from_traffic_error_rate(self):
+        """Test that real call failures above the threshold report degraded."""
+        monitor = UpstreamHealthMonitor({}, error_rate_threshold=0.5, min_requests=4)
+
+        monitor.record('speech', True)
+        monitor.record('speech', False)
+        monitor.record('speech', False)
+        assert monitor.status('speech')['status'] == 'ok'  # below min_requests
+
+        monitor.record('speech', True)
+        status = monitor.status('speech')
+        assert status['status'] == 'degraded'
+        assert status['error_rate'] == 0.5
+        assert status['requests'] == 4
+
+    def test_old_calls_leave_the_window(self):
+        """Test that calls older than the window no longer count."""
+        monitor = UpstreamHealthMonitor({}, window_seconds=10, min_requests=1)
+
+        with patch('app.utils.health.time.monotonic', return_value=100.0):
+            monitor.record('gemini', False)
+        with patch('app.utils.health.time.monotonic', return_value=105.0):
+            assert monitor.status('gemini')['status'] == 'degraded'
+        with patch('app.utils.health.time.monotonic', return_value=111.0):
+            status = monitor.status('gemini')
+
+        assert status['requests'] == 0
+        assert status['status'] == 'unknown'
+
+    def test_snapshot_covers_probed_and_recorded_upstreams(self):
+        """Test that snapshot lists every upstream the monitor knows about."""
+        monitor = UpstreamHealthMonitor({'gemini': lambda: None})
+        monitor.record('speech', True)
+
+        assert set(monitor.snapshot()) == {'gemini', 'speech'}
+
+    def test_background_thread_probes_and_stops(self):
+        """Test that start runs probes on a thread and stop ends it."""
+        calls = []
+        monitor = UpstreamHealthMonitor({'gemini': lambda: calls.append(1)}, interval_seconds=0.01)
+
+        monitor.start()
+        try:
+            for _ in range(100):
+                if calls:
+                    break
+                time.sleep(0.01)
+        finally:
+            monitor.stop()
+
+        assert calls
+        assert not monitor._thread.is_alive()
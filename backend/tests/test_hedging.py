@@ -0,0 +1,158 @@
+"""
+Tests for hedged model calls.
+"""
+import threading
+import time
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.hedging import HedgePolicy
+
+
+def warmed_policy(latency=0.01, **kwargs):
+    """Return a policy with enough samples (all at latency) to start hedging."""
+    kwargs.setdefault('min_samples', 5)
+    kwargs.setdefault('min_delay', 0)
+    policy = HedgePolicy(**kwargs)
+    for _ in range(policy.min_samples):
+        policy.record_latency(latency)
+    return policy
+
+
+def scripted_calls(*delays_and_results):
+    """Build a call factory whose n-th call sleeps and returns the n-th (delay, result)."""
+    script = iter(delays_and_results)
+    started = []
+
+    def call():
+        delay, result = next(script)
+        started.append(delay)
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call, started
+
+
+class TestHedgePolicy:
+    """Tests for HedgePolicy."""
+
+    def test_no_hedge_until_enough_samples(self):
+        """Test that hedging waits for a latency history."""
+        policy = HedgePolicy(min_samples=3)
+        policy.record_latency(1.0)
+
+        assert policy.hedge_delay() is None
+
+    def test_hedge_delay_is_latency_percentile(self):
+        """Test that the hedge delay is the configured percentile, floored at min_delay."""
+        policy = HedgePolicy(percentile=0.9, min_samples=10, min_delay=0.5)
+        for latency in range(1, 11):
+            policy.record_latency(latency / 10)
+
+        assert policy.hedge_delay() == 1.0
+
+        policy = HedgePolicy(percentile=0.5, min_samples=1, min_delay=0.5)
+        policy.record_latency(0.1)
+        assert policy.hedge_delay() == 0.5
+
+    def test_fast_primary_is_not_hedged(self):
+        """Test that a primary finishing before the hedge delay is used alone."""
+        policy = warmed_policy(latency=0.2, budget_ratio=1)
+        call, started = scripted_calls((0, 'primary'), (0, 'hedge'))
+
+        assert policy.run(call) == 'primary'
+        assert len(started) == 1
+        stats = policy.stats()
+        assert stats['hedges'] == 0
+        assert stats['primary_wins'] == 0
+
+    def test_slow_primary_loses_to_hedge(self):
+        """Test that a hedge is issued after the delay and wins when faster."""
+        policy = warmed_policy(latency=0.01, budget_ratio=1)
+        call, started = scripted_calls((1.0, 'primary'), (0, 'hedge'))
+
+        assert policy.run(call) == 'hedge'
+        assert len(started) == 2
+
+        stats = policy.stats()
+        assert stats['hedges'] == 1
+        assert stats['hedge_wins'] == 1
+
+    def test_invalid_result_does_not_win(self):
+        """Test that the first result failing is_valid is skipped."""
+        policy = warmed_policy(latency=0.01, budget_ratio=1)
+        call, _ = scripted_calls((0.05, 'valid primary'), (0, 'truncated'))
+
+        result = policy.run(call, is_valid=lambda result: result != 'truncated')
+
+        assert result == 'valid primary'
+        assert policy.stats()['primary_wins'] == 1
+
+    def test_unhedged_calls_are_not_wins(self):
+        """Test that calls without a hedge (no samples or no budget) leave the win counters alone."""
+        policy = HedgePolicy(min_samples=5)
+        policy.run(lambda: 'cold')
+        assert policy.stats()['primary_wins'] == 0
+
+        policy = warmed_policy(latency=0.01, budget_ratio=0)
+        call, started = scripted_calls((0.05, 'slow primary'))
+
+        assert policy.run(call) == 'slow primary'
+        assert len(started) == 1
+
+        stats = policy.stats()
+        assert stats['hedges'] == 0
+        assert stats['primary_wins'] == 0
+        assert stats['hedge_wins'] == 0
+
+    def test_failed_hedge_falls_back_to_primary(self):
+        """Test that a hedge error does not fail the request."""
+        policy = warmed_policy(latency=0.01, budget_ratio=1)
+        call, _ = scripted_calls((0.05, 'primary'), (0, RuntimeError('hedge failed')))
+
+        assert policy.run(call) == 'primary'
+
+    def test_budget_limits_hedges(self):
+        """Test that hedges stop once the token budget is spent."""
+        policy = warmed_policy(latency=0.001, percentile=0.5, min_samples=20, budget_ratio=0.5, max_tokens=1)
+        call, started = scripted_calls(*[(0.02, 'slow')] * 8)
+
+        for _ in range(4):
+            policy.run(call)
+
+        # 4 requests * 0.5 tokens = 2 hedges
+        assert policy.stats()['hedges'] == 2
+        assert len(started) == 6
+
+    def test_loser_is_abandoned(self):
+        """Test that the caller returns without waiting for the losing call, which is counted as abandoned."""
+        policy = warmed_policy(latency=0.01, budget_ratio=1)
+        release = threading.Event()
+        calls = iter(['primary', 'hedge'])
+
+        def call():
+            name = next(calls)
+            if name == 'primary':
+                release.wait(5)
+            return name
+
+        started = time.monotonic()
+        try:
+            assert policy.run(call) == 'hedge'
+            assert time.monotonic() - started < 1
+            assert policy.stats()['abandoned'] == 1
+        finally:
+            release.set()
+
+    def test_call_timeout_is_tightest_limit(self):
+        """Test that a hedged call's RPC timeout is the per-call cap or the time left, whichever is sooner."""
+        policy = HedgePolicy(max_call_seconds=15)
+
+        assert policy.call_timeout() == 15
+        assert policy.call_timeout(4) == 4
+        assert policy.call_timeout(20) == 15
+        assert HedgePolicy().call_timeout() is None
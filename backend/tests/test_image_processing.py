@@ -0,0 +1,176 @@
+"""
+Tests for single-decode image ingestion.
+"""
+import io
+import os
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.image_processing import (
+    ingest_image, ingest_image_data, read_stream, ResizePolicy, estimate_image_tokens
+)
+
+
+def make_upload(data, content_type='image/jpeg'):
+    """Wrap bytes in a FileStorage like Flask's request.files."""
+    return FileStorage(stream=io.BytesIO(data), filename='snapshot', content_type=content_type)
+
+
+def encode(img, format='JPEG', **kwargs):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **kwargs)
+    return buffer.getvalue()
+
+
+def noisy_image(size):
+    """Create an image that does not compress well."""
+    return Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+
+
+class TestIngestImage:
+    """Tests for ingest_image."""
+
+    def test_small_jpeg_passes_through_unchanged(self):
+        """Test that uploads under the threshold are not re-encoded."""
+        data = encode(Image.new('RGB', (100, 100), color='red'))
+
+        is_valid, snapshot, error = ingest_image(make_upload(data))
+
+        assert is_valid, error
+        assert snapshot.data == data
+        assert not snapshot.reencoded
+        assert snapshot.report.original_dimensions == (100, 100)
+        assert snapshot.report.bytes_saved == 0
+
+    def test_large_jpeg_is_resized_to_target(self):
+        """Test that large uploads are decoded at reduced scale and re-encoded."""
+        data = encode(noisy_image((2048, 1536)), quality=95)
+
+        is_valid, snapshot, error = ingest_image(make_upload(data), policy=ResizePolicy(target_size=(768, 768)))
+
+        assert is_valid, error
+        assert snapshot.reencoded
+        assert max(snapshot.image.size) < 2048  # DCT-scaled decode
+        assert max(Image.open(io.BytesIO(snapshot.data)).size) <= 768
+        assert len(snapshot.data) < len(data)
+        assert snapshot.report.bytes_saved == len(data) - len(snapshot.data)
+        assert snapshot.report.tokens_saved == estimate_image_tokens(2048, 1536) - estimate_image_tokens(768, 576)
+
+    def test_png_is_always_converted(self):
+        """Test that PNG uploads are re-encoded even when already small."""
+        data = encode(Image.new('RGBA', (64, 64), color='blue'), format='PNG')
+
+        is_valid, snapshot, error = ingest_image(make_upload(data, 'image/png'))
+
+        assert is_valid, error
+        assert Image.open(io.BytesIO(snapshot.data)).format == 'JPEG'
+        assert snapshot.mime_type == 'image/jpeg'
+
+    def test_webp_output(self):
+        """Test that the policy can convert uploads to WebP."""
+        data = encode(Image.new('RGB', (64, 64), color='blue'))
+
+        is_valid, snapshot, error = ingest_image(make_upload(data), policy=ResizePolicy(output_format='WEBP'))
+
+        assert is_valid, error
+        assert Image.open(io.BytesIO(snapshot.data)).format == 'WEBP'
+        assert snapshot.mime_type == 'image/webp'
+
+    def test_invalid_content_type(self):
+        """Test that non-image content types are rejected."""
+        is_valid, snapshot, error = ingest_image(make_upload(b'not an image', 'text/plain'))
+
+        assert not is_valid
+        assert snapshot is None
+        assert 'Must be JPEG or PNG' in error
+
+    def test_too_large(self):
+        """Test that uploads over max_size are rejected."""
+        is_valid, _, error = ingest_image(make_upload(b'\xff' * 2048), max_size=1024)
+
+        assert not is_valid
+        assert 'too large' in error.lower()
+
+    def test_truncated_jpeg_is_rejected(self):
+        """Test that a truncated JPEG fails the decode-based validation."""
+        data = encode(noisy_image((256, 256)))
+
+        is_valid, _, error = ingest_image(make_upload(data[:len(data) // 2]))
+
+        assert not is_valid
+        assert 'Invalid image file' in error
+
+
+class TestRawUpload:
+    """Tests for read_stream and ingest_image_data."""
+
+    def test_read_stream_in_chunks(self):
+        """Test that a body read in several chunks is returned whole."""
+        data = os.urandom(10000)
+
+        is_valid, body, error = read_stream(io.BytesIO(data), max_size=20000, chunk_size=4096)
+
+        assert is_valid, error
+        assert body == data
+
+    def test_read_stream_stops_past_the_limit(self):
+        """Test that reading stops just past max_size when Content-Length is missing or wrong."""
+        stream = io.BytesIO(b'\xff' * 100000)
+
+        is_valid, body, error = read_stream(stream, max_size=1024, content_length=10)
+
+        assert not is_valid
+        assert body is None
+        assert 'too large' in error.lower()
+        assert stream.tell() == 1025
+
+    def test_read_stream_rejects_declared_length_without_reading(self):
+        """Test that an oversized Content-Length is rejected before the body is read."""
+        stream = io.BytesIO(b'\xff' * 2048)
+
+        is_valid, _, _ = read_stream(stream, max_size=1024, content_length=2048)
+
+        assert not is_valid
+        assert stream.tell() == 0
+
+    def test_ingest_image_data_matches_ingest_image(self):
+        """Test that raw bytes go through the same validation and resize as a file upload."""
+        data = encode(Image.new('RGB', (100, 100), color='red'))
+
+        is_valid, snapshot, error = ingest_image_data(data)
+
+        assert is_valid, error
+        assert snapshot.data is data
+        assert not ingest_image_data(b'not an image')[0]
+
+
+class TestResizePolicy:
+    """Tests for ResizePolicy sizing and byte budget."""
+
+    def test_token_estimate(self):
+        """Test the tile-based token estimate."""
+        assert estimate_image_tokens(384, 384) == 258
+        assert estimate_image_tokens(768, 768) == 258
+        assert estimate_image_tokens(1024, 1024) == 4 * 258
+
+    def test_tile_budget_limits_dimensions(self):
+        """Test that max_tiles shrinks images that fit target_size but cost extra tiles."""
+        policy = ResizePolicy(target_size=(1536, 1536), max_tiles=1)
+
+        width, height = policy.target_dimensions(2000, 1000)
+
+        assert estimate_image_tokens(width, height) == 258
+        assert abs(width / height - 2.0) < 0.01
+
+    def test_byte_budget_searches_quality(self):
+        """Test that quality is lowered until the image fits max_bytes."""
+        img = noisy_image((512, 512))
+        unconstrained, _ = ResizePolicy(quality=90).apply(img)
+
+        data, quality = ResizePolicy(quality=90, min_quality=10, max_bytes=len(unconstrained) // 2).apply(img)
+
+        assert len(data) <= len(unconstrained) // 2
+        assert 10 <= quality < 90
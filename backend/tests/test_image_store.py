@@ -0,0 +1,82 @@
+"""
+Tests for the image blob store.
+"""
+import base64
+import pytest
+import sys
+import os
+from langchain_core.messages import HumanMessage, SystemMessage
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.image_store import ImageBlobStore, image_store, image_url
+
+
+class TestImageBlobStore:
+    """Tests for ImageBlobStore."""
+
+    def test_put_get_release(self):
+        """Test that stored bytes are returned as-is until the handle is released."""
+        store = ImageBlobStore()
+        data = b'\xff\xd8jpeg'
+        handle = store.put(data, 'image/jpeg')
+
+        assert store.get(handle) is data
+        assert store.get(handle.url) is data
+        assert handle.size == len(data)
+        assert store.stats() == {'images': 1, 'bytes': len(data)}
+
+        store.release(handle)
+
+        assert store.stats()['images'] == 0
+        with pytest.raises(KeyError):
+            store.get(handle)
+
+    def test_data_url(self):
+        """Test that the data URL carries the MIME type and base64 of the bytes."""
+        store = ImageBlobStore()
+        handle = store.put(b'webp', 'image/webp')
+
+        assert store.data_url(handle) == 'data:image/webp;base64,' + base64.b64encode(b'webp').decode('ascii')
+
+    def test_materialize_replaces_only_blob_parts(self):
+        """Test that blob references become data URLs in a copy, leaving the original message untouched."""
+        store = ImageBlobStore()
+        handle = store.put(b'frame', 'image/jpeg')
+        system = SystemMessage(content='rules')
+        human = HumanMessage(content=[
+            {'type': 'text', 'text': 'View 1'},
+            {'type': 'image_url', 'image_url': handle.url},
+            {'type': 'image_url', 'image_url': 'data:image/png;base64,AAAA'}
+        ])
+
+        materialized = store.materialize([system, human])
+
+        assert materialized[0] is system
+        assert materialized[1].content[1]['image_url'] == store.data_url(handle)
+        assert materialized[1].content[2]['image_url'] == 'data:image/png;base64,AAAA'
+        assert human.content[1]['image_url'] == handle.url
+
+    def test_image_url_accepts_base64(self):
+        """Test that callers passing base64 strings still get a data URL."""
+        assert image_url('AAAA', 'image/png') == 'data:image/png;base64,AAAA'
+
+
+class TestWorkflowMessages:
+    """Tests for images in the workflow's messages."""
+
+    def test_state_keeps_references(self):
+        """Test that the built message refers to the image by handle, not by its base64 data."""
+        from llm import VRContextWorkflow
+
+        workflow = VRContextWorkflow('key')
+        handle = image_store.put(b'x' * 4096, 'image/jpeg')
+        try:
+            state = workflow._initial_state(handle, '1', 'PSU_Install', {'x': 0, 'y': 0, 'z': 1}, 's1')
+            message = workflow._build_message(state)
+            parts = [part['image_url'] for part in message.content if part['type'] == 'image_url']
+
+            assert parts == [handle.url]
+            assert state['image_mime_type'] == 'image/jpeg'
+            assert image_store.materialize([message])[0].content[-1]['image_url'].startswith('data:image/jpeg;base64,')
+        finally:
+            image_store.release(handle)
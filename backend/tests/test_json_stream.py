@@ -0,0 +1,184 @@
+"""
+Tests for incremental JSON parsing of streamed model output.
+"""
+import json
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.json_stream import (
+    IncrementalJSONParser, instruction_event, missing_fields, parse_model_json, ParseStats,
+    INSTRUCTION_RESPONSE_SCHEMA
+)
+
+
+SAMPLE_RESPONSE = {
+    "image_analysis": "A motherboard with an empty \"RAM\" slot.",
+    "instruction": {
+        "steps": [
+            "Locate the RAM slot on the right",
+            "Align the notch, then press firmly"
+        ],
+        "target_id": "ram_slot_2",
+        "haptic_cue": "guide_to_target"
+    }
+}
+
+
+def feed_in_chunks(text, size):
+    """Feed text to a new parser in fixed-size chunks and collect all values."""
+    parser = IncrementalJSONParser()
+    values = []
+    for i in range(0, len(text), size):
+        values.extend(parser.feed(text[i:i + size]))
+    return parser, values
+
+
+class TestIncrementalJSONParser:
+    """Tests for IncrementalJSONParser."""
+
+    @pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+    def test_reports_all_string_values_regardless_of_chunking(self, chunk_size):
+        """Test that chunk boundaries do not change the parsed values."""
+        parser, values = feed_in_chunks(json.dumps(SAMPLE_RESPONSE, indent=2), chunk_size)
+
+        assert values == [
+            (('image_analysis',), 'A motherboard with an empty "RAM" slot.'),
+            (('instruction', 'steps', 0), 'Locate the RAM slot on the right'),
+            (('instruction', 'steps', 1), 'Align the notch, then press firmly'),
+            (('instruction', 'target_id'), 'ram_slot_2'),
+            (('instruction', 'haptic_cue'), 'guide_to_target'),
+        ]
+        assert parser.complete
+
+    def test_step_emitted_before_response_finishes(self):
+        """Test that a step is reported as soon as its closing quote arrives."""
+        parser = IncrementalJSONParser()
+
+        assert parser.feed('{"instruction": {"steps": ["First st') == []
+        assert parser.feed('ep", "Sec') == [(('instruction', 'steps', 0), 'First step')]
+        assert not parser.complete
+
+    def test_ignores_markdown_fence(self):
+        """Test that text before the first brace is skipped."""
+        _, values = feed_in_chunks('```json\n{"image_analysis": "ok"}\n```', 4)
+
+        assert values == [(('image_analysis',), 'ok')]
+
+    def test_ignores_non_string_values(self):
+        """Test that numbers and literals do not shift array indices."""
+        _, values = feed_in_chunks('{"a": [1, "x", true, "y"], "b": null}', 2)
+
+        assert values == [(('a', 1), 'x'), (('a', 3), 'y')]
+
+
+class TestInstructionEvent:
+    """Tests for mapping parsed values to stream events."""
+
+    def test_step_event(self):
+        """Test that instruction steps map to step events."""
+        event = instruction_event(('instruction', 'steps', 2), 'Press firmly')
+        assert event == {'event': 'step', 'index': 2, 'text': 'Press firmly'}
+
+    def test_invalid_haptic_cue_is_replaced(self):
+        """Test that unknown haptic cues are normalized to none."""
+        event = instruction_event(('instruction', 'haptic_cue'), 'buzz')
+        assert event == {'event': 'haptic_cue', 'haptic_cue': 'none'}
+
+    def test_unrelated_value_is_ignored(self):
+        """Test that values outside the instruction schema produce no event."""
+        assert instruction_event(('step_text',), 'ignored') is None
+
+
+class TestParseModelJson:
+    """Tests for parse_model_json."""
+
+    def test_valid_json(self):
+        """Test that well-formed output parses without repair."""
+        assert parse_model_json(json.dumps(SAMPLE_RESPONSE)) == (SAMPLE_RESPONSE, "ok")
+
+    def test_fenced_json(self):
+        """Test that a markdown fence and surrounding text are ignored."""
+        text = "Here you go:\n```json\n" + json.dumps(SAMPLE_RESPONSE) + "\n```"
+
+        assert parse_model_json(text) == (SAMPLE_RESPONSE, "ok")
+
+    def test_trailing_comma(self):
+        """Test that a trailing comma is repaired."""
+        assert parse_model_json('{"target_id": "psu", "haptic_cue": "none",}') == (
+            {"target_id": "psu", "haptic_cue": "none"}, "repaired"
+        )
+
+    @pytest.mark.parametrize("cut", [60, 90, 120, 150])
+    def test_truncated_output_keeps_complete_steps(self, cut):
+        """Test that output cut off mid-response keeps only complete values."""
+        text = json.dumps(SAMPLE_RESPONSE)[:cut]
+
+        result, status = parse_model_json(text)
+
+        assert status == "repaired"
+        steps = result.get("instruction", {}).get("steps", [])
+        assert all(step in SAMPLE_RESPONSE["instruction"]["steps"] for step in steps)
+
+    def test_truncated_inside_only_value(self):
+        """Test that a lone partial string is kept rather than lost."""
+        assert parse_model_json('{"image_analysis": "A motherboard wi') == (
+            {"image_analysis": "A motherboard wi"}, "repaired"
+        )
+
+    @pytest.mark.parametrize("text", ["", "no json here", '{"a": tru', None])
+    def test_unrecoverable(self, text):
+        """Test that output with no usable object fails."""
+        assert parse_model_json(text) == (None, "failed")
+
+    def test_schema_matches_streamed_fields(self):
+        """Test that the response schema requires the fields the client relies on."""
+        instruction = INSTRUCTION_RESPONSE_SCHEMA["properties"]["instruction"]
+
+        assert set(instruction["required"]) == {"steps", "target_id", "haptic_cue"}
+        assert instruction["properties"]["haptic_cue"]["enum"] == ["guide_to_target", "success_pulse", "none"]
+
+
+class TestMissingFields:
+    """Tests for missing_fields."""
+
+    def test_complete_response(self):
+        """Test that a response with every required field has nothing missing."""
+        assert missing_fields(SAMPLE_RESPONSE) == []
+
+    def test_truncated_response(self):
+        """Test that fields cut off by truncation are reported as dotted paths."""
+        result, status = parse_model_json('{"image_analysis": "PSU", "instruction": {"steps": ["Lift the latch", "Sl')
+
+        assert status == "repaired"
+        assert missing_fields(result) == ["instruction.target_id", "instruction.haptic_cue"]
+
+    def test_any_prefix_repairs_to_an_empty_object(self):
+        """Test that the empty object repaired from a lone brace is missing every top-level field."""
+        assert parse_model_json('xx {') == ({}, "repaired")
+        assert missing_fields({}) == ["image_analysis", "instruction"]
+        assert missing_fields({"image_analysis": "x", "instruction": "text"}) == [
+            "instruction.steps", "instruction.target_id", "instruction.haptic_cue"
+        ]
+
+
+class TestParseStats:
+    """Tests for ParseStats."""
+
+    def test_rates(self):
+        """Test that repair and failure rates are reported."""
+        stats = ParseStats()
+        for status in ["ok", "ok", "repaired", "failed"]:
+            stats.record(status)
+
+        snapshot = stats.snapshot()
+
+        assert snapshot["total"] == 4
+        assert snapshot["repair_rate"] == 0.25
+        assert snapshot["failure_rate"] == 0.25
+
+    def test_empty(self):
+        """Test that rates are zero before any parse."""
+        assert ParseStats().snapshot()["failure_rate"] == 0.0
+
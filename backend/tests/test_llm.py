@@ -38,121 +38,103 @@ class TestVRContextWorkflow:
         assert workflow.workflow is not None
         assert workflow.max_context_history == 10
     
-    @patch('llm.ChatGoogleGenerativeAI')
-    def test_analyze_image_node(self, mock_llm_class, workflow, sample_state):
-        """Test the analyze_image node"""
+    def test_analyze_and_instruct_node(self, workflow, sample_state):
+        """Test the analyze_and_instruct node"""
         # Mock the LLM response
         mock_response = Mock()
-        mock_response.content = "The image shows a server chassis with visible power supply bay."
+        mock_response.content = '{"image_analysis": "The image shows a server chassis with visible power supply bay.", ' \
+                                '"instruction": {"steps": ["Open the bay"], "target_id": "", "haptic_cue": "none"}}'
         
-        mock_llm_instance = Mock()
-        mock_llm_instance.invoke.return_value = mock_response
-        workflow.llm = mock_llm_instance
+        workflow.llm = Mock(invoke=Mock(return_value=mock_response))
         
         # Run the node
-        result = workflow.analyze_image(sample_state)
+        result = workflow.analyze_and_instruct(sample_state)
         
         # Verify
-        assert "image_analysis" in result
-        assert result["image_analysis"] == mock_response.content
+        assert result["image_analysis"] == "The image shows a server chassis with visible power supply bay."
         assert "messages" in result
         assert len(result["messages"]) == 2  # HumanMessage and AIMessage
     
-    @patch('llm.ChatGoogleGenerativeAI')
-    def test_analyze_image_with_retry(self, mock_llm_class, workflow, sample_state):
-        """Test that analyze_image retries on failure"""
+    def test_analyze_and_instruct_with_retry(self, workflow, sample_state):
+        """Test that analyze_and_instruct retries a transient failure"""
+        from app.utils.resilience import Resilience
+        
         # Mock the LLM to fail once then succeed
         mock_response = Mock()
-        mock_response.content = "Analysis after retry"
+        mock_response.content = '{"image_analysis": "Analysis after retry", "instruction": {"steps": ["Go"]}}'
         
-        mock_llm_instance = Mock()
-        mock_llm_instance.invoke.side_effect = [Exception("API Error"), mock_response]
-        workflow.llm = mock_llm_instance
+        mock_invoke = Mock(side_effect=[Exception("503 UNAVAILABLE"), mock_response])
+        workflow.llm = Mock(invoke=mock_invoke)
+        workflow.resilience = Resilience(max_attempts=2, sleep=lambda delay: None)
         
         # Run the node
-        result = workflow.analyze_image(sample_state)
+        result = workflow.analyze_and_instruct(sample_state)
         
         # Verify it retried and succeeded
-        assert "image_analysis" in result
         assert result["image_analysis"] == "Analysis after retry"
-        assert mock_llm_instance.invoke.call_count == 2
+        assert mock_invoke.call_count == 2
     
-    @patch('llm.ChatGoogleGenerativeAI')
-    def test_generate_instruction_node(self, mock_llm_class, workflow, sample_state):
-        """Test the generate_instruction node"""
-        # Add image_analysis to state
-        sample_state["image_analysis"] = "Server chassis visible, power supply bay open"
-        
+    def test_analyze_and_instruct_instruction_fields(self, workflow, sample_state):
+        """Test that the instruction steps, target and haptic cue are read from the response"""
         # Mock the LLM response with JSON
         mock_response = Mock()
         mock_response.content = '''{
-            "instruction_text": "Locate the 8-pin PDU cable and plug it into port J_PWR_1.",
-            "target_id": "J_PWR_1",
-            "haptic_cue": "guide_to_target"
+            "image_analysis": "Server chassis visible, power supply bay open",
+            "instruction": {
+                "steps": ["Locate the 8-pin PDU cable and plug it into port J_PWR_1."],
+                "target_id": "J_PWR_1",
+                "haptic_cue": "guide_to_target"
+            }
         }'''
         
-        mock_llm_instance = Mock()
-        mock_llm_instance.invoke.return_value = mock_response
-        workflow.llm = mock_llm_instance
+        workflow.llm = Mock(invoke=Mock(return_value=mock_response))
         
         # Run the node
-        result = workflow.generate_instruction(sample_state)
+        result = workflow.analyze_and_instruct(sample_state)
         
         # Verify
-        assert "instruction_text" in result
-        assert "target_id" in result
-        assert "haptic_cue" in result
+        assert result["instruction_text"] == ["Locate the 8-pin PDU cable and plug it into port J_PWR_1."]
         assert result["target_id"] == "J_PWR_1"
         assert result["haptic_cue"] == "guide_to_target"
     
-    @patch('llm.ChatGoogleGenerativeAI')
-    def test_generate_instruction_invalid_json_fallback(self, mock_llm_class, workflow, sample_state):
-        """Test that generate_instruction handles invalid JSON gracefully"""
-        sample_state["image_analysis"] = "Test analysis"
-        
+    def test_analyze_and_instruct_invalid_json_fallback(self, workflow, sample_state):
+        """Test that analyze_and_instruct handles invalid JSON gracefully"""
         # Mock the LLM to return non-JSON
         mock_response = Mock()
         mock_response.content = "This is not JSON, just plain text instruction"
         
-        mock_llm_instance = Mock()
-        mock_llm_instance.invoke.return_value = mock_response
-        workflow.llm = mock_llm_instance
+        workflow.llm = Mock(invoke=Mock(return_value=mock_response))
         
         # Run the node
-        result = workflow.generate_instruction(sample_state)
+        result = workflow.analyze_and_instruct(sample_state)
         
         # Verify fallback behavior
-        assert "instruction_text" in result
-        assert result["instruction_text"] == mock_response.content[:200]
+        assert result["parse_error"]
+        assert result["instruction_text"]
         assert result["target_id"] == ""
         assert result["haptic_cue"] == "none"
     
-    @patch('llm.ChatGoogleGenerativeAI')
-    def test_generate_instruction_validates_haptic_cue(self, mock_llm_class, workflow, sample_state):
+    def test_analyze_and_instruct_validates_haptic_cue(self, workflow, sample_state):
         """Test that invalid haptic_cue values are corrected"""
-        sample_state["image_analysis"] = "Test analysis"
-        
         # Mock the LLM to return invalid haptic_cue
         mock_response = Mock()
         mock_response.content = '''{
-            "instruction_text": "Test instruction",
-            "target_id": "TEST_1",
-            "haptic_cue": "invalid_cue"
+            "image_analysis": "Test analysis",
+            "instruction": {"steps": ["Test instruction"], "target_id": "TEST_1", "haptic_cue": "invalid_cue"}
         }'''
         
-        mock_llm_instance = Mock()
-        mock_llm_instance.invoke.return_value = mock_response
-        workflow.llm = mock_llm_instance
+        workflow.llm = Mock(invoke=Mock(return_value=mock_response))
         
         # Run the node
-        result = workflow.generate_instruction(sample_state)
+        result = workflow.analyze_and_instruct(sample_state)
         
         # Verify haptic_cue was corrected to "none"
         assert result["haptic_cue"] == "none"
     
+    @patch('os.replace')
     @patch('builtins.open', create=True)
     @patch('os.makedirs')
-    def test_save_context_node(self, mock_makedirs, mock_open, workflow, sample_state):
+    def test_save_context_node(self, mock_makedirs, mock_open, mock_replace, workflow, sample_state):
         """Test the save_context node"""
         # Add required fields to state
         sample_state["image_analysis"] = "Test analysis"
@@ -170,17 +152,18 @@ class TestVRContextWorkflow:
         # Verify directory creation
         mock_makedirs.assert_called_once_with("contexts", exist_ok=True)
         
-        # Verify file was opened for writing
+        # Verify a temp file was written and renamed over the session file
         mock_open.assert_called_once()
         call_args = mock_open.call_args[0]
-        assert call_args[0] == "contexts/test-session-123.json"
+        assert call_args[0].startswith("contexts/test-session-123.json.")
         assert call_args[1] == "w"
+        mock_replace.assert_called_once_with(call_args[0], "contexts/test-session-123.json")
         
         # Verify context_history was updated
         assert "context_history" in result
         assert len(result["context_history"]) > 0
     
-    @patch('llm.ChatGoogleGenerativeAI')
+    @patch('llm.get_chat_model')
     def test_full_workflow_run(self, mock_llm_class, workflow):
         """Test running the full workflow"""
         # Mock LLM responses
@@ -207,7 +190,7 @@ class TestVRContextWorkflow:
             
             # Run the workflow
             result = workflow.run(
-                image_base64="test_image_base64",
+                image="test_image_base64",
                 task_step="5",
                 current_task="Cable_Install",
                 gaze_vector={"x": 0.1, "y": 0.2, "z": 0.3},
@@ -221,3 +204,253 @@ class TestVRContextWorkflow:
         assert result["session_id"] == "test-session-456"
         assert result["current_task"] == "Cable_Install"
         assert result["task_step"] == "5"
+    
+    def test_analyze_and_instruct_retries_transient_errors(self, workflow, sample_state):
+        """Test that a 503 from Gemini is retried through the resilience policy"""
+        from app.utils.resilience import Resilience
+        
+        class Unavailable(Exception):
+            code = 503
+        
+        mock_response = Mock()
+        mock_response.content = '{"image_analysis": "ok", "instruction": {"steps": ["Go"], "target_id": "", "haptic_cue": "none"}}'
+        
+        mock_llm_instance = Mock()
+        mock_llm_instance.invoke.side_effect = [Unavailable("503 UNAVAILABLE"), mock_response]
+        workflow.llm = mock_llm_instance
+        workflow.resilience = Resilience(max_attempts=2, sleep=lambda delay: None)
+        
+        result = workflow.analyze_and_instruct(sample_state)
+        
+        assert mock_llm_instance.invoke.call_count == 2
+        assert result["instruction_text"] == ["Go"]
+    
+    def test_analyze_and_instruct_fails_fast_when_circuit_open(self, workflow, sample_state):
+        """Test that an open circuit skips Gemini and sets retry_after"""
+        from app.utils.resilience import Resilience
+        
+        mock_llm_instance = Mock()
+        workflow.llm = mock_llm_instance
+        workflow.resilience = Resilience(failure_threshold=1)
+        workflow.resilience.breaker(workflow.model_name).record_failure()
+        
+        result = workflow.analyze_and_instruct(sample_state)
+        
+        mock_llm_instance.invoke.assert_not_called()
+        assert result["retry_after"] > 0
+        assert "error" in result
+    
+    def test_is_complete_response_rejects_truncated_json(self, workflow):
+        """Test that a truncated generation cannot win a hedged call"""
+        complete = Mock(content='{"image_analysis": "ok", "instruction": {"steps": ["Go"]}}')
+        truncated = Mock(content='{"image_analysis": "ok", "instruction": {"steps": ["G')
+        
+        assert workflow._is_complete_response(complete)
+        assert not workflow._is_complete_response(truncated)
+    
+    def test_analyze_and_instruct_stopped_at_deadline(self, workflow, sample_state):
+        """Test that a Gemini call outliving the request deadline ends at its RPC timeout"""
+        import time
+        from app.utils.deadline import Deadline
+        
+        class DeadlineError(Exception):
+            code = 504
+        
+        def slow_invoke(messages, **kwargs):
+            # The RPC runs until its timeout, the request's remaining deadline
+            time.sleep(kwargs["timeout"])
+            raise DeadlineError("504 DEADLINE_EXCEEDED")
+        
+        workflow.llm = Mock(invoke=slow_invoke)
+        sample_state["deadline"] = Deadline(0.05)
+        
+        result = workflow.analyze_and_instruct(sample_state)
+        
+        assert result["deadline_exceeded"] == "generation"
+        assert "error" in result
+    
+    def test_remaining_deadline_sent_as_rpc_timeout(self, workflow, sample_state):
+        """Test that the Gemini RPC is bounded by the time left before the deadline"""
+        from app.utils.deadline import Deadline
+        
+        calls = []
+        
+        def invoke(messages, **kwargs):
+            calls.append(kwargs)
+            return Mock(content='{"image_analysis": "ok", "instruction": {"steps": ["Go"], "target_id": "", "haptic_cue": "none"}}')
+        
+        workflow.llm = Mock(invoke=invoke)
+        sample_state["deadline"] = Deadline(5)
+        
+        workflow.analyze_and_instruct(sample_state)
+        
+        assert 0 < calls[0]["timeout"] <= 5
+        assert calls[0]["retry"] is None
+    
+    def test_hedged_calls_capped_by_per_call_timeout(self, workflow, sample_state):
+        """Test that hedged calls carry the policy's per-call RPC timeout, so a loser cannot run on indefinitely"""
+        from app.utils.hedging import HedgePolicy
+        
+        calls = []
+        
+        def invoke(messages, **kwargs):
+            calls.append(kwargs)
+            return Mock(content='{"image_analysis": "ok", "instruction": {"steps": ["Go"], "target_id": "", "haptic_cue": "none"}}')
+        
+        workflow.llm = Mock(invoke=invoke)
+        workflow.hedging = HedgePolicy(max_call_seconds=3)
+        
+        workflow.analyze_and_instruct(sample_state)
+        
+        assert calls[0]["timeout"] == 3
+    
+    def test_slow_call_is_hedged(self, workflow, sample_state):
+        """Test that a second call is started when the first is slow, and the first complete answer wins"""
+        import threading
+        from app.utils.hedging import HedgePolicy
+        
+        release = threading.Event()
+        calls = []
+        
+        def invoke(messages, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                release.wait(5)
+            return Mock(content='{"image_analysis": "call %d", "instruction": {"steps": ["Go"], "target_id": "", '
+                                '"haptic_cue": "none"}}' % len(calls))
+        
+        workflow.llm = Mock(invoke=invoke)
+        workflow.hedging = HedgePolicy(min_samples=1, min_delay=0, budget_ratio=1)
+        workflow.hedging.record_latency(0.01)
+        
+        try:
+            result = workflow.analyze_and_instruct(sample_state)
+        finally:
+            release.set()
+        
+        assert result["image_analysis"] == "call 2"
+        assert workflow.hedging.stats()["hedge_wins"] == 1
+    
+    def test_static_prompt_sent_as_system_instruction(self, workflow, sample_state):
+        """Test that only task, step and gaze are in the per-request message"""
+        from langchain_core.messages import SystemMessage
+        
+        messages = workflow._messages(workflow._build_message(sample_state))
+        
+        assert isinstance(messages[0], SystemMessage)
+        assert "CORE PRINCIPLES" in messages[0].content
+        assert "PSU_Install" not in messages[0].content
+        
+        text = messages[1].content[0]["text"]
+        assert "PSU_Install" in text
+        assert "CORE PRINCIPLES" not in text
+    
+    def test_parse_response_repairs_truncated_output(self, workflow):
+        """Test that a truncated generation keeps its complete steps and is counted"""
+        content = '{"image_analysis": "PSU visible", "instruction": {"steps": ["Lift the latch", "Slide'
+        
+        result, status = workflow._parse_response(content)
+        
+        assert status == "repaired"
+        assert result["instruction"]["steps"] == ["Lift the latch"]
+        assert workflow.parse_stats.snapshot()["repaired"] == 1
+    
+    def test_repaired_output_missing_fields_is_a_parse_error(self, workflow, sample_state):
+        """Test that a repair which lost required fields (here everything) is flagged rather than passed as valid"""
+        workflow.llm = Mock(invoke=Mock(return_value=Mock(content='xx {')))
+        
+        result = workflow.analyze_and_instruct(sample_state)
+        
+        assert result["parse_status"] == "repaired"
+        assert "image_analysis" in result["parse_error"]
+        assert "instruction" in result["parse_error"]
+        
+        complete = '{"image_analysis": "ok", "instruction": {"steps": ["Go"], "target_id": "", "haptic_cue": "none"},}'
+        workflow.llm = Mock(invoke=Mock(return_value=Mock(content=complete)))
+        result = workflow.analyze_and_instruct(sample_state)
+        
+        assert result["parse_status"] == "repaired"
+        assert result["parse_error"] is None
+    
+    def test_extra_frames_added_to_message(self, workflow, sample_state):
+        """Test that batch views are sent as extra images in the same message"""
+        sample_state["extra_frames"] = [
+            {"image": "second", "image_mime_type": "image/webp", "gaze_vector": {"x": 0.1, "y": 0, "z": 1}}
+        ]
+        
+        content = workflow._build_message(sample_state).content
+        
+        images = [part["image_url"] for part in content if part["type"] == "image_url"]
+        assert images[-1] == "data:image/webp;base64,second"
+        assert "View 2" in content[-2]["text"]
+    
+    def test_session_memory_carries_across_runs(self, tmp_path):
+        """Test that earlier steps reach later prompts and the prompt stops growing once the buffer is full"""
+        from app.utils.session_store import JSONFileSessionStore
+        
+        workflow = VRContextWorkflow(api_key="test-api-key", max_context_history=2, max_summary_chars=200,
+                                     session_store=JSONFileSessionStore(str(tmp_path)))
+        prompts = []
+        
+        def invoke(messages, **kwargs):
+            prompts.append(messages[1].content[0]["text"])
+            step = len(prompts)
+            return Mock(content='{"image_analysis": "Bay %d", "instruction": {"steps": ["Do step %d"], '
+                                '"target_id": "part_%d", "haptic_cue": "none"}}' % (step, step, step))
+        
+        workflow.llm = Mock(invoke=invoke)
+        for step in range(1, 41):
+            workflow.run("aW1hZ2U=", str(step), "PSU_Install", {"x": 0, "y": 0, "z": 1}, "memory-session")
+        
+        assert "No earlier steps" in prompts[0]
+        assert 'told "Do step 1"' in prompts[1]
+        assert "step 39" in prompts[-1] and "step 38" in prompts[-1]
+        assert "Summary of 37 earlier step(s)" in prompts[-1]
+        assert len(prompts[-1]) <= len(prompts[10]) + 20
+        
+        saved = workflow.session_store.load("memory-session")["memory"]
+        assert [entry["step"] for entry in saved["recent"]] == ["39", "40"]
+        assert saved["summarized_steps"] == 38
+    
+    def test_stream_client_deadline_leaves_breaker_closed(self, workflow):
+        """Test that streams cut off by the client's short deadline do not open the shared circuit"""
+        import time
+        from app.utils.deadline import Deadline
+        from app.utils.resilience import Resilience
+        
+        class DeadlineError(Exception):
+            code = 504
+        
+        def stream(messages, **kwargs):
+            # The RPC runs until its timeout, the client's remaining deadline
+            time.sleep(kwargs["timeout"])
+            raise DeadlineError("504 Deadline Exceeded")
+            yield
+        
+        workflow.resilience = Resilience(failure_threshold=3)
+        workflow.llm = Mock(stream=stream)
+        
+        for _ in range(3):
+            events = workflow.stream("aW1hZ2U=", "1", "PSU_Install", {"x": 0, "y": 0, "z": 1}, "stream-session",
+                                     deadline=Deadline(0.02))
+            result = list(events)[-1]["result"]
+            assert result["deadline_exceeded"] == "generation"
+        
+        assert workflow.resilience.stats() == {workflow.model_name: "closed"}
+    
+    def test_stream_closed_early_returns_breaker_slot(self, workflow):
+        """Test that a client disconnecting mid-stream does not leave a half-open circuit stuck"""
+        from app.utils.resilience import Resilience
+        
+        workflow.resilience = Resilience(failure_threshold=1, recovery_seconds=0)
+        workflow.resilience.breaker(workflow.model_name).record_failure()
+        workflow.llm = Mock(stream=lambda messages, **kwargs: iter([
+            Mock(content='{"image_analysis": "PSU bay", '),
+            Mock(content='"instruction": {"steps": ["Go"], "target_id": "", "haptic_cue": "none"}}')
+        ]))
+        
+        events = workflow.stream("aW1hZ2U=", "1", "PSU_Install", {"x": 0, "y": 0, "z": 1}, "stream-session")
+        assert next(events)["event"] == "image_analysis"
+        events.close()
+        
+        assert workflow.resilience.breaker(workflow.model_name).allow()
@@ -0,0 +1,145 @@
+"""
+Tests for the queued, sampled JSON logging pipeline.
+"""
+import io
+import json
+import logging
+import pytest
+from types import SimpleNamespace
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.log_pipeline import (
+    JSONFormatter, NonBlockingQueueHandler, SamplingFilter, configure_logging, parse_rates,
+    start_request_sampling, stop_logging, _sample_roll
+)
+from app.utils.tracing import BatchSpanProcessor, configure_tracing, tracer
+
+
+def make_record(level=logging.INFO, msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('app.test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def stream():
+    """Install the pipeline writing to a buffer for one test."""
+    buffer = io.StringIO()
+    yield buffer
+    stop_logging()
+
+
+def lines(buffer):
+    return [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+
+class TestParseRates:
+    """Tests for parse_rates."""
+
+    def test_pairs(self):
+        """Test that NAME=RATE pairs are parsed."""
+        assert parse_rates('DEBUG=0.01, model_payload=1') == {'DEBUG': 0.01, 'model_payload': 1.0}
+        assert parse_rates('') == {}
+
+    @pytest.mark.parametrize('spec', ['DEBUG', 'DEBUG=x', 'DEBUG=2', '=0.5'])
+    def test_invalid(self, spec):
+        """Test that malformed or out-of-range rates are rejected."""
+        with pytest.raises(ValueError):
+            parse_rates(spec)
+
+
+class TestSamplingFilter:
+    """Tests for SamplingFilter."""
+
+    def test_levels_below_minimum_are_dropped(self):
+        """Test that without a rate, records below min_level are dropped and others kept."""
+        sampling = SamplingFilter(logging.INFO)
+
+        assert sampling.filter(make_record(logging.INFO))
+        assert not sampling.filter(make_record(logging.DEBUG))
+        assert sampling.dropped == 1
+
+    def test_level_rate_uses_the_request_roll(self):
+        """Test that one roll per request keeps or drops all of its sampled records together."""
+        sampling = SamplingFilter(logging.INFO, level_rates={logging.DEBUG: 0.01})
+
+        start_request_sampling(lambda: 0.005)
+        assert all(sampling.filter(make_record(logging.DEBUG)) for _ in range(5))
+        start_request_sampling(lambda: 0.5)
+        assert not any(sampling.filter(make_record(logging.DEBUG)) for _ in range(5))
+        _sample_roll.set(None)
+
+    def test_message_rate_overrides_level(self):
+        """Test that a sample_key rate applies regardless of level."""
+        sampling = SamplingFilter(logging.INFO, message_rates={'model_payload': 0}, rng=lambda: 0.0)
+
+        assert not sampling.filter(make_record(logging.INFO, sample_key='model_payload'))
+        assert sampling.filter(make_record(logging.INFO, sample_key='other'))
+
+    def test_capture_level(self):
+        """Test that loggers are opened up to the lowest sampled level."""
+        assert SamplingFilter(logging.INFO).capture_level == logging.INFO
+        assert SamplingFilter(logging.INFO, {logging.DEBUG: 0.01}).capture_level == logging.DEBUG
+        assert SamplingFilter(logging.INFO, {logging.DEBUG: 0}).capture_level == logging.INFO
+
+
+class TestPipeline:
+    """Tests for the queue handler, listener and JSON formatter."""
+
+    def test_records_are_written_as_json(self, stream):
+        """Test that records reach the stream as JSON lines with their extra fields."""
+        configure_logging(logging.INFO, stream=stream)
+        logging.getLogger('app.test').info('done %s', 'ok', extra={'session_id': 's1', 'duration_ms': 12})
+        stop_logging()
+
+        [line] = lines(stream)
+        assert line['message'] == 'done ok'
+        assert line['level'] == 'INFO'
+        assert line['session_id'] == 's1'
+        assert line['duration_ms'] == 12
+        assert line['timestamp'].endswith('Z')
+
+    def test_exception_is_kept_separate(self, stream):
+        """Test that the traceback is rendered in the caller and written as its own field."""
+        configure_logging(logging.INFO, stream=stream)
+        try:
+            raise ValueError('bad json')
+        except ValueError:
+            logging.getLogger('app.test').error('failed', exc_info=True)
+        stop_logging()
+
+        [line] = lines(stream)
+        assert line['message'] == 'failed'
+        assert 'ValueError: bad json' in line['exception']
+
+    def test_trace_ids_are_captured_in_the_request_thread(self, stream):
+        """Test that the active span's IDs are attached before the record is queued."""
+        configure_logging(logging.INFO, stream=stream)
+        configure_tracing(BatchSpanProcessor(SimpleNamespace(export=lambda payload: None)))
+        try:
+            with tracer.span('request') as span:
+                logging.getLogger('app.test').info('inside')
+        finally:
+            configure_tracing(None)
+        stop_logging()
+
+        [line] = lines(stream)
+        assert line['trace_id'] == span.trace_id
+        assert line['span_id'] == span.span_id
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        """Test that a full queue counts dropped records."""
+        import queue
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        handler.handle(make_record())
+        handler.handle(make_record())
+
+        assert handler.dropped == 1
+
+    def test_formatter_handles_unserializable_extras(self):
+        """Test that values json cannot encode are written as strings."""
+        line = json.loads(JSONFormatter().format(make_record(image=object())))
+
+        assert line['image'].startswith('<object object')
@@ -4,12 +4,13 @@ Tests for Flask application core functionality.
 import pytest
 import json
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 # Set test environment variables BEFORE importing app modules
 os.environ['GEMINI_API_KEY'] = 'test_gemini_key'
 os.environ['API_KEY'] = 'test_api_key'
 os.environ['FLASK_ENV'] = 'testing'
+os.environ['HEALTH_MONITOR_ENABLED'] = 'false'
 
 from app.main import create_app, Config
 
@@ -46,10 +47,15 @@ class TestFlaskAppInitialization:
         assert Config.SESSION_TIMEOUT_HOURS == 24
     
     def test_json_logging_setup(self, app):
-        """Test that JSON logging is configured."""
-        assert len(app.logger.handlers) > 0
+        """Test that JSON logging is configured through the queued root handler."""
+        import logging
+        from app.utils.log_pipeline import NonBlockingQueueHandler
+        
+        handlers = [h for h in logging.getLogger().handlers if isinstance(h, NonBlockingQueueHandler)]
+        assert len(handlers) == 1
+        assert app.logger.propagate
         # Check that logger is set up
-        assert app.logger.level > 0
+        assert app.logger.getEffectiveLevel() > 0
 
 
 class TestErrorHandlers:
@@ -148,26 +154,28 @@ class TestErrorHandlers:
 class TestHealthEndpoint:
     """Tests for /health endpoint."""
     
-    @patch('app.main.ChatGoogleGenerativeAI')
-    def test_health_endpoint_success(self, mock_gemini, client):
-        """Test /health endpoint returns 200 when Gemini API is reachable."""
-        # Mock successful Gemini API call
-        mock_llm_instance = MagicMock()
-        mock_llm_instance.invoke.return_value = MagicMock()
-        mock_gemini.return_value = mock_llm_instance
+    @patch('app.utils.clients.ChatGoogleGenerativeAI')
+    def test_health_endpoint_success(self, mock_gemini, app, client):
+        """Test /health endpoint returns 200 from cached state without calling Gemini."""
+        app.upstream_monitor.probes = {'gemini': lambda: None}
+        app.upstream_monitor.probe_now()
         
         response = client.get('/health')
         
         assert response.status_code == 200
         data = json.loads(response.get_data(as_text=True))
         assert data['status'] == 'healthy'
+        assert data['upstreams']['gemini']['status'] == 'ok'
         assert 'timestamp' in data
+        mock_gemini.assert_not_called()
     
-    @patch('app.main.ChatGoogleGenerativeAI')
-    def test_health_endpoint_gemini_failure(self, mock_gemini, client):
-        """Test /health endpoint returns 503 when Gemini API fails."""
-        # Mock Gemini API failure
-        mock_gemini.side_effect = Exception('Gemini API unavailable')
+    def test_health_endpoint_gemini_failure(self, app, client):
+        """Test /health endpoint returns 503 when the Gemini probe fails."""
+        def failing_probe():
+            raise Exception('Gemini API unavailable')
+        
+        app.upstream_monitor.probes = {'gemini': failing_probe}
+        app.upstream_monitor.probe_now()
         
         response = client.get('/health')
         
@@ -177,6 +185,18 @@ class TestHealthEndpoint:
         assert 'error' in data
         assert 'timestamp' in data
     
+    def test_health_endpoint_degraded_by_traffic_errors(self, app, client):
+        """Test that a high error rate on real traffic reports degraded."""
+        for _ in range(app.upstream_monitor.min_requests):
+            app.upstream_monitor.record('gemini', False)
+        
+        response = client.get('/health')
+        
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assert data['status'] == 'degraded'
+        assert data['upstreams']['gemini']['error_rate'] == 1.0
+    
     @patch('app.main.Config')
     def test_health_endpoint_missing_api_key(self, mock_config, client):
         """Test /health endpoint handles missing API key."""
@@ -188,3 +208,57 @@ class TestHealthEndpoint:
         assert response.status_code == 503
         data = json.loads(response.get_data(as_text=True))
         assert data['status'] == 'unhealthy'
+
+
+class TestProbeEndpoints:
+    """Tests for /livez and /readyz."""
+    
+    def test_livez(self, client):
+        """Test that the liveness probe always answers 200."""
+        response = client.get('/livez')
+        
+        assert response.status_code == 200
+        assert json.loads(response.get_data(as_text=True))['status'] == 'alive'
+    
+    def test_readyz_when_workflow_initialized(self, app, client):
+        """Test that the readiness probe is 200 once the workflow exists."""
+        app.workflow = MagicMock()
+        
+        response = client.get('/readyz')
+        
+        assert response.status_code == 200
+        assert json.loads(response.get_data(as_text=True))['status'] == 'ready'
+    
+    def test_readyz_without_workflow(self, app, client):
+        """Test that the readiness probe is 503 without a workflow."""
+        app.workflow = None
+        
+        response = client.get('/readyz')
+        
+        assert response.status_code == 503
+
+
+class TestMetricsEndpoint:
+    """Tests for /metrics."""
+    
+    def test_metrics_exposes_stage_and_request_metrics(self, app, client):
+        """Test that /metrics renders the Prometheus text format with request timings."""
+        client.get('/livez')
+        
+        response = client.get('/metrics')
+        body = response.get_data(as_text=True)
+        
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        assert '# TYPE lucid_stage_duration_seconds histogram' in body
+        assert 'lucid_request_duration_seconds_count{endpoint="/livez",status="200"}' in body
+        assert 'lucid_requests_in_flight{endpoint="/metrics"} 1' in body
+    
+    def test_metrics_exports_component_counters(self, app, client):
+        """Test that retries, parse outcomes and cache hits are exported."""
+        response = client.get('/metrics')
+        body = response.get_data(as_text=True)
+        
+        assert '# TYPE lucid_llm_retries_total counter' in body
+        assert 'lucid_model_output_total{outcome="failed"}' in body
+        assert 'lucid_response_cache_hits_total' in body
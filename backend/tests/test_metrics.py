@@ -0,0 +1,194 @@
+"""
+Tests for the Prometheus metrics registry.
+"""
+import math
+import re
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.metrics import MetricsRegistry, STAGE_SECONDS, app_collector, stage_timer
+from app.utils.resilience import Resilience
+from app.utils.response_cache import ResponseCache
+
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(?:,|$)')
+SAMPLE_SUFFIXES = {'counter': ('',), 'gauge': ('',), 'histogram': ('_bucket', '_sum', '_count')}
+
+
+def parse_exposition(body):
+    """
+    Parse the Prometheus text format strictly enough to catch what a scraper would reject.
+
+    Returns {family: {'type', 'help', 'samples': [(name, labels, value)]}}.
+    """
+    families = {}
+    family = None
+    for line in body.splitlines():
+        if not line:
+            continue
+        if line.startswith('# HELP '):
+            name, text = line[len('# HELP '):].split(' ', 1)
+            assert name not in families, f'{name} declared twice'
+            families[name] = {'help': text, 'type': None, 'samples': []}
+            family = name
+        elif line.startswith('# TYPE '):
+            name, kind = line[len('# TYPE '):].split(' ')
+            assert name == family and families[name]['type'] is None, f'TYPE {name} without its HELP'
+            assert kind in SAMPLE_SUFFIXES, kind
+            families[name]['type'] = kind
+        else:
+            match = SAMPLE_LINE.match(line)
+            assert match, f'malformed sample: {line}'
+            name, labels, value = match.groups()
+            kind = families[family]['type']
+            assert name in [family + suffix for suffix in SAMPLE_SUFFIXES[kind]], (family, name)
+            labels = dict(LABEL.findall(labels or ''))
+            families[family]['samples'].append((name, labels, float(value)))
+
+    for name, family in families.items():
+        # Counters carry the _total suffix on the family, so parsers do not type them "unknown"
+        assert name.endswith('_total') == (family['type'] == 'counter'), name
+        if family['type'] == 'histogram':
+            buckets = [(labels['le'], value) for sample, labels, value in family['samples']
+                       if sample.endswith('_bucket')]
+            counts = [value for _, value in buckets]
+            assert buckets[-1][0] == '+Inf' and counts == sorted(counts), name
+            assert [value for sample, _, value in family['samples'] if sample == name + '_count'] == [counts[-1]]
+            assert all(math.isfinite(float(le)) for le, _ in buckets[:-1])
+
+    return families
+
+
+class TestMetrics:
+    """Tests for Counter, Gauge and Histogram rendering."""
+
+    def test_counter_renders_total(self):
+        """Test that counters are rendered with the _total suffix and labels."""
+        registry = MetricsRegistry()
+        counter = registry.counter('requests', 'Requests', ['endpoint'])
+        counter.inc(endpoint='/assist')
+        counter.inc(2, endpoint='/assist')
+
+        body = registry.render()
+
+        assert '# TYPE requests_total counter' in body
+        assert 'requests_total{endpoint="/assist"} 3' in body
+
+    def test_gauge_goes_up_and_down(self):
+        """Test that gauges track increments and decrements."""
+        registry = MetricsRegistry()
+        gauge = registry.gauge('in_flight', 'In flight')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        assert gauge.value() == 1
+        assert 'in_flight 1' in registry.render()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that histogram buckets, sum and count follow the exposition format."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency', 'Latency', ['stage'], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, stage='llm_call')
+
+        body = registry.render()
+
+        assert 'latency_bucket{le="0.1",stage="llm_call"} 1' in body
+        assert 'latency_bucket{le="1",stage="llm_call"} 2' in body
+        assert 'latency_bucket{le="+Inf",stage="llm_call"} 3' in body
+        assert 'latency_sum{stage="llm_call"} 5.55' in body
+        assert 'latency_count{stage="llm_call"} 3' in body
+
+    def test_histogram_times_failing_blocks(self):
+        """Test that a block that raises is still observed."""
+        histogram = MetricsRegistry().histogram('latency', 'Latency', ['stage'])
+
+        with pytest.raises(RuntimeError):
+            with histogram.time(stage='stt'):
+                raise RuntimeError('upstream down')
+
+        assert histogram.count(stage='stt') == 1
+
+    def test_wrong_labels_raise(self):
+        """Test that observing with missing or extra labels is rejected."""
+        counter = MetricsRegistry().counter('requests', 'Requests', ['endpoint'])
+
+        with pytest.raises(ValueError):
+            counter.inc(status='200')
+
+    def test_label_values_are_escaped(self):
+        """Test that quotes and backslashes in label values are escaped."""
+        registry = MetricsRegistry()
+        registry.counter('errors', 'Errors', ['message']).inc(message='bad "json" \\')
+
+        assert 'errors_total{message="bad \\"json\\" \\\\"} 1' in registry.render()
+
+    def test_reregistering_returns_the_same_metric(self):
+        """Test that a metric registered twice is shared, and a conflicting one rejected."""
+        registry = MetricsRegistry()
+        first = registry.counter('requests', 'Requests')
+
+        assert registry.counter('requests', 'Requests') is first
+        with pytest.raises(ValueError):
+            registry.gauge('requests', 'Requests')
+
+    def test_stage_timer_records_stage(self):
+        """Test that stage_timer observes into the shared stage histogram."""
+        before = STAGE_SECONDS.count(stage='json_parse')
+
+        with stage_timer('json_parse'):
+            pass
+
+        assert STAGE_SECONDS.count(stage='json_parse') == before + 1
+
+
+class TestAppCollector:
+    """Tests for the collector exporting component counters."""
+
+    def test_exports_available_components(self):
+        """Test that retries, breaker states and cache counters are exported, and missing components skipped."""
+        resilience = Resilience()
+        resilience.breaker('gemini')
+        cache = ResponseCache()
+        cache.get('PSU_Install', '1', {'x': 0, 'y': 0, 'z': 1}, 0)
+        app = SimpleNamespace(resilience=resilience, response_cache=cache, workflow=None,
+                              single_flight=None, hedging=None)
+
+        registry = MetricsRegistry()
+        registry.register_collector(app_collector(app))
+        body = registry.render()
+
+        assert 'lucid_circuit_breaker_state{state="closed",upstream="gemini"} 1' in body
+        assert 'lucid_circuit_breaker_state{state="open",upstream="gemini"} 0' in body
+        assert 'lucid_response_cache_misses_total 1' in body
+        assert 'lucid_model_output' not in body
+        assert 'lucid_hedges' not in body
+
+    def test_exposition_parses_with_consistent_counter_names(self):
+        """Test that the exposition is well-formed: declared families, matching sample names, _total counters and cumulative buckets."""
+        resilience = Resilience()
+        resilience.breaker('gemini')
+        cache = ResponseCache()
+        cache.get('PSU_Install', '1', {'x': 0, 'y': 0, 'z': 1}, 0)
+        app = SimpleNamespace(resilience=resilience, response_cache=cache, workflow=None,
+                              single_flight=SimpleNamespace(stats=lambda: {'shared': 2}),
+                              hedging=SimpleNamespace(stats=lambda: {'hedges': 1, 'hedge_wins': 1, 'abandoned': 1}))
+
+        registry = MetricsRegistry()
+        registry.counter('requests', 'Requests', ['endpoint']).inc(endpoint='/assist')
+        registry.histogram('latency_seconds', 'Latency').observe(0.2)
+        registry.register_collector(app_collector(app))
+        body = registry.render()
+
+        families = parse_exposition(body)
+
+        assert families['requests_total']['type'] == 'counter'
+        assert families['requests_total']['samples'] == [('requests_total', {'endpoint': '/assist'}, 1)]
+        assert families['lucid_response_cache_misses_total']['type'] == 'counter'
+        assert families['lucid_hedge_abandoned_calls_total']['samples'][0][2] == 1
+        assert families['latency_seconds']['type'] == 'histogram'
@@ -0,0 +1,79 @@
+"""
+Tests for the prompt template registry.
+"""
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.prompts import PromptRegistry, PromptTemplate, prompt_registry
+
+
+class TestPromptTemplate:
+    """Tests for PromptTemplate."""
+
+    def test_fields_are_extracted(self):
+        """Test that placeholders in the per-request section are found."""
+        template = PromptTemplate('t', 'static', 'Task: {task}\nStep: {step}')
+
+        assert template.fields == {'task', 'step'}
+
+    def test_render_fills_only_the_user_section(self):
+        """Test that render formats the dynamic part and leaves the system text alone."""
+        template = PromptTemplate('t', 'Respond with {"json": true}', 'Task: {task}')
+
+        assert template.render(task='PSU_Install') == 'Task: PSU_Install'
+        assert template.system == 'Respond with {"json": true}'
+
+    def test_values_with_braces_are_not_reformatted(self):
+        """Test that user input containing braces is inserted verbatim."""
+        template = PromptTemplate('t', 'static', 'Q: {question}')
+
+        assert template.render(question='what is {step}?') == 'Q: what is {step}?'
+
+    def test_missing_field_raises(self):
+        """Test that a missing placeholder value is reported by name."""
+        template = PromptTemplate('t', 'static', '{task} {step}')
+
+        with pytest.raises(KeyError, match='step'):
+            template.render(task='x')
+
+    def test_system_hash_identifies_static_prefix(self):
+        """Test that the hash changes only with the system instruction."""
+        a = PromptTemplate('a', 'static', '{x}')
+        b = PromptTemplate('b', 'static', '{y} {z}')
+        c = PromptTemplate('c', 'other', '{x}')
+
+        assert a.system_hash == b.system_hash
+        assert a.system_hash != c.system_hash
+
+
+class TestPromptRegistry:
+    """Tests for PromptRegistry and the built-in prompts."""
+
+    def test_register_and_get(self):
+        """Test that templates are looked up by name."""
+        registry = PromptRegistry()
+        template = registry.register(PromptTemplate('x', 'static', '{a}'))
+
+        assert registry.get('x') is template
+        assert registry.names() == ['x']
+        with pytest.raises(KeyError):
+            registry.get('missing')
+
+    def test_builtin_prompts_compile(self):
+        """Test that the /assist and /ask templates are registered and valid."""
+        hashes = prompt_registry.compile()
+
+        assert set(hashes) == {'assist', 'ask'}
+
+    def test_static_sections_have_no_request_fields(self):
+        """Test that per-request values only appear in the user sections."""
+        assist = prompt_registry.get('assist')
+        ask = prompt_registry.get('ask')
+
+        assert assist.fields == {'task', 'step', 'gaze', 'history'}
+        assert {'question', 'task', 'step'} <= ask.fields
+        assert 'Hands-On Coach' in assist.system
+        assert '"haptic_cue"' in assist.system
+        assert 'Hands-On Coach' in ask.system
@@ -0,0 +1,109 @@
+"""
+Tests for the record-and-replay benchmark runner.
+"""
+import io
+import json
+import random
+import pytest
+from PIL import Image
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import create_app
+from app.utils.capture import CaptureRecorder, load_corpus
+from app.utils.session_store import JSONFileSessionStore
+from app.utils.clients import use_google_backends
+import replay
+
+
+def captured_corpus(directory):
+    """Write a small corpus: one /assist snapshot and one /ask question for the same session"""
+    img_bytes = io.BytesIO()
+    Image.new('RGB', (64, 64), color='blue').save(img_bytes, format='JPEG')
+    recorder = CaptureRecorder(directory)
+    recorder.record('/assist', {
+        'task_step': ['1'], 'current_task': ['PSU_Install'],
+        'gaze_vector': [json.dumps({"x": 0.0, "y": 0.0, "z": 1.0})], 'session_id': ['replay-session']
+    }, {'snapshot': [{'filename': 'f.jpg', 'content_type': 'image/jpeg', 'data': img_bytes.getvalue()}]},
+        None, {}, 200, 20)
+    recorder.record('/ask', {}, {}, {'session_id': 'replay-session', 'question': 'Which cable?'}, {}, 200, 10)
+    return load_corpus(directory)
+
+
+class TestPercentiles:
+    """Tests for percentile and summarize"""
+    
+    def test_nearest_rank(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        
+        assert replay.percentile(values, 50) == 50
+        assert replay.percentile(values, 95) == 95
+        assert replay.percentile(values, 99) == 99
+        assert replay.percentile([], 50) == 0.0
+    
+    def test_summarize_in_milliseconds(self):
+        """Test that summaries convert seconds to milliseconds"""
+        summary = replay.summarize([0.1, 0.2, 0.3])
+        
+        assert summary['count'] == 3
+        assert summary['p50_ms'] == 200.0
+        assert summary['max_ms'] == 300.0
+
+
+class TestReplay:
+    """Tests for replaying a corpus against the app"""
+    
+    def test_latency_sampler_recorded(self):
+        """Test that recorded durations are replayed, scaled"""
+        rng = random.Random(0)
+        
+        assert replay.LatencySampler.from_spec('recorded', [0.2], scale=0.5)(rng) == 0.1
+        assert replay.LatencySampler.from_spec('0.3', [0.2])(rng) == 0.3
+    
+    def test_corpus_replayed_with_stubbed_model(self, tmp_path):
+        """Test that captured requests succeed against the fakes and are reported per endpoint and stage"""
+        corpus = captured_corpus(str(tmp_path / 'corpus'))
+        app = create_app()
+        app.config['API_KEY'] = 'test-api-key'
+        app.response_cache = None
+        app.session_store = app.workflow.session_store = JSONFileSessionStore(str(tmp_path / 'contexts'))
+        
+        try:
+            timings = replay.install_fakes(corpus, model_latency='0', stt_latency='0')
+            replay.seed_sessions(app, corpus)
+            results = replay.run_replay(app, corpus, concurrency=1, total_requests=6)
+        finally:
+            use_google_backends()
+        
+        report = replay.build_report(results, timings)
+        
+        assert report['requests'] == 6
+        assert report['endpoints']['/assist']['statuses'] == {'200': 3}
+        assert report['endpoints']['/ask']['statuses'] == {'200': 3}
+        assert report['stages']['assist_model']['count'] == 3
+        assert report['stages']['ask_model']['count'] == 3
+    
+    def test_raw_body_entry_resent_as_raw_body(self, tmp_path):
+        """Test that a captured raw snapshot upload is replayed with its body, headers and query string"""
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (64, 64), color='blue').save(img_bytes, format='JPEG')
+        recorder = CaptureRecorder(str(tmp_path / 'corpus'))
+        recorder.record('/assist', {}, {}, None,
+                        {'Content-Type': 'image/jpeg', 'X-Task-Step': '1', 'X-Current-Task': 'PSU_Install'},
+                        200, 20, query={'gaze': ['0,0,1'], 'session_id': ['raw-replay']}, body=img_bytes.getvalue())
+        [entry] = load_corpus(str(tmp_path / 'corpus'))
+        app = create_app()
+        app.config['API_KEY'] = 'test-api-key'
+        app.response_cache = None
+        app.session_store = app.workflow.session_store = JSONFileSessionStore(str(tmp_path / 'contexts'))
+        
+        try:
+            replay.install_fakes([entry], model_latency='0')
+            response = replay.send(app.test_client(), entry, 'test-api-key')
+        finally:
+            use_google_backends()
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['session_id'] == 'raw-replay'
@@ -0,0 +1,326 @@
+"""
+Tests for circuit breakers, backoff and the retry budget.
+"""
+import asyncio
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.deadline import Deadline, DeadlineExceeded
+from app.utils.resilience import (
+    CircuitBreaker, CircuitOpenError, Resilience, RetryBudget, backoff_delay, is_retryable
+)
+
+
+class StatusError(Exception):
+    """Stand-in for google.api_core errors, which expose the HTTP status as .code."""
+
+    def __init__(self, code, message='upstream error'):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def no_sleep(delay):
+    pass
+
+
+class TestIsRetryable:
+    """Tests for is_retryable."""
+
+    @pytest.mark.parametrize('code', [429, 503, 504])
+    def test_transient_status_codes(self, code):
+        """Test that rate limiting, unavailability and deadlines are retryable."""
+        assert is_retryable(StatusError(code))
+
+    @pytest.mark.parametrize('code', [400, 401, 403, 404, 500])
+    def test_other_status_codes(self, code):
+        """Test that client errors are not retried."""
+        assert not is_retryable(StatusError(code))
+
+    def test_timeout(self):
+        """Test that timeouts are retryable."""
+        assert is_retryable(asyncio.TimeoutError())
+
+    def test_wrapped_cause(self):
+        """Test that a retryable cause makes a wrapping error retryable."""
+        try:
+            try:
+                raise StatusError(429)
+            except StatusError as e:
+                raise RuntimeError('generation failed') from e
+        except RuntimeError as e:
+            assert is_retryable(e)
+
+    def test_grpc_status_in_message(self):
+        """Test that gRPC status names in the message are recognised."""
+        assert is_retryable(Exception('503 UNAVAILABLE: connection reset'))
+        assert not is_retryable(Exception('API key not valid'))
+
+
+class TestBackoffDelay:
+    """Tests for backoff_delay."""
+
+    def test_delay_grows_and_is_capped(self):
+        """Test that the jitter range doubles per attempt up to max_delay."""
+        upper = lambda low, high: high
+
+        assert backoff_delay(0, 0.5, 8.0, rng=upper) == 0.5
+        assert backoff_delay(2, 0.5, 8.0, rng=upper) == 2.0
+        assert backoff_delay(10, 0.5, 8.0, rng=upper) == 8.0
+
+    def test_delay_is_jittered(self):
+        """Test that delays fall within [0, cap]."""
+        delays = [backoff_delay(3, 0.5, 8.0) for _ in range(50)]
+
+        assert all(0 <= delay <= 4.0 for delay in delays)
+        assert len(set(delays)) > 1
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker."""
+
+    def test_opens_after_threshold(self):
+        """Test that consecutive failures open the circuit."""
+        breaker = CircuitBreaker('gemini', failure_threshold=3, clock=FakeClock())
+
+        for _ in range(2):
+            breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+    def test_success_resets_failures(self):
+        """Test that a success in between keeps the circuit closed."""
+        breaker = CircuitBreaker('gemini', failure_threshold=2, clock=FakeClock())
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_trial_closes_on_success(self):
+        """Test that one trial call is allowed after recovery and closes the circuit."""
+        clock = FakeClock()
+        breaker = CircuitBreaker('gemini', failure_threshold=1, recovery_seconds=30, clock=clock)
+        breaker.record_failure()
+
+        clock.now = 29
+        assert breaker.retry_after() == pytest.approx(1)
+        assert not breaker.allow()
+
+        clock.now = 30
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()  # only one trial at a time
+
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_failure_reopens(self):
+        """Test that a failed trial call opens the circuit again."""
+        clock = FakeClock()
+        breaker = CircuitBreaker('gemini', failure_threshold=1, recovery_seconds=30, clock=clock)
+        breaker.record_failure()
+        clock.now = 30
+        breaker.allow()
+
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.retry_after() == pytest.approx(30)
+
+
+class TestRetryBudget:
+    """Tests for RetryBudget."""
+
+    def test_budget_scales_with_requests(self):
+        """Test that retries are limited to min_retries + ratio * requests."""
+        budget = RetryBudget(ratio=0.5, min_retries=1, clock=FakeClock())
+        for _ in range(4):
+            budget.record_request()
+
+        spent = sum(budget.try_spend() for _ in range(10))
+
+        assert spent == 3
+
+    def test_budget_refills_after_window(self):
+        """Test that old retries leave the window."""
+        clock = FakeClock()
+        budget = RetryBudget(ratio=0, min_retries=1, window_seconds=10, clock=clock)
+
+        assert budget.try_spend()
+        assert not budget.try_spend()
+
+        clock.now = 11
+        assert budget.try_spend()
+
+
+class TestResilience:
+    """Tests for Resilience.call."""
+
+    def test_retries_transient_errors(self):
+        """Test that a 503 is retried with backoff and the result returned."""
+        delays = []
+        resilience = Resilience(max_attempts=3, sleep=delays.append)
+        outcomes = iter([StatusError(503), StatusError(429), 'ok'])
+
+        def fn():
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        assert resilience.call('gemini', fn) == 'ok'
+        assert len(delays) == 2
+        assert resilience.retry_counts() == {'gemini': 2}
+
+    def test_does_not_retry_client_errors(self):
+        """Test that a non-retryable error is raised after one attempt."""
+        calls = []
+        resilience = Resilience(max_attempts=3, sleep=no_sleep)
+
+        def fn():
+            calls.append(1)
+            raise StatusError(400)
+
+        with pytest.raises(StatusError):
+            resilience.call('gemini', fn)
+        assert len(calls) == 1
+        assert resilience.stats() == {'gemini': 'closed'}
+
+    def test_gives_up_after_max_attempts(self):
+        """Test that the last retryable error is raised."""
+        resilience = Resilience(max_attempts=2, sleep=no_sleep)
+
+        def fn():
+            raise StatusError(503)
+
+        with pytest.raises(StatusError):
+            resilience.call('gemini', fn)
+
+    def test_retry_budget_stops_retries(self):
+        """Test that an exhausted budget raises instead of retrying."""
+        calls = []
+        resilience = Resilience(max_attempts=3, retry_budget_ratio=0, retry_budget_min=0, sleep=no_sleep)
+
+        def fn():
+            calls.append(1)
+            raise StatusError(503)
+
+        with pytest.raises(StatusError):
+            resilience.call('gemini', fn)
+        assert len(calls) == 1
+        assert resilience.retry_counts() == {}
+
+    def test_open_circuit_fails_fast(self):
+        """Test that once the circuit opens, calls fail without reaching the upstream."""
+        calls = []
+        resilience = Resilience(max_attempts=1, failure_threshold=2, recovery_seconds=30, sleep=no_sleep)
+
+        def fn():
+            calls.append(1)
+            raise StatusError(503)
+
+        for _ in range(2):
+            with pytest.raises(StatusError):
+                resilience.call('gemini', fn)
+
+        with pytest.raises(CircuitOpenError) as exc_info:
+            resilience.call('gemini', fn)
+
+        assert len(calls) == 2
+        assert exc_info.value.retry_after > 0
+        assert resilience.stats() == {'gemini': 'open'}
+
+    def test_breakers_are_per_upstream(self):
+        """Test that one upstream's failures do not open another's circuit."""
+        resilience = Resilience(max_attempts=1, failure_threshold=1, sleep=no_sleep)
+
+        def fail():
+            raise StatusError(503)
+
+        with pytest.raises(StatusError):
+            resilience.call('gemini-2.5-flash', fail)
+
+        assert resilience.call('gemini-2.5-pro', lambda: 'ok') == 'ok'
+
+    def test_guard_and_record_outcome(self):
+        """Test the breaker check used for streamed calls."""
+        resilience = Resilience(failure_threshold=1)
+
+        resilience.guard('gemini')
+        resilience.record_outcome('gemini', StatusError(503))
+
+        with pytest.raises(CircuitOpenError):
+            resilience.guard('gemini')
+
+    def test_interrupted_half_open_trial_returns_its_slot(self):
+        """Test that a trial call ended without an outcome does not leave the circuit stuck half-open."""
+        resilience = Resilience(failure_threshold=1, recovery_seconds=0)
+        resilience.breaker('gemini').record_failure()
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            resilience.call('gemini', interrupted)
+
+        breaker = resilience.breaker('gemini')
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+    def test_release_guarded_call(self):
+        """Test that a guarded call ended without an outcome gives back its trial slot."""
+        resilience = Resilience(failure_threshold=1, recovery_seconds=0)
+        resilience.breaker('gemini').record_failure()
+
+        resilience.guard('gemini')
+        resilience.release('gemini')
+
+        resilience.guard('gemini')
+
+    def test_spent_client_deadline_is_not_an_upstream_failure(self):
+        """Test that RPC timeouts from a client's own deadline raise DeadlineExceeded and leave the breaker closed."""
+        resilience = Resilience(failure_threshold=3, sleep=lambda delay: None)
+        calls = []
+
+        def timed_out():
+            calls.append(1)
+            raise StatusError(504, '504 DEADLINE_EXCEEDED')
+
+        for _ in range(3):
+            with pytest.raises(DeadlineExceeded):
+                resilience.call('gemini', timed_out, Deadline(0))
+            resilience.guard('gemini')
+            with pytest.raises(DeadlineExceeded):
+                resilience.record_outcome('gemini', StatusError(504), Deadline(0))
+
+        assert len(calls) == 3  # never retried
+        assert resilience.stats() == {'gemini': CircuitBreaker.CLOSED}
+        assert resilience.retry_counts() == {}
+
+    def test_timeout_within_deadline_is_an_upstream_failure(self):
+        """Test that an upstream timeout with time still left counts against the breaker."""
+        resilience = Resilience(failure_threshold=1, max_attempts=1)
+
+        def timed_out():
+            raise StatusError(504, '504 DEADLINE_EXCEEDED')
+
+        with pytest.raises(StatusError):
+            resilience.call('gemini', timed_out, Deadline(30))
+
+        assert resilience.stats() == {'gemini': CircuitBreaker.OPEN}
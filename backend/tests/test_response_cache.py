@@ -0,0 +1,126 @@
+"""
+Tests for the perceptual-hash response cache.
+"""
+import io
+import pytest
+from unittest.mock import patch
+from PIL import Image, ImageDraw
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.image_processing import ingest_image_data
+from app.utils.response_cache import ResponseCache, image_hash, hamming_distance, quantize_gaze
+
+
+GAZE = {"x": 0.5, "y": -0.2, "z": 0.8}
+RESULT = {
+    'image_analysis': 'Open PSU bay',
+    'instruction_text': ['Insert the PSU'],
+    'target_id': 'psu_bay',
+    'haptic_cue': 'guide_to_target',
+    'messages': ['not cached']
+}
+
+
+def make_scene(box_color='blue', offset=0, quality=90):
+    """Create a JPEG with a gradient background and a box."""
+    img = Image.new('RGB', (320, 240))
+    for x in range(320):
+        ImageDraw.Draw(img).line([(x, 0), (x, 239)], fill=(x * 255 // 320, 80, 120))
+    ImageDraw.Draw(img).rectangle([100 + offset, 60, 220 + offset, 180], fill=box_color)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def scene_hash(data):
+    """Hash an encoded frame the way /assist does: ingest it, then hash the decoded image."""
+    is_valid, snapshot, error = ingest_image_data(data)
+    assert is_valid, error
+    return image_hash(snapshot.image)
+
+
+class TestPerceptualHash:
+    """Tests for the hashing helpers."""
+
+    def test_recompressed_frame_is_near_duplicate(self):
+        """Test that JPEG noise barely changes the hash."""
+        distance = hamming_distance(scene_hash(make_scene(quality=95)), scene_hash(make_scene(quality=60)))
+        assert distance <= 6
+
+    def test_different_scene_is_far_apart(self):
+        """Test that a different scene produces a distant hash."""
+        flipped = Image.open(io.BytesIO(make_scene())).transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        buffer = io.BytesIO()
+        flipped.save(buffer, format='JPEG')
+
+        assert hamming_distance(scene_hash(make_scene()), scene_hash(buffer.getvalue())) > 6
+
+    def test_quantize_gaze(self):
+        """Test that small gaze changes map to the same grid cell."""
+        assert quantize_gaze(GAZE, 0.1) == quantize_gaze({"x": 0.52, "y": -0.18, "z": 0.79}, 0.1)
+        assert quantize_gaze(GAZE, 0.1) != quantize_gaze({"x": 0.9, "y": -0.2, "z": 0.8}, 0.1)
+
+
+class TestResponseCache:
+    """Tests for ResponseCache lookups and eviction."""
+
+    def test_hit_for_near_duplicate(self):
+        """Test that a near-identical frame is answered from the cache."""
+        cache = ResponseCache()
+        cache.put('PSU_Install', '4', GAZE, scene_hash(make_scene(quality=95)), RESULT)
+
+        cached = cache.get('PSU_Install', '4', GAZE, scene_hash(make_scene(quality=60)))
+
+        assert cached['instruction_text'] == ['Insert the PSU']
+        assert 'messages' not in cached
+        assert cache.stats() == {'hits': 1, 'misses': 0, 'size': 1}
+
+    def test_miss_for_different_step(self):
+        """Test that task_step is part of the key."""
+        cache = ResponseCache()
+        frame_hash = scene_hash(make_scene())
+        cache.put('PSU_Install', '4', GAZE, frame_hash, RESULT)
+
+        assert cache.get('PSU_Install', '5', GAZE, frame_hash) is None
+        assert cache.stats()['misses'] == 1
+
+    def test_miss_for_different_session(self):
+        """Test that session_id is part of the key, since answers depend on the session's history."""
+        cache = ResponseCache()
+        cache.put('PSU_Install', '4', GAZE, 1, RESULT, session_id='session-a')
+
+        assert cache.get('PSU_Install', '4', GAZE, 1, session_id='session-b') is None
+        assert cache.get('PSU_Install', '4', GAZE, 1, session_id='session-a') is not None
+
+    def test_returned_result_is_a_copy(self):
+        """Test that callers cannot mutate the cached entry."""
+        cache = ResponseCache()
+        cache.put('PSU_Install', '4', GAZE, 1, RESULT)
+
+        cache.get('PSU_Install', '4', GAZE, 1)['instruction_text'].append('mutated')
+
+        assert cache.get('PSU_Install', '4', GAZE, 1)['instruction_text'] == ['Insert the PSU']
+
+    def test_ttl_expiry(self):
+        """Test that expired entries are treated as misses and removed."""
+        cache = ResponseCache(ttl_seconds=10)
+        with patch('app.utils.response_cache.time.monotonic', return_value=100.0):
+            cache.put('PSU_Install', '4', GAZE, 1, RESULT)
+        with patch('app.utils.response_cache.time.monotonic', return_value=111.0):
+            assert cache.get('PSU_Install', '4', GAZE, 1) is None
+
+        assert cache.stats()['size'] == 0
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        cache = ResponseCache(max_entries=2, hamming_threshold=0)
+        cache.put('task', '1', GAZE, 1, RESULT)
+        cache.put('task', '2', GAZE, 2, RESULT)
+        cache.get('task', '1', GAZE, 1)
+        cache.put('task', '3', GAZE, 3, RESULT)
+
+        assert cache.get('task', '1', GAZE, 1) is not None
+        assert cache.get('task', '2', GAZE, 2) is None
+        assert cache.get('task', '3', GAZE, 3) is not None
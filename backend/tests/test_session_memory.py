@@ -0,0 +1,79 @@
+"""
+Tests for bounded per-session memory.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.session_memory import SessionMemory, NO_HISTORY
+
+
+def record_steps(memory, steps, task='PSU_Install'):
+    """Record one entry per step and return the resulting (recent, summary, summarized_steps)."""
+    recent, summary, summarized = [], '', 0
+    for step in steps:
+        entry = memory.entry(task, step, f'Analysis of step {step}', [f'Do step {step}', 'Then more'], f'part_{step}')
+        recent, summary, summarized = memory.record(recent, summary, summarized, entry)
+    return recent, summary, summarized
+
+
+class TestSessionMemory:
+    """Tests for SessionMemory."""
+
+    def test_ring_buffer_keeps_newest_steps(self):
+        """Test that only the newest max_recent steps are kept in full."""
+        recent, summary, summarized = record_steps(SessionMemory(max_recent=3), ['1', '2', '3', '4', '5'])
+
+        assert [entry['step'] for entry in recent] == ['3', '4', '5']
+        assert summarized == 2
+        assert summary == '- PSU_Install step 1: Do step 1\n- PSU_Install step 2: Do step 2'
+
+    def test_summary_stays_bounded(self):
+        """Test that the summary drops its oldest lines instead of growing with the session."""
+        memory = SessionMemory(max_recent=2, max_summary_chars=120)
+        recent, summary, summarized = record_steps(memory, [str(step) for step in range(1, 41)])
+
+        assert len(summary) <= 120
+        assert summary.endswith('- PSU_Install step 38: Do step 38')
+        assert summarized == 38
+        assert len(memory.render(recent, summary, summarized)) < 600
+
+    def test_repeated_steps_are_counted(self):
+        """Test that a step visited several times becomes one summary line with a count."""
+        _, summary, _ = record_steps(SessionMemory(max_recent=1), ['1', '2', '2', '2', '3'])
+
+        assert summary == '- PSU_Install step 1: Do step 1\n- PSU_Install step 2 (3x): Do step 2'
+
+    def test_repeated_step_replaces_last_entry(self):
+        """Test that repeating the latest step (a retry or cache hit) replaces it instead of filling the buffer."""
+        memory = SessionMemory(max_recent=3)
+        recent, summary, summarized = record_steps(memory, ['1', '2', '2', '2'])
+
+        assert [entry['step'] for entry in recent] == ['1', '2']
+        assert recent[-1]['visits'] == 3
+        assert (summary, summarized) == ('', 0)
+
+        other_task = memory.entry('RAM_Install', '2', 'RAM slots', ['Seat the RAM'], 'ram_slot')
+        recent, _, _ = memory.record(recent, summary, summarized, other_task)
+        assert [(entry['task'], entry['step']) for entry in recent] == [
+            ('PSU_Install', '1'), ('PSU_Install', '2'), ('RAM_Install', '2')
+        ]
+
+    def test_round_trips_through_the_session_context(self):
+        """Test that memory saved with a context is read back, and older contexts have none."""
+        memory = SessionMemory(max_recent=2)
+        state = record_steps(memory, ['1', '2', '3'])
+
+        assert memory.from_context({'memory': memory.to_context(*state)}) == state
+        assert memory.from_context({'task': 'PSU_Install', 'step': '1'}) == ([], '', 0)
+        assert memory.from_context(None) == ([], '', 0)
+
+    def test_render(self):
+        """Test that the rendered history lists the summary, then the recent steps with their targets."""
+        memory = SessionMemory(max_recent=1)
+        text = memory.render(*record_steps(memory, ['1', '2']))
+
+        assert text.index('- PSU_Install step 1') < text.index('1. PSU_Install step 2')
+        assert '"Do step 2"' in text
+        assert '(target part_2)' in text
+        assert memory.render([], '') == NO_HISTORY
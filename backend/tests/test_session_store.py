@@ -0,0 +1,256 @@
+"""
+Tests for session context storage backends.
+"""
+import json
+import sqlite3
+import threading
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.session import load_session_context
+from app.utils.session_store import (
+    SessionStore, JSONFileSessionStore, SQLiteSessionStore, CachedSessionStore, create_session_store
+)
+
+
+SAMPLE_CONTEXT = {
+    "session_id": "session-1",
+    "timestamp": "2025-11-15T10:30:00",
+    "task": "PSU_Install",
+    "step": "4",
+    "gaze_vector": {"x": 0.5, "y": -0.2, "z": 0.8},
+    "image_analysis": "Server chassis",
+    "instruction": {"steps": ["Plug in the cable"], "target_id": "J_PWR_1", "haptic_cue": "none"}
+}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    """Each storage backend, uncached."""
+    return create_session_store(request.param, context_dir=str(tmp_path), cache_entries=0)
+
+
+class TestSessionStores:
+    """Behaviour shared by all backends."""
+
+    def test_round_trip(self, store):
+        """Test that a saved context loads back unchanged."""
+        store.save("session-1", SAMPLE_CONTEXT)
+
+        assert store.load("session-1") == SAMPLE_CONTEXT
+
+    def test_missing_session_returns_none(self, store):
+        """Test that unknown sessions load as None."""
+        assert store.load("nope") is None
+
+    def test_save_replaces_context(self, store):
+        """Test that saving again overwrites the previous context."""
+        store.save("session-1", SAMPLE_CONTEXT)
+        store.save("session-1", dict(SAMPLE_CONTEXT, step="5"))
+
+        assert store.load("session-1")["step"] == "5"
+
+    def test_interface_cannot_be_instantiated(self):
+        """Test that a store missing an operation fails at construction."""
+        with pytest.raises(TypeError):
+            SessionStore()
+
+
+class TestJSONFileSessionStore:
+    """Tests for the JSON file backend."""
+
+    def test_file_format_is_unchanged(self, tmp_path):
+        """Test that sessions are stored as {context_dir}/{session_id}.json."""
+        JSONFileSessionStore(str(tmp_path / "contexts")).save("session-1", SAMPLE_CONTEXT)
+
+        with open(tmp_path / "contexts" / "session-1.json") as f:
+            assert json.load(f) == SAMPLE_CONTEXT
+
+    def test_invalid_json_raises_value_error(self, tmp_path):
+        """Test that a corrupt file is reported as ValueError."""
+        (tmp_path / "session-1.json").write_text("{not json")
+
+        with pytest.raises(ValueError):
+            JSONFileSessionStore(str(tmp_path)).load("session-1")
+
+    def test_failed_save_keeps_previous_context(self, tmp_path):
+        """Test that a write that fails midway leaves the old file and no temp files."""
+        store = JSONFileSessionStore(str(tmp_path))
+        store.save("session-1", SAMPLE_CONTEXT)
+
+        with pytest.raises(TypeError):
+            store.save("session-1", dict(SAMPLE_CONTEXT, step=object()))
+
+        assert store.load("session-1") == SAMPLE_CONTEXT
+        assert os.listdir(tmp_path) == ["session-1.json"]
+
+
+class TestSQLiteSessionStore:
+    """Tests for the SQLite backend."""
+
+    def test_uses_wal_mode(self, tmp_path):
+        """Test that the database is switched to WAL journaling."""
+        db_path = str(tmp_path / "sessions.db")
+        SQLiteSessionStore(db_path)
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_concurrent_writers(self, tmp_path):
+        """Test that threads can save different sessions concurrently."""
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+        def worker(index):
+            store.save(f"session-{index}", dict(SAMPLE_CONTEXT, session_id=f"session-{index}"))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(store.load(f"session-{i}")["session_id"] == f"session-{i}" for i in range(8))
+
+    def test_connections_reused_across_threads(self, tmp_path):
+        """Test that requests on new threads reuse pooled connections instead of opening their own."""
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), pool_size=2)
+        store.save("session-1", SAMPLE_CONTEXT)
+        with store._connection() as conn:
+            pooled = conn
+
+        loaded = []
+        for _ in range(4):
+            thread = threading.Thread(target=lambda: loaded.append(store.load("session-1")))
+            thread.start()
+            thread.join()
+
+        assert loaded == [SAMPLE_CONTEXT] * 4
+        with store._connection() as conn:
+            assert conn is pooled
+
+
+class TestCachedSessionStore:
+    """Tests for the LRU read-through cache."""
+
+    def test_reads_are_served_from_memory(self, tmp_path):
+        """Test that a cached session does not hit the backend again."""
+        backend = JSONFileSessionStore(str(tmp_path))
+        backend.save("session-1", SAMPLE_CONTEXT)
+        store = CachedSessionStore(backend)
+
+        store.load("session-1")
+        os.remove(tmp_path / "session-1.json")
+
+        assert store.load("session-1") == SAMPLE_CONTEXT
+
+    def test_returned_context_is_a_copy(self, tmp_path):
+        """Test that mutating a loaded context does not change the cache."""
+        store = CachedSessionStore(JSONFileSessionStore(str(tmp_path)))
+        store.save("session-1", SAMPLE_CONTEXT)
+
+        store.load("session-1")["task"] = "changed"
+
+        assert store.load("session-1")["task"] == "PSU_Install"
+
+    def test_least_recently_used_is_evicted(self, tmp_path):
+        """Test that the cache is bounded."""
+        store = CachedSessionStore(JSONFileSessionStore(str(tmp_path)), max_entries=2)
+        for session_id in ("a", "b", "c"):
+            store.save(session_id, dict(SAMPLE_CONTEXT, session_id=session_id))
+
+        assert list(store._entries) == ["b", "c"]
+
+
+class TestLoadSessionContext:
+    """Tests for load_session_context."""
+
+    def test_loads_from_store(self, tmp_path):
+        """Test that load_session_context reads through the given store."""
+        store = create_session_store("sqlite", context_dir=str(tmp_path))
+        store.save("session-1", SAMPLE_CONTEXT)
+
+        assert load_session_context("session-1", store=store) == SAMPLE_CONTEXT
+
+    def test_missing_fields_raise_value_error(self, tmp_path):
+        """Test that incomplete contexts are rejected."""
+        store = JSONFileSessionStore(str(tmp_path))
+        store.save("session-1", {"session_id": "session-1"})
+
+        with pytest.raises(ValueError, match="missing required fields"):
+            load_session_context("session-1", store=store)
+
+    def test_defaults_to_json_files_in_context_dir(self, tmp_path):
+        """Test the backward compatible context_dir argument."""
+        JSONFileSessionStore(str(tmp_path)).save("session-1", SAMPLE_CONTEXT)
+
+        assert load_session_context("session-1", str(tmp_path)) == SAMPLE_CONTEXT
+
+
+class TestFollowUpLog:
+    """Tests for the append-only follow-up log."""
+
+    def test_tail_returns_newest_in_order(self, store):
+        """Test that recent_follow_ups returns the last entries, oldest first."""
+        for i in range(5):
+            store.append_follow_up("session-1", {"question": f"q{i}"})
+
+        assert [e["question"] for e in store.recent_follow_ups("session-1", 3)] == ["q2", "q3", "q4"]
+
+    def test_unknown_session_has_no_follow_ups(self, store):
+        """Test that a session without follow-ups returns an empty tail."""
+        assert store.recent_follow_ups("nope", 5) == []
+
+    def test_appending_does_not_rewrite_context(self, tmp_path):
+        """Test that follow-ups leave the session's context file untouched."""
+        store = JSONFileSessionStore(str(tmp_path))
+        store.save("session-1", SAMPLE_CONTEXT)
+        before = os.stat(tmp_path / "session-1.json").st_mtime_ns
+
+        store.append_follow_up("session-1", {"question": "q"})
+
+        assert os.stat(tmp_path / "session-1.json").st_mtime_ns == before
+        assert (tmp_path / "session-1.followups.jsonl").read_text().count("\n") == 1
+
+    def test_compaction_archives_older_entries(self, tmp_path):
+        """Test that the live log is trimmed to keep_recent once it reaches compact_at."""
+        store = JSONFileSessionStore(str(tmp_path), compact_at=10, keep_recent=3)
+        for i in range(12):
+            store.append_follow_up("session-1", {"question": f"q{i}"})
+
+        live = (tmp_path / "session-1.followups.jsonl").read_text().splitlines()
+        archive = (tmp_path / "session-1.followups.archive.jsonl").read_text().splitlines()
+
+        assert len(live) == 5
+        assert len(archive) == 7
+        assert [e["question"] for e in store.recent_follow_ups("session-1", 2)] == ["q10", "q11"]
+
+    def test_tail_of_large_log_reads_across_blocks(self, tmp_path):
+        """Test that tail reads stitch lines that span read blocks."""
+        store = JSONFileSessionStore(str(tmp_path), compact_at=10000)
+        for i in range(300):
+            store.append_follow_up("session-1", {"question": f"q{i}", "pad": "x" * 50})
+
+        assert [e["question"] for e in store.recent_follow_ups("session-1", 100)] == [f"q{i}" for i in range(200, 300)]
+
+    def test_line_counts_are_bounded(self, tmp_path):
+        """Test that only tracked_logs sessions keep an in-memory line count."""
+        store = JSONFileSessionStore(str(tmp_path), tracked_logs=2)
+        for session_id in ["a", "b", "c", "a"]:
+            store.append_follow_up(session_id, {"question": session_id})
+
+        assert list(store._log_lines) == ["c", "a"]
+        assert store._log_lines["a"] == 2
+
+    def test_compaction_drops_line_count(self, tmp_path):
+        """Test that a compacted log is recounted from disk on the next append."""
+        store = JSONFileSessionStore(str(tmp_path), compact_at=4, keep_recent=2)
+        for i in range(4):
+            store.append_follow_up("session-1", {"question": f"q{i}"})
+
+        assert "session-1" not in store._log_lines
+
+        store.append_follow_up("session-1", {"question": "q4"})
+
+        assert store._log_lines["session-1"] == 3
@@ -0,0 +1,104 @@
+"""
+Tests for single-flight request coalescing.
+"""
+import threading
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.singleflight import SingleFlight, coalesce, content_hash
+
+
+def run_in_threads(count, fn):
+    """Run fn() in `count` threads, like concurrent request threads."""
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    return results, errors
+
+
+class TestSingleFlight:
+    """Tests for SingleFlight."""
+
+    def test_concurrent_duplicates_share_one_call(self):
+        """Test that callers on different threads share the leader's result."""
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            release.wait()
+            return {'answer': 42}
+
+        def request():
+            return flight.do(('session', '/assist', 'abc'), work)
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, errors = run_in_threads(4, request)
+
+        assert errors == [None] * 4
+        assert len(calls) == 1
+        assert all(result == {'answer': 42} for result, _ in results)
+        assert sorted(shared for _, shared in results) == [False, True, True, True]
+        assert flight.stats() == {'leaders': 1, 'shared': 3, 'in_flight': 0}
+
+    def test_exception_is_shared(self):
+        """Test that followers receive the leader's exception."""
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def work():
+            release.wait()
+            raise ValueError('upstream failed')
+
+        def request():
+            return flight.do('key', work)
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        _, errors = run_in_threads(3, request)
+
+        assert all(isinstance(e, ValueError) for e in errors)
+
+    def test_key_released_after_completion(self):
+        """Test that sequential calls with the same key each run."""
+        flight = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            return len(calls)
+
+        assert flight.do('key', work) == (1, False)
+        assert flight.do('key', work) == (2, False)
+
+    def test_coalesce_without_flight_runs_directly(self):
+        """Test that coalescing can be disabled."""
+        assert coalesce(None, 'key', lambda: 'done') == ('done', False)
+
+
+class TestContentHash:
+    """Tests for content_hash."""
+
+    def test_part_boundaries_matter(self):
+        """Test that moving bytes between parts changes the hash."""
+        assert content_hash('ab', 'c') != content_hash('a', 'bc')
+
+    def test_str_and_bytes_are_equivalent(self):
+        """Test that text and its UTF-8 bytes hash the same."""
+        assert content_hash('step 4', None) == content_hash(b'step 4', b'')
@@ -5,6 +5,15 @@ import pytest
 from unittest.mock import patch, MagicMock
 from google.cloud import speech
 from app.utils.speech_to_text import transcribe_audio, get_encoding_from_content_type
+from app.utils.clients import reset_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    """Drop the shared Speech client so each test sees its own mock."""
+    reset_clients()
+    yield
+    reset_clients()
 
 
 class TestGetEncodingFromContentType:
@@ -281,3 +290,17 @@ class TestTranscribeAudio:
         assert success
         assert text == "Bonjour."
         assert error == ""
+    
+    @patch('app.utils.speech_to_text.speech.SpeechClient')
+    def test_transcribe_audio_timeout_bounds_rpc(self, mock_speech_client):
+        """Test that the request's remaining deadline is passed as the RPC timeout."""
+        mock_client = MagicMock()
+        mock_client.recognize.return_value = MagicMock(results=[])
+        mock_speech_client.return_value = mock_client
+        
+        transcribe_audio(b'fake audio data', 'audio/wav', timeout=2.5)
+        transcribe_audio(b'fake audio data', 'audio/wav')
+        
+        first, second = mock_client.recognize.call_args_list
+        assert first.kwargs['timeout'] == 2.5
+        assert 'timeout' not in second.kwargs
@@ -0,0 +1,186 @@
+"""
+Tests for request tracing.
+"""
+import asyncio
+import json
+import pytest
+import sys
+import os
+from flask import Flask
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.tracing import (
+    BatchSpanProcessor, FileSpanExporter, Tracer, configure_tracing, install_tracing, parse_traceparent,
+    traced, tracer, SPAN_KIND_SERVER, STATUS_ERROR
+)
+from app.utils.clients import use_fake_backends, use_google_backends
+from app.utils.fakes import FaultInjector
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class ListExporter:
+    """Keeps exported OTLP payloads in memory."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def export(self, payload):
+        self.payloads.append(payload)
+
+    def spans(self):
+        return [
+            span
+            for payload in self.payloads
+            for resource in payload['resourceSpans']
+            for scope in resource['scopeSpans']
+            for span in scope['spans']
+        ]
+
+
+@pytest.fixture
+def exporter():
+    """Turn tracing on for one test, exporting to memory."""
+    exporter = ListExporter()
+    processor = configure_tracing(BatchSpanProcessor(exporter, flush_interval_seconds=60)).processor
+    exporter.flush = processor.flush
+    yield exporter
+    configure_tracing(None)
+
+
+class TestTraceparent:
+    """Tests for parse_traceparent."""
+
+    def test_valid_header(self):
+        """Test that trace ID, parent span ID and the sampled flag are extracted."""
+        assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01') == (TRACE_ID, PARENT_ID, True)
+
+    @pytest.mark.parametrize('value', [
+        None, '', 'garbage', f'ff-{TRACE_ID}-{PARENT_ID}-01',
+        f'00-{"0" * 32}-{PARENT_ID}-01', f'00-{TRACE_ID}-{"0" * 16}-01'
+    ])
+    def test_invalid_headers(self, value):
+        """Test that malformed or all-zero headers start a new trace instead."""
+        assert parse_traceparent(value) is None
+
+
+class TestTracer:
+    """Tests for span creation, nesting and export."""
+
+    def test_disabled_tracer_yields_none(self):
+        """Test that without a processor spans cost nothing and are not recorded."""
+        with Tracer().span('noop') as span:
+            assert span is None
+
+    def test_nested_spans_share_the_trace(self, exporter):
+        """Test that a child span links to its parent and the OTLP shape is complete."""
+        with tracer.span('parent', attributes={'session.id': 's1'}) as parent:
+            with tracer.span('child') as child:
+                pass
+        exporter.flush()
+
+        spans = {span['name']: span for span in exporter.spans()}
+        assert spans['child']['traceId'] == parent.trace_id
+        assert spans['child']['parentSpanId'] == parent.span_id
+        assert 'parentSpanId' not in spans['parent']
+        assert spans['parent']['attributes'] == [{'key': 'session.id', 'value': {'stringValue': 's1'}}]
+        assert int(spans['child']['endTimeUnixNano']) >= int(spans['child']['startTimeUnixNano'])
+        assert exporter.payloads[0]['resourceSpans'][0]['resource']['attributes'][0]['key'] == 'service.name'
+
+    def test_exceptions_mark_the_span_failed(self, exporter):
+        """Test that an exception escaping a span is recorded as an error event."""
+        with pytest.raises(ValueError):
+            with tracer.span('failing'):
+                raise ValueError('bad gaze')
+        exporter.flush()
+
+        span = exporter.spans()[0]
+        assert span['status'] == {'code': STATUS_ERROR, 'message': 'bad gaze'}
+        assert span['events'][0]['name'] == 'exception'
+
+    def test_context_follows_async_tasks_and_threads(self, exporter):
+        """Test that spans started in tasks and worker threads are children of the caller's span."""
+        def work():
+            with tracer.span('worker'):
+                return 'done'
+
+        async def main():
+            with tracer.span('root'):
+                await asyncio.gather(asyncio.to_thread(work), traced('task', asyncio.sleep)(0))
+
+        asyncio.run(main())
+        exporter.flush()
+
+        spans = {span['name']: span for span in exporter.spans()}
+        assert spans['worker']['parentSpanId'] == spans['root']['spanId']
+        assert spans['task']['parentSpanId'] == spans['root']['spanId']
+
+    def test_full_queue_drops_spans(self):
+        """Test that spans are dropped rather than blocking when the exporter falls behind."""
+        processor = BatchSpanProcessor(ListExporter(), max_queue_size=1, flush_interval_seconds=60)
+        local = Tracer(processor)
+        for _ in range(3):
+            with local.span('s'):
+                pass
+
+        assert processor.dropped == 2
+
+    def test_file_exporter_writes_otlp_json_lines(self, tmp_path):
+        """Test that each exported batch is one JSON line."""
+        path = tmp_path / 'traces' / 'spans.jsonl'
+        processor = BatchSpanProcessor(FileSpanExporter(str(path)), flush_interval_seconds=60)
+        with Tracer(processor).span('s'):
+            pass
+        processor.flush()
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['resourceSpans'][0]['scopeSpans'][0]['spans'][0]['name'] == 's'
+
+
+class TestRequestTracing:
+    """Tests for install_tracing and spans on the workflow path."""
+
+    def test_incoming_traceparent_is_continued(self, exporter):
+        """Test that the request span joins the caller's trace and is returned in the response."""
+        app = Flask(__name__)
+        install_tracing(app)
+
+        @app.route('/work')
+        def work():
+            with tracer.span('stage'):
+                return 'ok'
+
+        response = app.test_client().get('/work', headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+        exporter.flush()
+
+        spans = {span['name']: span for span in exporter.spans()}
+        server = spans['GET /work']
+        assert server['traceId'] == TRACE_ID
+        assert server['parentSpanId'] == PARENT_ID
+        assert server['kind'] == SPAN_KIND_SERVER
+        assert spans['stage']['parentSpanId'] == server['spanId']
+        assert response.headers['traceparent'] == f"00-{TRACE_ID}-{server['spanId']}-01"
+
+    def test_workflow_spans(self, exporter, tmp_path):
+        """Test that run traces the workflow, each node, the model call and the session read and write."""
+        from llm import VRContextWorkflow
+        from app.utils.session_store import JSONFileSessionStore
+
+        use_fake_backends(FaultInjector('0'), FaultInjector('0'))
+        try:
+            workflow = VRContextWorkflow('key', session_store=JSONFileSessionStore(str(tmp_path)))
+            workflow.run('aW1hZ2U=', '1', 'PSU_Install', {"x": 0, "y": 0, "z": 1}, 'trace-session')
+        finally:
+            use_google_backends()
+        exporter.flush()
+
+        spans = {span['name']: span for span in exporter.spans()}
+        assert set(spans) == {'workflow.run', 'workflow.analyze_and_instruct', 'session.load', 'gemini.generate',
+                              'workflow.save_context', 'session.save'}
+        assert len({span['traceId'] for span in spans.values()}) == 1
+        assert spans['workflow.analyze_and_instruct']['parentSpanId'] == spans['workflow.run']['spanId']
+        assert spans['gemini.generate']['parentSpanId'] == spans['workflow.analyze_and_instruct']['spanId']
+        assert spans['session.load']['parentSpanId'] == spans['workflow.analyze_and_instruct']['spanId']
+        assert spans['session.save']['parentSpanId'] == spans['workflow.save_context']['spanId']